@@ -14,10 +14,54 @@ MENUS_DIR = os.path.join(DATA_DIR, "menus")
 DISCOUNTS_JSON = os.path.join(DATA_DIR, "discounts.json")
 FOLDERS_JSON = os.path.join(DATA_DIR, "folders.json")
 CUPONERAS_JSON = os.path.join(DATA_DIR, "cuponeras.json")
+# Usos particionados por mes: usage_YYYY-MM.json (snapshot) + usage_YYYY-MM.log (append-only)
+CUPONERA_USAGE_DIR = os.path.join(DATA_DIR, "cuponera_usage")
+CUPONERA_USAGE_ARCHIVE_DIR = os.path.join(CUPONERA_USAGE_DIR, "archive")
+USAGE_LOG_COMPACT_EVERY = int(os.getenv("USAGE_LOG_COMPACT_EVERY", "1000"))
+# Meses completos que se conservan además del actual (0 = no archivar)
+USAGE_RETENTION_MONTHS = int(os.getenv("USAGE_RETENTION_MONTHS", "0"))
+# Formato anterior (un solo archivo); se migra a particiones al arrancar
 CUPONERA_USAGE_JSON = os.path.join(DATA_DIR, "cuponera_usage.json")
+CUPONERA_USAGE_LOG = os.path.join(DATA_DIR, "cuponera_usage.log")
 CUPONERA_USERS_JSON = os.path.join(DATA_DIR, "cuponera_users.json")
 
+# Backend de almacenamiento: "json" (data/*.json) o "sqlite" (SQLITE_PATH, modo WAL).
+# Sedes y menús siempre se guardan como JSON (son copia del API externo).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH") or os.path.join(DATA_DIR, "cuponera.sqlite3")
+
+# Formato en disco (backend json): "json" (data/*.json, indentado) o "binary" (snapshot
+# <archivo>.bin con checksum; el .json se exporta cada STORAGE_JSON_EXPORT_SECONDS).
+STORAGE_FORMAT = os.getenv("STORAGE_FORMAT", "json").strip().lower()
+STORAGE_JSON_EXPORT_SECONDS = int(os.getenv("STORAGE_JSON_EXPORT_SECONDS", "60"))
+
+# Hilos para las escrituras de storage que se ejecutan desde código async (storage_async)
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", "4"))
+# Hilos del pool de AnyIO para las rutas síncronas (def) de la API y del pool de lecturas de storage_async
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", "40"))
+
+# Caché en memoria de archivos JSON (máximo de archivos; LRU, sobre todo menús por sede)
+STORAGE_CACHE_MAX_FILES = int(os.getenv("STORAGE_CACHE_MAX_FILES", "64"))
+
+# Respuestas guardadas (por worker) de canjes con Idempotency-Key: vigencia y máximo de claves
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "900"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+# Máximo de ítems por POST /redeem/batch
+REDEEM_BATCH_MAX_ITEMS = int(os.getenv("REDEEM_BATCH_MAX_ITEMS", "1000"))
+
 SITES_API_URL = "https://backend.salchimonster.com/sites"
 MENU_API_URL_TEMPLATE = "https://backend.salchimonster.com/tiendas/{site_id}/products-light"
 
 SYNC_INTERVAL_MINUTES = 10
+# Sincronización: peticiones simultáneas al API, timeout y reintentos
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "4"))
+SYNC_HTTP_TIMEOUT_SECONDS = float(os.getenv("SYNC_HTTP_TIMEOUT_SECONDS", "30"))
+SYNC_MAX_RETRIES = int(os.getenv("SYNC_MAX_RETRIES", "3"))
+SYNC_RETRY_BACKOFF_SECONDS = float(os.getenv("SYNC_RETRY_BACKOFF_SECONDS", "0.5"))
+# Planificador por sede: intervalo mínimo (menús que cambian seguido), espera máxima tras
+# fallos, jitter relativo de cada turno y antigüedad a partir de la cual un menú se reporta stale
+SYNC_MIN_INTERVAL_MINUTES = float(os.getenv("SYNC_MIN_INTERVAL_MINUTES", "2"))
+SYNC_MAX_BACKOFF_MINUTES = float(os.getenv("SYNC_MAX_BACKOFF_MINUTES", "60"))
+SYNC_JITTER_FRACTION = float(os.getenv("SYNC_JITTER_FRACTION", "0.2"))
+SYNC_STALE_MINUTES = float(os.getenv("SYNC_STALE_MINUTES", "30"))
@@ -0,0 +1,28 @@
+"""Eventos en proceso: los módulos con cachés derivadas se suscriben a cambios de datos.
+
+Eventos emitidos:
+- "sites_changed": la sincronización escribió sedes distintas.
+- "menu_changed" (site_id): la sincronización escribió un menú distinto para la sede.
+
+Solo alcanzan al proceso que escribe; los demás workers detectan el cambio por la firma
+del archivo (ver storage).
+"""
+import logging
+from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+_subscribers: dict[str, list[Callable[..., None]]] = {}
+
+
+def subscribe(event: str, callback: Callable[..., None]):
+    _subscribers.setdefault(event, []).append(callback)
+
+
+def emit(event: str, **payload):
+    """Llama a los suscriptores; un error en uno no impide a los demás."""
+    for callback in list(_subscribers.get(event, ())):
+        try:
+            callback(**payload)
+        except Exception:
+            logger.exception("Suscriptor de %s falló", event)
@@ -0,0 +1,52 @@
+"""Caché de respuestas por clave de idempotencia (TTL y tamaño máximo), en el proceso.
+
+La primera petición con una clave calcula la respuesta en una tarea propia: si el cliente
+se desconecta (timeout del POS) el canje termina igual y el reintento recibe la respuesta
+guardada. Un reintento que llega mientras la primera sigue en curso espera su resultado.
+Si el cálculo falla no se guarda nada y el siguiente intento vuelve a ejecutarlo.
+
+Es solo el camino rápido de cada worker: /redeem guarda además la clave con el uso en
+storage, que es lo que evita consumir dos veces si el reintento llega a otro worker.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+
+class IdempotencyCache:
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # clave -> (vence en time.monotonic(), tarea con la respuesta); en orden de creación
+        self._entries: OrderedDict[Hashable, tuple[float, asyncio.Future]] = OrderedDict()
+
+    def _evict(self, now: float):
+        """Quita las entradas vencidas y, si sobran, las más viejas (el TTL es igual para todas)."""
+        while self._entries:
+            expires, _ = next(iter(self._entries.values()))
+            if expires > now and len(self._entries) < self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def _forget_failed(self, key: Hashable, task: asyncio.Future):
+        if task.cancelled() or task.exception() is not None:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is task:
+                del self._entries[key]
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """(respuesta, True si es la guardada de una petición anterior con la misma clave)."""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return await asyncio.shield(entry[1]), True
+        self._evict(now)
+        task = asyncio.ensure_future(compute())
+        self._entries[key] = (now + self.ttl_seconds, task)
+        task.add_done_callback(lambda t: self._forget_failed(key, t))
+        return await asyncio.shield(task), False
+
+    def clear(self):
+        self._entries.clear()
@@ -1,22 +1,49 @@
 import asyncio
 from contextlib import asynccontextmanager
 
+import anyio.to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from routers import cuponeras, cuponera_users, discounts, folders, menus, redeem, sites
+from routers import cuponeras, cuponera_users, discounts, folders, menus, redeem, sites, sync
+import storage_async
+from config import API_THREADPOOL_SIZE, STORAGE_JSON_EXPORT_SECONDS
+from storage import archive_cuponera_usage, compact_cuponera_usage, flush_json_exports, queue_stale_json_exports
 from sync_service import run_sync_loop
 
 
+async def run_storage_maintenance_loop():
+    """
+    Exporta a JSON legible los archivos guardados como snapshot binario (STORAGE_FORMAT=binary)
+    y archiva las particiones de usos fuera de la retención (USAGE_RETENTION_MONTHS).
+    """
+    while True:
+        await asyncio.sleep(STORAGE_JSON_EXPORT_SECONDS)
+        await storage_async.flush_json_exports()
+        await storage_async.archive_cuponera_usage()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    task = asyncio.create_task(run_sync_loop())
+    # Hilos para las rutas síncronas (def); las async no ocupan este pool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    # Reconstruye la tabla de usos, vuelca los logs pendientes y archiva meses viejos
+    compact_cuponera_usage()
+    archive_cuponera_usage()
+    # Exportaciones JSON que quedaron atrás de su snapshot (p. ej. tras una caída)
+    if queue_stale_json_exports():
+        flush_json_exports()
+    tasks = [asyncio.create_task(run_sync_loop()), asyncio.create_task(run_storage_maintenance_loop())]
     yield
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    storage_async.drain()
+    flush_json_exports()
 
 
 app = FastAPI(
@@ -41,6 +68,7 @@ app.include_router(discounts.router)
 app.include_router(cuponeras.router)
 app.include_router(cuponera_users.router)
 app.include_router(redeem.router)
+app.include_router(sync.router)
 
 
 @app.get("/")
@@ -1,17 +1,25 @@
 """Catálogo de categorías y productos desde menús (para selects validados por backend)."""
-from storage import read_menu, read_sites_filtered
+import base64
+import heapq
+import json
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Iterator
+from itertools import islice
 
+from events import subscribe
+from menu_index import CatalogEntry, MenuIndex, entry_sort_key, matches_terms, search_tokens
+from storage import get_menu_index, read_sites_filtered
 
-def _normalize_id(value) -> str:
-    return str(value) if value is not None else ""
-
-
-def _product_name(prod: dict) -> str:
-    return (prod.get("producto_descripcion") or prod.get("english_name") or "").strip() or _normalize_id(prod.get("producto_id"))
+# Índices fusionados por tupla de sedes; se reconstruyen si cambia el índice de alguna sede
+_MERGED_MAX = 32
+_merged: OrderedDict[tuple[int, ...], tuple[tuple, MenuIndex]] = OrderedDict()
+_merged_lock = threading.Lock()
 
 
-def _category_name(cat: dict) -> str:
-    return (cat.get("categoria_descripcion") or cat.get("english_name") or "").strip() or _normalize_id(cat.get("categoria_id"))
+def _normalize_id(value) -> str:
+    return str(value) if value is not None else ""
 
 
 def _site_ids_resolved(site_ids: list[int] | None) -> list[int]:
@@ -20,114 +28,132 @@ def _site_ids_resolved(site_ids: list[int] | None) -> list[int]:
     return [s["site_id"] for s in read_sites_filtered() if s.get("site_id") is not None]
 
 
+def merged_menu_index(site_ids: list[int]) -> MenuIndex:
+    """Índice fusionado de los menús de las sedes (en ese orden; gana la primera sede)."""
+    key = tuple(site_ids)
+    parts = tuple(get_menu_index(site_id) for site_id in key)
+    with _merged_lock:
+        entry = _merged.get(key)
+        if entry is not None and len(entry[0]) == len(parts) and all(a is b for a, b in zip(entry[0], parts)):
+            _merged.move_to_end(key)
+            return entry[1]
+    merged = MenuIndex.merge([p for p in parts if p is not None])
+    with _merged_lock:
+        _merged[key] = (parts, merged)
+        _merged.move_to_end(key)
+        while len(_merged) > _MERGED_MAX:
+            _merged.popitem(last=False)
+    return merged
+
+
+def _forget_site(site_id: int):
+    """Descarta los índices fusionados que incluyen la sede (su menú cambió)."""
+    with _merged_lock:
+        for key in [k for k in _merged if site_id in k]:
+            del _merged[key]
+
+
+subscribe("menu_changed", _forget_site)
+
+
 def get_categories(site_ids: list[int] | None = None) -> list[dict]:
     """Lista única de categorías (id, name) de los menús de las sedes indicadas."""
-    resolved = _site_ids_resolved(site_ids)
-    seen: set[str] = set()
-    out: list[dict] = []
-    for site_id in resolved:
-        menu = read_menu(site_id)
-        if not menu:
-            continue
-        for cat in menu.get("categorias") or []:
-            cid = _normalize_id(cat.get("categoria_id"))
-            if not cid or cid in seen:
-                continue
-            seen.add(cid)
-            out.append({"id": cid, "name": _category_name(cat)})
+    index = merged_menu_index(_site_ids_resolved(site_ids))
+    out = [{"id": cid, "name": cat.display_name} for cid, cat in index.categories.items()]
     out.sort(key=lambda x: (x["name"].lower(), x["id"]))
     return out
 
 
-def get_products(
+def encode_cursor(entry: CatalogEntry) -> str:
+    """Cursor opaco con la clave de orden del último producto devuelto."""
+    raw = json.dumps(list(entry_sort_key(entry)), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Clave de orden de un cursor; ValueError si no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        name, pid = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("cursor inválido") from e
+    if not isinstance(name, str) or not isinstance(pid, str):
+        raise ValueError("cursor inválido")
+    return name, pid
+
+
+def iter_products(
     site_ids: list[int] | None = None,
     q: str | None = None,
-    limit: int = 20,
-    offset: int = 0,
     ids_to_include: list[str] | None = None,
-) -> tuple[list[dict], int]:
+    after: tuple[str, str] | None = None,
+) -> tuple[Iterator[CatalogEntry], int]:
     """
-    Lista de productos (id, name, category_id) de los menús de las sedes.
-    q: búsqueda en nombre/descripción (case-insensitive).
+    Productos (CatalogEntry: id, name, category_id) de los menús de las sedes en orden estable
+    (nombre, id), a partir de la clave `after` (excluida). Recorre el índice sin copiarlo.
+    q: términos de búsqueda; cada uno debe ser parte de alguna palabra del nombre
+    (sin distinguir mayúsculas ni tildes).
     ids_to_include: ids que deben aparecer en la respuesta (p. ej. ya seleccionados).
-    Devuelve (items, total_count).
+    Devuelve (iterador, total que cumple q sin contar el cursor).
     """
-    resolved = _site_ids_resolved(site_ids)
-    q_clean = (q or "").strip().lower()
-    # Recolectar todos los productos de las sedes (por sitio, pueden repetirse producto_id)
-    all_products: dict[str, dict] = {}
-    for site_id in resolved:
-        menu = read_menu(site_id)
-        if not menu:
-            continue
-        for cat in menu.get("categorias") or []:
-            cid = _normalize_id(cat.get("categoria_id"))
-            for prod in cat.get("products") or []:
-                pid = _normalize_id(prod.get("producto_id"))
-                if not pid:
-                    continue
-                name = _product_name(prod)
-                if pid not in all_products:
-                    all_products[pid] = {"id": pid, "name": name, "category_id": cid}
-            for prod in cat.get("products") or []:
-                for pres in prod.get("lista_presentacion") or []:
-                    pid = _normalize_id(pres.get("producto_id"))
-                    if not pid:
-                        continue
-                    if pid not in all_products:
-                        name = _product_name(prod) or pid
-                        all_products[pid] = {"id": pid, "name": name, "category_id": cid}
-
-    # Incluir siempre los ids_to_include (pueden no estar en all_products si son de otra sede)
+    index = merged_menu_index(_site_ids_resolved(site_ids))
+    search = index.search
+    terms = search_tokens(q)
+
+    # Incluir siempre los ids_to_include (pueden no estar en el catálogo si son de otra sede)
+    extra: dict[str, CatalogEntry] = {}
     if ids_to_include:
         for pid in ids_to_include:
             pid = _normalize_id(pid)
-            if pid and pid not in all_products:
-                all_products[pid] = {"id": pid, "name": pid, "category_id": ""}
-
-    items_list = list(all_products.values())
-    if q_clean:
-        items_list = [p for p in items_list if q_clean in (p.get("name") or "").lower()]
-    total = len(items_list)
-    items_list.sort(key=lambda x: (x.get("name") or "").lower())
-    page = items_list[offset : offset + limit]
-    return page, total
-    
-    # Recolectar todos los productos de las sedes (por sitio, pueden repetirse producto_id)
-    all_products: dict[str, dict] = {}
-    for site_id in resolved:
-        menu = read_menu(site_id)
-        if not menu:
-            continue
-        for cat in menu.get("categorias") or []:
-            cid = _normalize_id(cat.get("categoria_id"))
-            for prod in cat.get("products") or []:
-                pid = _normalize_id(prod.get("producto_id"))
-                if not pid:
-                    continue
-                name = _product_name(prod)
-                if pid not in all_products:
-                    all_products[pid] = {"id": pid, "name": name, "category_id": cid}
-            for prod in cat.get("products") or []:
-                for pres in prod.get("lista_presentacion") or []:
-                    pid = _normalize_id(pres.get("producto_id"))
-                    if not pid:
-                        continue
-                    if pid not in all_products:
-                        name = _product_name(prod) or pid
-                        all_products[pid] = {"id": pid, "name": name, "category_id": cid}
-
-    # Incluir siempre los all_ids_to_include (pueden no estar en all_products si son de otra sede)
-    if all_ids_to_include:
-        for pid in all_ids_to_include:
-            pid = _normalize_id(pid)
-            if pid and pid not in all_products:
-                all_products[pid] = {"id": pid, "name": pid, "category_id": ""}
-
-    items_list = list(all_products.values())
-    if q_clean:
-        items_list = [p for p in items_list if q_clean in (p.get("name") or "").lower()]
-    total = len(items_list)
-    items_list.sort(key=lambda x: (x.get("name") or "").lower())
-    page = items_list[offset : offset + limit]
-    return page, total
\ No newline at end of file
+            if pid and pid not in index.catalog and matches_terms(pid, terms):
+                extra[pid] = CatalogEntry(pid, pid, "")
+
+    ranks = search.match(terms)
+    start = search.start_after(after)
+    if ranks is None:
+        total = len(search.items)
+        positions = range(start, len(search.items))
+    else:
+        total = len(ranks)
+        positions = ranks[bisect_left(ranks, start):]
+    total += len(extra)
+    extras_sorted = sorted(
+        (e for e in extra.values() if after is None or entry_sort_key(e) > after),
+        key=entry_sort_key,
+    )
+    matched = (search.items[r] for r in positions)
+    return heapq.merge(matched, extras_sorted, key=entry_sort_key), total
+
+
+def get_products_by_ids(site_ids: list[int] | None, ids: list[str]) -> list[dict]:
+    """Productos con esos ids, en ese orden (los que no están en los menús van con el id como nombre)."""
+    index = merged_menu_index(_site_ids_resolved(site_ids))
+    out = []
+    for pid in dict.fromkeys(_normalize_id(i) for i in ids):
+        if pid:
+            entry = index.catalog.get(pid) or CatalogEntry(pid, pid, "")
+            out.append(entry.as_dict())
+    return out
+
+
+def get_products(
+    site_ids: list[int] | None = None,
+    q: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+    ids_to_include: list[str] | None = None,
+    cursor: str | None = None,
+) -> tuple[list[dict], int, str | None]:
+    """
+    Página de productos (ver iter_products). Con cursor se continúa después del último
+    producto de la página anterior; offset se aplica a partir de ahí.
+    Devuelve (items, total_count, next_cursor); next_cursor es None en la última página.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    products, total = iter_products(site_ids, q, ids_to_include, after)
+    entries = list(islice(products, offset, offset + limit + 1))
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1])
+    return [e.as_dict() for e in entries], total, next_cursor
@@ -0,0 +1,321 @@
+"""Índice de búsqueda por id sobre el menú de una sede (productos, categorías, presentaciones).
+
+Se construye una vez por versión del archivo del menú (al escribirlo con write_menu o al
+leerlo por primera vez) y storage lo mantiene residente por sede. Si una nueva versión del
+archivo tiene el mismo contenido (mismo content_hash) se reutiliza el índice.
+
+Representación compacta: solo se guardan los campos que usan el catálogo y el canje, en
+registros con __slots__ y strings internados. Los registros iguales se comparten entre sedes
+(un producto repetido en 20 sedes es un solo objeto), igual que el índice de búsqueda de
+catálogos idénticos, y el precio, que puede variar por sede, va en una columna array('d').
+"""
+import hashlib
+import json
+import re
+import sys
+import threading
+import unicodedata
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+def _normalize_id(value) -> str:
+    return str(value) if value is not None else ""
+
+
+def _intern(value: str) -> str:
+    return sys.intern(value) if value else ""
+
+
+def _price(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def menu_content_hash(menu: dict) -> str:
+    """Hash del contenido del menú (independiente del formato en disco)."""
+    payload = json.dumps(menu, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def normalize_text(text) -> str:
+    """Minúsculas y sin tildes ("Salchipápa" -> "salchipapa")."""
+    decomposed = unicodedata.normalize("NFKD", str(text or ""))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def search_tokens(text) -> list[str]:
+    return re.findall(r"\w+", normalize_text(text))
+
+
+def matches_terms(text, terms: list[str]) -> bool:
+    """True si cada término es parte de alguna palabra del texto (misma regla que ProductSearch)."""
+    tokens = search_tokens(text)
+    return all(any(term in token for token in tokens) for term in terms)
+
+
+class CatalogProduct:
+    """Producto para el canje; el precio no va aquí sino en la columna de precios de cada sede."""
+
+    __slots__ = ("product_id", "name", "image", "category_id", "__weakref__")
+
+    def __init__(self, product_id: str, name: str, image: str, category_id: str):
+        self.product_id = product_id
+        self.name = name
+        self.image = image
+        self.category_id = category_id
+
+    def redeem_info(self, price: float) -> dict:
+        return {
+            "product_id": self.product_id,
+            "name": self.name,
+            "price": price,
+            "image": self.image,
+            "category_id": self.category_id,
+        }
+
+
+class CatalogCategory:
+    """Categoría: name para el canje (categoria_nombre primero), display_name para los selects."""
+
+    __slots__ = ("category_id", "name", "display_name", "image", "__weakref__")
+
+    def __init__(self, category_id: str, name: str, display_name: str, image: str):
+        self.category_id = category_id
+        self.name = name
+        self.display_name = display_name
+        self.image = image
+
+    def redeem_info(self) -> dict:
+        return {"category_id": self.category_id, "name": self.name, "image": self.image}
+
+
+class CatalogEntry:
+    """Entrada del select de productos (producto o presentación, con el nombre del padre)."""
+
+    __slots__ = ("id", "name", "category_id", "__weakref__")
+
+    def __init__(self, id: str, name: str, category_id: str):
+        self.id = id
+        self.name = name
+        self.category_id = category_id
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "category_id": self.category_id}
+
+
+# (clase, *campos) -> registro compartido; se libera cuando ningún índice lo usa
+_records: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+# tupla de entradas del catálogo -> ProductSearch (sedes con el mismo catálogo)
+_searches: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_records_lock = threading.Lock()
+
+
+def _shared(cls, *fields):
+    key = (cls, *fields)
+    with _records_lock:
+        record = _records.get(key)
+        if record is None:
+            record = cls(*fields)
+            _records[key] = record
+        return record
+
+
+def _shared_search(entries) -> "ProductSearch":
+    """ProductSearch de esas entradas; sedes con el mismo catálogo comparten la misma."""
+    key = tuple(entries)
+    with _records_lock:
+        search = _searches.get(key)
+    if search is None:
+        search = ProductSearch(key)
+        with _records_lock:
+            search = _searches.setdefault(key, search)
+    return search
+
+
+def entry_sort_key(entry: CatalogEntry) -> tuple[str, str]:
+    """Orden estable del catálogo: nombre sin distinguir mayúsculas, luego id."""
+    return entry.name.lower(), entry.id
+
+
+class ProductSearch:
+    """
+    Búsqueda sobre los productos del catálogo: lista ordenada por nombre + índice invertido
+    de fragmentos de palabra normalizados (cada sufijo de cada palabra), así un término
+    encuentra las palabras que lo contienen con una búsqueda por prefijo (bisect).
+    Varios términos se combinan con AND.
+    """
+
+    __slots__ = ("items", "keys", "_keys", "_postings", "__weakref__")
+
+    def __init__(self, entries):
+        self.items: list[CatalogEntry] = sorted(entries, key=entry_sort_key)
+        self.keys = [entry_sort_key(e) for e in self.items]
+        postings: dict[str, list[int]] = {}
+        for rank, entry in enumerate(self.items):
+            for token in set(search_tokens(entry.name)):
+                for start in range(len(token)):
+                    ranks = postings.setdefault(token[start:], [])
+                    if not ranks or ranks[-1] != rank:
+                        ranks.append(rank)
+        self._keys = sorted(postings)
+        self._postings = [array("I", postings[k]) for k in self._keys]
+
+    def _term_ranks(self, term: str) -> set[int]:
+        lo = bisect_left(self._keys, term)
+        hi = bisect_left(self._keys, term + "\U0010ffff", lo)
+        ranks: set[int] = set()
+        for i in range(lo, hi):
+            ranks.update(self._postings[i])
+        return ranks
+
+    def start_after(self, key: tuple[str, str] | None) -> int:
+        """Primera posición con clave de orden mayor que key (paginación por cursor)."""
+        return 0 if key is None else bisect_right(self.keys, key)
+
+    def match(self, terms: list[str]) -> list[int] | None:
+        """Posiciones (en orden por nombre) de los productos que cumplen todos los términos; None = todos."""
+        if not terms:
+            return None
+        ranks: set[int] | None = None
+        for term in sorted(set(terms), key=len, reverse=True):  # el más largo suele ser el más selectivo
+            found = self._term_ranks(term)
+            ranks = found if ranks is None else ranks & found
+            if not ranks:
+                return []
+        return sorted(ranks)
+
+
+def product_display_name(prod: dict) -> str:
+    return (prod.get("producto_descripcion") or prod.get("english_name") or "").strip() or _normalize_id(prod.get("producto_id"))
+
+
+def category_display_name(cat: dict) -> str:
+    return (cat.get("categoria_descripcion") or cat.get("english_name") or "").strip() or _normalize_id(cat.get("categoria_id"))
+
+
+class MenuIndex:
+    """
+    Lookups por id de un menú (o de varios fusionados; gana la primera aparición):
+    - product_info / category_info: info para canje (dict nuevo en cada llamada)
+    - categories: category_id -> CatalogCategory
+    - catalog: product_id -> CatalogEntry para el select de productos (incluye presentaciones)
+    - product_ids / category_ids: ids existentes (incluye presentaciones) para validar scopes
+    - search: ProductSearch sobre catalog
+    - content_hash: hash del menú del que se construyó (vacío en índices fusionados)
+    """
+
+    __slots__ = (
+        "content_hash",
+        "_positions",
+        "_products",
+        "_prices",
+        "categories",
+        "presentations",
+        "catalog",
+        "product_ids",
+        "category_ids",
+        "search",
+    )
+
+    def __init__(self):
+        self.content_hash = ""
+        self._positions: dict[str, int] = {}  # product_id -> posición en _products / _prices
+        self._products: list[CatalogProduct] = []
+        self._prices = array("d")
+        self.categories: dict[str, CatalogCategory] = {}
+        self.presentations: dict[str, str] = {}  # producto_id de presentación -> producto padre
+        self.catalog: dict[str, CatalogEntry] = {}
+        self.product_ids: frozenset[str] = frozenset()
+        self.category_ids: frozenset[str] = frozenset()
+        self.search: ProductSearch | None = None
+
+    def product_info(self, product_id: str) -> dict | None:
+        pos = self._positions.get(product_id)
+        if pos is None:
+            return None
+        return self._products[pos].redeem_info(self._prices[pos])
+
+    def category_info(self, category_id: str) -> dict | None:
+        category = self.categories.get(category_id)
+        return category.redeem_info() if category else None
+
+    def _add_product(self, pid: str, product: CatalogProduct, price: float):
+        if pid not in self._positions:
+            self._positions[pid] = len(self._products)
+            self._products.append(product)
+            self._prices.append(price)
+
+    @classmethod
+    def build(cls, menu: dict, content_hash: str | None = None) -> "MenuIndex":
+        index = cls()
+        index.content_hash = content_hash if content_hash is not None else menu_content_hash(menu)
+        product_ids: set[str] = set()
+        category_ids: set[str] = set()
+        for cat in menu.get("categorias") or []:
+            raw_cid = cat.get("categoria_id")
+            cid = _intern(_normalize_id(raw_cid))
+            if raw_cid is not None:
+                category_ids.add(cid)
+            if cid and cid not in index.categories:
+                index.categories[cid] = _shared(
+                    CatalogCategory,
+                    cid,
+                    _intern((cat.get("categoria_nombre") or cat.get("categoria_descripcion") or "").strip()),
+                    _intern(category_display_name(cat)),
+                    _intern(cat.get("categoria_urlimagen") or ""),
+                )
+            products = cat.get("products") or []
+            for prod in products:
+                raw_pid = prod.get("producto_id")
+                if raw_pid is None:
+                    continue
+                pid = _intern(str(raw_pid))
+                product_ids.add(pid)
+                if pid not in index._positions:
+                    product = _shared(
+                        CatalogProduct,
+                        pid,
+                        _intern((prod.get("producto_descripcion") or prod.get("english_name") or "").strip()),
+                        _intern(prod.get("productogeneral_urlimagen") or ""),
+                        _intern(str(raw_cid or "")),
+                    )
+                    index._add_product(pid, product, _price(prod.get("productogeneral_precio")))
+                if pid and pid not in index.catalog:
+                    index.catalog[pid] = _shared(CatalogEntry, pid, _intern(product_display_name(prod)), cid)
+            for prod in products:
+                for pres in prod.get("lista_presentacion") or []:
+                    raw_pid = pres.get("producto_id")
+                    if raw_pid is None:
+                        continue
+                    pid = _intern(str(raw_pid))
+                    product_ids.add(pid)
+                    index.presentations.setdefault(pid, _intern(_normalize_id(prod.get("producto_id"))))
+                    if pid and pid not in index.catalog:
+                        name = _intern(product_display_name(prod) or pid)
+                        index.catalog[pid] = _shared(CatalogEntry, pid, name, cid)
+        index.product_ids = frozenset(product_ids)
+        index.category_ids = frozenset(category_ids)
+        index.search = _shared_search(index.catalog.values())
+        return index
+
+    @classmethod
+    def merge(cls, indexes: list["MenuIndex"]) -> "MenuIndex":
+        """Fusiona índices en orden (p. ej. de sedes): para cada id gana el primero."""
+        if len(indexes) == 1:
+            return indexes[0]
+        merged = cls()
+        for index in indexes:
+            for pid, pos in index._positions.items():
+                merged._add_product(pid, index._products[pos], index._prices[pos])
+            for attr in ("categories", "presentations", "catalog"):
+                target = getattr(merged, attr)
+                for key, value in getattr(index, attr).items():
+                    target.setdefault(key, value)
+        merged.product_ids = frozenset().union(*(i.product_ids for i in indexes))
+        merged.category_ids = frozenset().union(*(i.category_ids for i in indexes))
+        merged.search = ProductSearch(merged.catalog.values())
+        return merged
@@ -1,31 +1,16 @@
 """Validación de scope de descuentos contra menús de sedes."""
-from storage import list_menu_site_ids, read_menu, read_sites_filtered
+from storage import get_menu_index, list_menu_site_ids, read_sites_filtered
 
 
-def get_menu_product_and_category_ids(site_id: int) -> tuple[set[str], set[str]]:
-    """Devuelve (product_ids, category_ids) que existen en el menú de la sede."""
-    menu = read_menu(site_id)
-    if not menu:
-        return set(), set()
-    product_ids: set[str] = set()
-    category_ids: set[str] = set()
-    categorias = menu.get("categorias") or []
-    for cat in categorias:
-        cid = cat.get("categoria_id")
-        if cid is not None:
-            category_ids.add(str(cid))
-        for prod in cat.get("products") or []:
-            pid = prod.get("producto_id")
-            if pid is not None:
-                product_ids.add(str(pid))
-            if cid is not None:
-                category_ids.add(str(cat.get("categoria_id", "")))
-        for prod in cat.get("products") or []:
-            for pres in prod.get("lista_presentacion") or []:
-                pid = pres.get("producto_id")
-                if pid is not None:
-                    product_ids.add(str(pid))
-    return product_ids, category_ids
+def get_menu_product_and_category_ids(site_id: int) -> tuple[frozenset[str], frozenset[str]]:
+    """
+    Devuelve (product_ids, category_ids) que existen en el menú de la sede. Son los conjuntos
+    precalculados del índice del menú (compartidos: no mutar); solo cambian si cambia el contenido.
+    """
+    index = get_menu_index(site_id)
+    if index is None:
+        return frozenset(), frozenset()
+    return index.product_ids, index.category_ids
 
 
 def validate_discount_scope_for_sites(
@@ -122,6 +122,19 @@ class CuponeraUpdate(BaseModel):
     end_date: Optional[str] = None
 
 
+# --- Uso de un descuento en calendarios de cuponeras ---
+class DiscountCuponeraRef(BaseModel):
+    cuponera_id: str
+    cuponera_name: Optional[str] = None
+    dates: list[str] = Field(default_factory=list)  # fechas YYYY-MM-DD donde está programado
+
+
+class DiscountUsageInCuponeras(BaseModel):
+    discount_id: str
+    in_use: bool  # true si alguna cuponera lo tiene en su calendario
+    cuponeras: list[DiscountCuponeraRef] = Field(default_factory=list)
+
+
 # --- Folder (carpeta para agrupar descuentos y cuponeras) ---
 class Folder(BaseModel):
     id: str
@@ -322,3 +335,44 @@ class RedeemResponse(BaseModel):
     free_product: Optional[dict[str, Any]] = None  # info del producto gratis si el descuento es FREE_ITEM
     discount_categories: Optional[list[dict[str, Any]]] = None  # info de categorías si el descuento es CATEGORY_*
     discount_products: Optional[list[dict[str, Any]]] = None  # info de productos si el descuento es PRODUCT_*
+
+
+# --- Canje por lotes (POS / call center) ---
+class RedeemBatchItem(BaseModel):
+    code: str
+    use_date: Optional[str] = Field(None, alias="date")  # YYYY-MM-DD (por defecto hoy)
+    record_use: bool = False
+
+
+class RedeemBatchResult(BaseModel):
+    code: str
+    use_date: str = Field(..., alias="date")
+    response: Optional[RedeemResponse] = None  # igual que GET /redeem
+    error: Optional[str] = None  # el ítem no se pudo procesar (los demás sí)
+
+
+# --- Estado de la sincronización con el API externo ---
+class SyncTargetStatus(BaseModel):
+    last_attempt: Optional[str] = None
+    last_success: Optional[str] = None
+    last_change: Optional[str] = None  # última vez que el contenido cambió
+    duration_ms: Optional[float] = None  # duración del último intento
+    bytes: int = 0  # bytes descargados en el último intento (0 si no cambió)
+    error: Optional[str] = None  # error del último intento
+    consecutive_failures: int = 0
+    interval_seconds: float  # intervalo actual (se acorta si el contenido cambia seguido)
+    next_run_in_seconds: Optional[float] = None
+    staleness_seconds: Optional[float] = None  # antigüedad del último éxito
+    stale: bool = False  # sin éxito en más de SYNC_STALE_MINUTES
+
+
+class SiteSyncStatus(SyncTargetStatus):
+    site_id: int
+
+
+class SyncStatus(BaseModel):
+    generated_at: str
+    sites_list: SyncTargetStatus
+    sites: list[SiteSyncStatus] = Field(default_factory=list)
+    failing: int = 0  # sedes cuyo último intento falló
+    stale: int = 0
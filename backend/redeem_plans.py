@@ -0,0 +1,139 @@
+"""Plan del día por (cuponera, fecha): lo que /redeem responde igual a todos los usuarios.
+
+Un plan tiene los descuentos del calendario para esa fecha ya resueltos (RedeemDiscountItem)
+y la info de menú que necesitan (free_product, discount_categories, discount_products). Se
+compila en el primer canje y se reutiliza mientras no cambien sus entradas: el calendario de
+ese día y las sedes de la cuponera, los descuentos referenciados (se comparan por valor) y el
+índice de menú de las sedes (por identidad; cambia cuando cambia algún menú). Así un cambio
+hecho por otro worker también invalida el plan.
+"""
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from menu_catalog import merged_menu_index
+from menu_index import MenuIndex
+from models import RedeemDiscountItem
+from storage import get_discount, read_sites_filtered
+
+_PLANS_MAX = 1024
+_plans: OrderedDict[tuple[str, str], "DayPlan"] = OrderedDict()
+_plans_lock = threading.Lock()
+
+# tipo de descuento -> (incluye categorías del scope, incluye productos del scope)
+_SCOPE_INFO = {
+    "FREE_ITEM": (True, True),
+    "CATEGORY_PERCENT_OFF": (True, False),
+    "CATEGORY_AMOUNT_OFF": (True, False),
+    "BUY_M_PAY_N": (True, True),
+    "BUY_X_GET_Y_PERCENT_OFF": (True, True),
+    "PRODUCT_PERCENT_OFF": (False, True),
+    "PRODUCT_AMOUNT_OFF": (False, True),
+}
+
+
+class DayPlan:
+    """Respuesta compilada de /redeem para una cuponera y fecha (sin usuario ni usos)."""
+
+    def __init__(self, discount_ids: tuple[str, ...], site_ids: list[int] | None):
+        self.discount_ids = discount_ids
+        self.site_ids = site_ids
+        self.sources: list[dict | None] = []  # copia de cada descuento referenciado (None = no existe)
+        self.menu: MenuIndex | None = None  # índice usado para la info de menú (None = no se usó)
+        self.discounts: list[RedeemDiscountItem] = []
+        self.free_product: dict[str, Any] | None = None
+        self.discount_categories: list[dict[str, Any]] | None = None
+        self.discount_products: list[dict[str, Any]] | None = None
+
+
+def _resolve_site_ids(site_ids: list[int] | None) -> list[int]:
+    """Sedes de la cuponera; si no tiene, todas las sedes disponibles."""
+    if site_ids:
+        return site_ids
+    return [s["site_id"] for s in read_sites_filtered() if s.get("site_id")]
+
+
+def _day_inputs(cuponera: dict, date: str) -> tuple[tuple[str, ...], list[int] | None]:
+    calendar = cuponera.get("calendar") or {}
+    return tuple(calendar.get(date) or []), cuponera.get("site_ids")
+
+
+def _categories_info(index: MenuIndex, category_ids: list) -> list[dict]:
+    out = []
+    for cid in dict.fromkeys(str(c) for c in category_ids):
+        info = index.category_info(cid)
+        if info:
+            out.append(info)
+    return out
+
+
+def _products_info(index: MenuIndex, product_ids: list) -> list[dict]:
+    out = []
+    for pid in product_ids:
+        info = index.product_info(str(pid))
+        if info:
+            out.append(info)
+    return out
+
+
+def compile_day_plan(cuponera: dict, date: str) -> DayPlan:
+    """Resuelve los descuentos del día y la info de menú de sus scopes (si varios la aportan, gana el último)."""
+    discount_ids, site_ids = _day_inputs(cuponera, date)
+    plan = DayPlan(discount_ids, site_ids)
+    menu: MenuIndex | None = None
+    for did in discount_ids:
+        discount = get_discount(did)
+        plan.sources.append(copy.deepcopy(discount))
+        if not discount:
+            continue
+        plan.discounts.append(RedeemDiscountItem(discount_id=did, discount=discount))
+        with_categories, with_products = _SCOPE_INFO.get(discount.get("type") or "", (False, False))
+        scope = discount.get("scope") or {}
+        free_item = ((discount.get("params") or {}).get("free_item") or {}) if discount.get("type") == "FREE_ITEM" else {}
+        category_ids = (scope.get("category_ids") or []) if scope.get("scope_type") == "CATEGORY_IDS" else []
+        product_ids = scope.get("product_ids") or []
+        if not (free_item.get("product_id") or (with_categories and category_ids) or (with_products and product_ids)):
+            continue
+        if menu is None:
+            menu = merged_menu_index(_resolve_site_ids(site_ids))
+        if free_item.get("product_id"):
+            info = menu.product_info(str(free_item["product_id"]))
+            if info:
+                info["max_qty"] = (discount.get("limits") or {}).get("max_free_qty", 1)
+                plan.free_product = info
+        if with_categories and category_ids:
+            plan.discount_categories = _categories_info(menu, category_ids)
+        if with_products and product_ids:
+            products = _products_info(menu, product_ids)
+            if products:
+                plan.discount_products = products
+    plan.menu = menu
+    return plan
+
+
+def _is_current(plan: DayPlan, cuponera: dict, date: str) -> bool:
+    if (plan.discount_ids, plan.site_ids) != _day_inputs(cuponera, date):
+        return False
+    if any(get_discount(did) != source for did, source in zip(plan.discount_ids, plan.sources)):
+        return False
+    return plan.menu is None or merged_menu_index(_resolve_site_ids(plan.site_ids)) is plan.menu
+
+
+def get_day_plan(cuponera: dict, date: str) -> DayPlan:
+    """Plan del día de la cuponera (compilado o reutilizado si sus entradas no cambiaron)."""
+    key = (str(cuponera.get("id") or ""), date)
+    with _plans_lock:
+        plan = _plans.get(key)
+    if plan is not None and _is_current(plan, cuponera, date):
+        with _plans_lock:
+            if key in _plans:
+                _plans.move_to_end(key)
+        return plan
+    plan = compile_day_plan(cuponera, date)
+    with _plans_lock:
+        _plans[key] = plan
+        _plans.move_to_end(key)
+        while len(_plans) > _PLANS_MAX:
+            _plans.popitem(last=False)
+    return plan
@@ -6,11 +6,12 @@ from fastapi import APIRouter, HTTPException
 from models import CuponeraUser, CuponeraUserCreate, CuponeraUserUpdate
 from storage import (
     delete_cuponera_user as storage_delete_cuponera_user,
+    find_cuponera_users_by_code,
     get_cuponera,
     get_cuponera_user,
     insert_cuponera_user,
-    read_cuponeras,
     read_cuponera_users,
+    transaction,
     update_cuponera_user as storage_update_cuponera_user,
 )
 from utils import new_id, new_user_code, now_iso
@@ -37,14 +38,10 @@ def _is_code_used_in_vigent_cuponera(code: str, exclude_user_id: str | None = No
     if not code_upper:
         return False
     today = date.today().isoformat()
-    users = read_cuponera_users()
-    cuponeras = {c["id"]: c for c in read_cuponeras() if c.get("id")}  # read_cuponeras for bulk
-    for u in users:
+    for u in find_cuponera_users_by_code(code_upper):
         if u.get("id") == exclude_user_id:
             continue
-        if (u.get("code") or "").strip().upper() != code_upper:
-            continue
-        cuponera = cuponeras.get(u.get("cuponera_id") or "")
+        cuponera = get_cuponera(u.get("cuponera_id") or "")
         if cuponera and _is_cuponera_vigent(cuponera, today):
             return True
     return False
@@ -140,7 +137,17 @@ def register_cuponera_user(cuponera_id: str, body: CuponeraUserCreate):
         "address": (body.address or "").strip() or None,
         "created_at": now,
     }
-    return insert_cuponera_user(doc)
+    # Re-verificar bajo lock: un registro concurrente pudo tomar el mismo código
+    with transaction("cuponera_users"):
+        if _is_code_used_in_vigent_cuponera(doc["code"]):
+            if code_raw:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Este código ya está en uso en una cuponera vigente. Use otro código o deje vacío para que el sistema genere uno.",
+                )
+            while _is_code_used_in_vigent_cuponera(doc["code"]):
+                doc["code"] = new_user_code(8)
+        return insert_cuponera_user(doc)
 
 
 @router.get("/{cuponera_id}/users/{user_id}", response_model=CuponeraUser)
@@ -238,7 +245,13 @@ def update_cuponera_user_route(cuponera_id: str, user_id: str, body: CuponeraUse
 
     upd = {k: v for k, v in doc.items() if k not in ("id", "cuponera_id", "created_at")}
     upd["updated_at"] = now_iso()
-    result = storage_update_cuponera_user(cuponera_id, user_id, upd)
+    with transaction("cuponera_users"):
+        if body.code is not None and _is_code_used_in_vigent_cuponera(doc.get("code"), exclude_user_id=user_id):
+            raise HTTPException(
+                status_code=400,
+                detail="Este código ya está en uso en una cuponera vigente.",
+            )
+        result = storage_update_cuponera_user(cuponera_id, user_id, upd)
     return result
 
 
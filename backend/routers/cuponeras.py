@@ -7,9 +7,8 @@ from storage import (
     get_cuponera,
     insert_cuponera,
     read_cuponeras,
-    read_cuponera_usage,
+    reset_cuponera_usage,
     update_cuponera,
-    write_cuponera_usage,
 )
 from utils import new_id, now_iso
 
@@ -88,18 +87,5 @@ def reset_usage(
     if not date_str or len(date_str) < 10:
         raise HTTPException(status_code=400, detail="date requerido (YYYY-MM-DD)")
 
-    cuponera_id_str = str(cuponera_id)
-    usage_list = read_cuponera_usage()
-    new_list = []
-    found = False
-    for rec in usage_list:
-        rec_cid = str(rec.get("cuponera_id") or "")
-        rec_code = (rec.get("user_code") or "").strip().upper()
-        rec_date = str(rec.get("date") or "")
-        if rec_cid == cuponera_id_str and rec_code == code_upper and rec_date == date_str:
-            found = True
-            continue
-        new_list.append(rec)
-    if found:
-        write_cuponera_usage(new_list)
+    found = reset_cuponera_usage(cuponera_id, code_upper, date_str)
     return {"ok": True, "message": "Usos reseteados para esa fecha.", "had_record": found}
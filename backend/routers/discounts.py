@@ -3,8 +3,22 @@ from fastapi import APIRouter, HTTPException
 
 from discount_validation import validate_discount_by_type
 from menu_validation import validate_discount_scope_full
-from models import DiscountRule, DiscountRuleCreate, DiscountRuleUpdate
-from storage import delete_discount, get_discount, insert_discount, read_discounts, update_discount
+from models import (
+    DiscountCuponeraRef,
+    DiscountRule,
+    DiscountRuleCreate,
+    DiscountRuleUpdate,
+    DiscountUsageInCuponeras,
+)
+from storage import (
+    delete_discount,
+    get_cuponera,
+    get_discount,
+    get_discount_cuponera_dates,
+    insert_discount,
+    read_discounts,
+    update_discount,
+)
 from utils import new_id, now_iso
 
 router = APIRouter(prefix="/discounts", tags=["discounts"])
@@ -23,6 +37,22 @@ def get_discount_route(discount_id: str):
     return d
 
 
+@router.get("/{discount_id}/usage-in-cuponeras", response_model=DiscountUsageInCuponeras)
+def discount_usage_in_cuponeras(discount_id: str):
+    """Cuponeras y fechas donde está programado el descuento (p. ej. para avisar antes de borrarlo)."""
+    if not get_discount(discount_id):
+        raise HTTPException(status_code=404, detail="Descuento no encontrado")
+    refs = []
+    for cuponera_id, dates in get_discount_cuponera_dates(discount_id).items():
+        c = get_cuponera(cuponera_id)
+        refs.append(DiscountCuponeraRef(
+            cuponera_id=cuponera_id,
+            cuponera_name=c.get("name") if c else None,
+            dates=dates,
+        ))
+    return DiscountUsageInCuponeras(discount_id=discount_id, in_use=bool(refs), cuponeras=refs)
+
+
 @router.post("", response_model=DiscountRule, status_code=201)
 def create_discount(body: DiscountRuleCreate):
     site_ids = body.site_ids
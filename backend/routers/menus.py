@@ -1,18 +1,46 @@
-"""Menús por sede y catálogo (categorías/productos) para selects con limit/offset y búsqueda."""
-from fastapi import APIRouter, HTTPException, Query
+"""Menús por sede y catálogo (categorías/productos) para selects con paginación por cursor y búsqueda."""
+import gzip
+import json
+from itertools import islice
 
-from menu_catalog import get_categories, get_products
-from storage import read_menu
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from menu_catalog import decode_cursor, get_categories, get_products, get_products_by_ids, iter_products
+from storage import get_menu_gzip
 
 router = APIRouter(prefix="/menus", tags=["menus"])
 
+PRODUCTS_PAGE_SIZE = 100
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
 
 @router.get("/site/{site_id}")
-def get_menu(site_id: int):
-    menu = read_menu(site_id)
-    if menu is None:
+def get_menu(site_id: int, request: Request):
+    """
+    Menú de la sede servido desde la copia comprimida guardada al sincronizar (sin parsear).
+    ETag fuerte por contenido; If-None-Match igual responde 304.
+    """
+    served = get_menu_gzip(site_id)
+    if served is None:
         raise HTTPException(status_code=404, detail="Menú no encontrado para esta sede")
-    return menu
+    gz_path, content_hash = served
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "").lower()
+    etag = f'"{content_hash}-gz"' if accepts_gzip else f'"{content_hash}"'
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if accepts_gzip:
+        return FileResponse(gz_path, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    with gzip.open(gz_path, "rb") as f:
+        return Response(f.read(), media_type="application/json", headers=headers)
 
 
 @router.get("/categories")
@@ -31,13 +59,19 @@ def list_categories(
 
 @router.get("/products")
 def list_products(
+    request: Request,
     site_ids: str | None = Query(None, description="IDs de sedes separados por coma; vacío = todas"),
-    q: str | None = Query(None, description="Búsqueda en nombre/descripción"),
-    limit: int | None = Query(None, ge=1, le=10000, description="Límite de resultados (opcional, si no se especifica devuelve todos)"),
-    offset: int = Query(0, ge=0),
+    q: str | None = Query(None, description="Búsqueda por palabras del nombre (sin distinguir tildes ni mayúsculas)"),
+    limit: int | None = Query(None, ge=1, le=10000, description=f"Tamaño de página (por defecto {PRODUCTS_PAGE_SIZE}; en streaming, sin límite)"),
+    offset: int = Query(0, ge=0, description="Productos a saltar (preferir cursor)"),
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
     ids: str | None = Query(None, description="IDs de productos a incluir siempre (p. ej. ya seleccionados), separados por coma"),
+    only_ids: bool = Query(False, description="Solo los productos de ids, en ese orden (p. ej. nombres de los ya seleccionados)"),
 ):
-    """Lista de productos con paginación opcional y búsqueda. Si no se especifica limit, devuelve todos los productos."""
+    """
+    Lista de productos ordenada por (nombre, id) con paginación por cursor y búsqueda.
+    Con `Accept: application/x-ndjson` se envía un producto por línea a medida que se recorre el índice.
+    """
     sid_list = None
     if site_ids and site_ids.strip():
         try:
@@ -47,8 +81,26 @@ def list_products(
     ids_include = None
     if ids and ids.strip():
         ids_include = [x.strip() for x in ids.split(",") if x.strip()]
-    
-    # Si no se especifica limit, usar un valor muy alto para obtener todos
-    actual_limit = limit if limit is not None else 999999
-    items, total = get_products(site_ids=sid_list, q=q, limit=actual_limit, offset=offset, ids_to_include=ids_include)
-    return {"items": items, "total": total}
+    if only_ids:
+        items = get_products_by_ids(sid_list, ids_include or [])
+        return {"items": items, "total": len(items), "next_cursor": None}
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        products, total = iter_products(site_ids=sid_list, q=q, ids_to_include=ids_include, after=after)
+        products = islice(products, offset, offset + limit if limit is not None else None)
+        lines = (json.dumps(p.as_dict(), ensure_ascii=False) + "\n" for p in products)
+        return StreamingResponse(lines, media_type="application/x-ndjson", headers={"X-Total-Count": str(total)})
+
+    items, total, next_cursor = get_products(
+        site_ids=sid_list,
+        q=q,
+        limit=limit if limit is not None else PRODUCTS_PAGE_SIZE,
+        offset=offset,
+        ids_to_include=ids_include,
+        cursor=cursor,
+    )
+    return {"items": items, "total": total, "next_cursor": next_cursor}
@@ -1,10 +1,26 @@
-"""Canjear código de cuponera: obtener descuentos del día y registrar uso."""
+"""Canjear código de cuponera: obtener descuentos del día y registrar uso (uno o por lotes)."""
+import logging
 from datetime import date
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Response
 
-from models import RedeemDiscountItem, RedeemResponse, RedeemUserInfo
-from storage import read_cuponeras, read_cuponera_usage, read_cuponera_users, read_discounts, write_cuponera_usage, read_menu
+import storage_async
+from config import IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS, REDEEM_BATCH_MAX_ITEMS
+from idempotency import IdempotencyCache
+from models import RedeemBatchItem, RedeemBatchResult, RedeemResponse, RedeemUserInfo
+from redeem_plans import DayPlan, get_day_plan
+from storage import (
+    consume_cuponera_usage_many,
+    find_cuponera_users_by_code,
+    get_cuponera,
+    get_cuponera_usage_count,
+)
+
+logger = logging.getLogger(__name__)
+
+# Respuestas de canjes con record_use por (Idempotency-Key, código, fecha) en este worker; la
+# clave también queda guardada con el uso en storage (reintentos en otro worker o tras reiniciar)
+_idempotent = IdempotencyCache(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS)
 
 router = APIRouter(prefix="", tags=["redeem"])
 
@@ -22,294 +38,213 @@ def _is_cuponera_vigent(cuponera: dict, today: str) -> bool:
     return True
 
 
-def _get_product_info(product_id: str, site_ids: list[int] | None) -> dict | None:
-    """Busca info del producto en los menús de las sedes especificadas."""
-    if not product_id:
-        return None
-    
-    # Si no hay site_ids, buscar en todas las sedes disponibles
-    from storage import read_sites_filtered
-    if not site_ids:
-        site_ids = [s["site_id"] for s in read_sites_filtered() if s.get("site_id")]
-    
-    for site_id in site_ids:
-        menu = read_menu(site_id)
-        if not menu:
-            continue
-        
-        for cat in menu.get("categorias") or []:
-            for prod in cat.get("products") or []:
-                if str(prod.get("producto_id")) == str(product_id):
-                    return {
-                        "product_id": str(product_id),
-                        "name": (prod.get("producto_descripcion") or prod.get("english_name") or "").strip(),
-                        "price": float(prod.get("productogeneral_precio") or 0),
-                        "image": prod.get("productogeneral_urlimagen") or "",
-                        "category_id": str(cat.get("categoria_id") or ""),
-                    }
-    
-    return None
-
-
-def _get_categories_info(category_ids: list[str], site_ids: list[int] | None) -> list[dict]:
-    """Busca info de las categorías en los menús de las sedes especificadas."""
-    if not category_ids:
-        return []
-    
-    from storage import read_sites_filtered
-    if not site_ids:
-        site_ids = [s["site_id"] for s in read_sites_filtered() if s.get("site_id")]
-    
-    categories_found = {}
-    category_ids_set = set(str(cid) for cid in category_ids)
-    
-    for site_id in site_ids:
-        menu = read_menu(site_id)
-        if not menu:
-            continue
-        
-        for cat in menu.get("categorias") or []:
-            cat_id = str(cat.get("categoria_id") or "")
-            if cat_id in category_ids_set and cat_id not in categories_found:
-                categories_found[cat_id] = {
-                    "category_id": cat_id,
-                    "name": (cat.get("categoria_nombre") or cat.get("categoria_descripcion") or "").strip(),
-                    "image": cat.get("categoria_urlimagen") or "",
-                }
-        
-        # Si ya encontramos todas las categorías, salir
-        if len(categories_found) == len(category_ids_set):
-            break
-    
-    return list(categories_found.values())
+def _find_user_cuponera(code_upper: str, today: str) -> tuple[dict, dict] | RedeemResponse:
+    """(usuario, cuponera vigente) del código, o la respuesta de error si no hay cuponera vigente."""
+    # Usuarios con este código y su cuponera (índice por código normalizado)
+    user_cuponeras = []
+    for u in find_cuponera_users_by_code(code_upper):
+        c = get_cuponera(u.get("cuponera_id") or "")
+        if c:
+            user_cuponeras.append((u, c))
+
+    # Buscar usuario + cuponera vigente (si el código está en varias cuponeras, priorizar la vigente)
+    vigent_candidates = [(u, c) for u, c in user_cuponeras if _is_cuponera_vigent(c, today)]
+    if vigent_candidates:
+        return vigent_candidates[0]
+
+    # Código no existe o no tiene cuponera vigente
+    for u, c in user_cuponeras:
+        if not c.get("active"):
+            return RedeemResponse(success=False, message="Cuponera no activa")
+        start_date = (c.get("start_date") or "").strip()
+        end_date = (c.get("end_date") or "").strip()
+        if start_date and today < start_date:
+            return RedeemResponse(
+                success=False,
+                message=f"La cuponera aún no ha comenzado. Vigencia desde el {start_date}.",
+            )
+        if end_date and today > end_date:
+            return RedeemResponse(
+                success=False,
+                message=f"La cuponera ya finalizó. Vigencia hasta el {end_date}. Puede renovar al cliente en una cuponera vigente con el mismo código.",
+            )
+    return RedeemResponse(success=False, message="Código no válido o no hay cuponera vigente para este código")
+
+
+def _user_info(user: dict) -> RedeemUserInfo:
+    """Datos del usuario con nombre dividido y phone_code."""
+    full_name = (user.get("name") or "").strip()
+    first_name = user.get("first_name") or ""
+    last_name = user.get("last_name") or ""
+
+    # Si no hay first_name/last_name pero hay name, dividir el nombre completo
+    if not first_name and not last_name and full_name:
+        name_parts = full_name.split(None, 1)  # Divide en 2 partes máximo
+        first_name = name_parts[0] if len(name_parts) > 0 else ""
+        last_name = name_parts[1] if len(name_parts) > 1 else ""
+
+    return RedeemUserInfo(
+        name=full_name,
+        first_name=first_name,
+        last_name=last_name,
+        phone=user.get("phone") or "",
+        phone_code=user.get("phone_code") or "+57",  # Default a Colombia si no está especificado
+        email=user.get("email") or "",
+        address=user.get("address") or "",
+    )
+
+
+def _uses_per_day(cuponera: dict) -> int:
+    # Normalizar tipos por si MongoDB/JSON devuelve otro tipo
+    return int(cuponera.get("uses_per_day") or 1)
+
+
+def _no_discounts_response(user: dict, cuponera: dict) -> RedeemResponse:
+    return RedeemResponse(
+        success=True,
+        message="No hay descuentos configurados para esta fecha.",
+        cuponera_name=cuponera.get("name"),
+        discounts=[],
+        uses_remaining_today=0,
+        user=_user_info(user),
+        cuponera_site_ids=cuponera.get("site_ids"),  # null = todas las sedes
+    )
+
+
+def _day_response(user: dict, cuponera: dict, plan: DayPlan, current_count: int) -> RedeemResponse:
+    return RedeemResponse(
+        success=True,
+        message="Descuentos del día.",
+        cuponera_name=cuponera.get("name"),
+        discounts=plan.discounts,
+        uses_remaining_today=max(0, _uses_per_day(cuponera) - current_count),
+        user=_user_info(user),
+        cuponera_site_ids=cuponera.get("site_ids"),  # null = todas las sedes
+        free_product=plan.free_product,
+        discount_categories=plan.discount_categories,
+        discount_products=plan.discount_products,
+    )
+
+
+def _lookup(code_upper: str, today: str, with_count: bool) -> tuple[tuple[dict, dict] | RedeemResponse, DayPlan | None, int]:
+    """Parte de lectura del canje: (usuario y cuponera o respuesta de error, plan del día, usos del día si with_count)."""
+    found = _find_user_cuponera(code_upper, today)
+    if isinstance(found, RedeemResponse):
+        return found, None, 0
+    user, cuponera = found
+    # Descuentos del día e info de menú: iguales para todos los usuarios (plan compilado)
+    plan = get_day_plan(cuponera, today)
+    count = 0
+    if with_count and plan.discount_ids:
+        count = get_cuponera_usage_count(str(cuponera.get("id") or ""), code_upper, today)
+    return found, plan, count
+
+
+async def _redeem(code_upper: str, today: str, record_use: bool, request_key: str | None = None) -> tuple[RedeemResponse, bool]:
+    """(respuesta, repetida): repetida si request_key ya había consumido un uso (en cualquier worker)."""
+    # Lecturas (cachés en memoria, que se recargan si el archivo cambió) en el pool de lecturas
+    # de storage, sin ocupar hilos del pool de rutas síncronas ni de las escrituras
+    found, plan, current_count = await storage_async.run_read(_lookup, code_upper, today, not record_use)
+    if isinstance(found, RedeemResponse):
+        return found, False
+    user, cuponera = found
+    if not plan.discount_ids:
+        return _no_discounts_response(user, cuponera), False
+
+    # Consumir es una sola operación atómica (incrementa solo si no llegó al límite del día):
+    # dos canjes simultáneos no pueden pasar ambos el límite. Los consumos concurrentes se
+    # escriben juntos. La clave de idempotencia se guarda con el uso: un reintento con la misma
+    # clave recibe el total de ese uso sin consumir otro.
+    replayed = False
+    if record_use:
+        cuponera_id_str = str(cuponera.get("id") or "")
+        _, current_count, replayed = await storage_async.consume_cuponera_usage(
+            cuponera_id_str, code_upper, str(today or ""), _uses_per_day(cuponera), request_key
+        )
+    return _day_response(user, cuponera, plan, current_count), replayed
 
 
 @router.get("/redeem", response_model=RedeemResponse)
-def redeem_code(
+async def redeem_code(
+    response: Response,
     code: str = Query(..., description="Código del usuario en la cuponera"),
     use_date: str | None = Query(None, alias="date", description="Fecha YYYY-MM-DD (por defecto hoy)"),
     record_use: bool = Query(False, description="Si true, registra un uso para hoy (consumir una de las veces del día)"),
+    idempotency_key: str | None = Query(None, description="Alternativa al header Idempotency-Key"),
+    idempotency_header: str | None = Header(None, alias="Idempotency-Key", description="Clave única del intento de canje (reintentos del POS)"),
 ):
-    """Devuelve los descuentos del día para el código. Si el código pertenece a varias cuponeras (pasadas y vigente), devuelve la cuponera vigente."""
+    """
+    Devuelve los descuentos del día para el código. Si el código pertenece a varias cuponeras (pasadas y vigente), devuelve la cuponera vigente.
+    Con record_use e Idempotency-Key, los reintentos con la misma clave (mismo código y fecha) no consumen
+    otro uso (header Idempotent-Replayed): la clave se guarda con el uso en storage, así vale entre workers
+    y reinicios, y dentro de IDEMPOTENCY_TTL_SECONDS el mismo worker devuelve la respuesta guardada sin
+    volver a calcularla.
+    """
     today = use_date or date.today().isoformat()
     code_upper = (code or "").strip().upper()
     if not code_upper:
         raise HTTPException(status_code=400, detail="Código requerido")
 
-    users = read_cuponera_users()
-    cuponeras = read_cuponeras()
-    cuponera_map = {c.get("id"): c for c in cuponeras if c.get("id")}
-
-    # Buscar usuario + cuponera vigente (si el código está en varias cuponeras, priorizar la vigente)
-    user = None
-    cuponera = None
-    vigent_candidates = []
-    for u in users:
-        if (u.get("code") or "").strip().upper() != code_upper:
-            continue
-        c = cuponera_map.get(u.get("cuponera_id") or "")
-        if not c:
+    key = (idempotency_header or idempotency_key or "").strip()
+    if not (record_use and key):
+        result, _ = await _redeem(code_upper, today, record_use)
+        return result
+    (result, stored), cached = await _idempotent.run((key, code_upper, today), lambda: _redeem(code_upper, today, True, key))
+    if cached or stored:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@router.post("/redeem/batch", response_model=list[RedeemBatchResult])
+def redeem_batch(items: list[RedeemBatchItem] = Body(..., description="Códigos a validar o canjear, en orden")):
+    """
+    Igual que GET /redeem para cada ítem, en una sola petición: cada plan del día se resuelve
+    una vez por lote y todos los usos (record_use) se registran en una sola escritura, en el
+    orden de los ítems. Un ítem que falla lleva `error` y no impide procesar los demás.
+    """
+    if len(items) > REDEEM_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo {REDEEM_BATCH_MAX_ITEMS} ítems por lote")
+    results: list[RedeemBatchResult | None] = [None] * len(items)
+    plans: dict[tuple[str, str], DayPlan] = {}
+    pending = []  # (posición, usuario, cuponera, plan, (cuponera_id, código, fecha, límite o None))
+    for i, item in enumerate(items):
+        today = item.use_date or date.today().isoformat()
+        code_upper = (item.code or "").strip().upper()
+        if not code_upper:
+            results[i] = RedeemBatchResult(code=item.code, date=today, error="Código requerido")
             continue
-        if _is_cuponera_vigent(c, today):
-            vigent_candidates.append((u, c))
-    if vigent_candidates:
-        user, cuponera = vigent_candidates[0]
-        cuponera_id = cuponera.get("id")
-    else:
-        # Código no existe o no tiene cuponera vigente
-        for u in users:
-            if (u.get("code") or "").strip().upper() == code_upper:
-                c = cuponera_map.get(u.get("cuponera_id") or "")
-                if c and not c.get("active"):
-                    return RedeemResponse(success=False, message="Cuponera no activa")
-                if c:
-                    start_date = (c.get("start_date") or "").strip()
-                    end_date = (c.get("end_date") or "").strip()
-                    if start_date and today < start_date:
-                        return RedeemResponse(
-                            success=False,
-                            message=f"La cuponera aún no ha comenzado. Vigencia desde el {start_date}.",
-                        )
-                    if end_date and today > end_date:
-                        return RedeemResponse(
-                            success=False,
-                            message=f"La cuponera ya finalizó. Vigencia hasta el {end_date}. Puede renovar al cliente en una cuponera vigente con el mismo código.",
-                        )
-        return RedeemResponse(success=False, message="Código no válido o no hay cuponera vigente para este código")
-
-    calendar = cuponera.get("calendar") or {}
-    discount_ids = calendar.get(today) or []
-    
-    # Construir user_info con nombre dividido y phone_code
-    user_info = None
-    if user:
-        full_name = (user.get("name") or "").strip()
-        first_name = user.get("first_name") or ""
-        last_name = user.get("last_name") or ""
-        
-        # Si no hay first_name/last_name pero hay name, dividir el nombre completo
-        if not first_name and not last_name and full_name:
-            name_parts = full_name.split(None, 1)  # Divide en 2 partes máximo
-            first_name = name_parts[0] if len(name_parts) > 0 else ""
-            last_name = name_parts[1] if len(name_parts) > 1 else ""
-        
-        user_info = RedeemUserInfo(
-            name=full_name,
-            first_name=first_name,
-            last_name=last_name,
-            phone=user.get("phone") or "",
-            phone_code=user.get("phone_code") or "+57",  # Default a Colombia si no está especificado
-            email=user.get("email") or "",
-            address=user.get("address") or "",
-        )
-
-    cuponera_site_ids = cuponera.get("site_ids")  # null = todas las sedes
-
-    if not discount_ids:
-        return RedeemResponse(
-            success=True,
-            message="No hay descuentos configurados para esta fecha.",
-            cuponera_name=cuponera.get("name"),
-            discounts=[],
-            uses_remaining_today=0,
-            user=user_info,
-            cuponera_site_ids=cuponera_site_ids,
-        )
-
-    # Obtener reglas de descuento
-    all_discounts = read_discounts()
-    discount_map = {d.get("id"): d for d in all_discounts if d.get("id")}
-    discounts_for_day = []
-    free_product_info = None
-    discount_categories_info = None
-    discount_products_info = None
-    
-    for did in discount_ids:
-        if did in discount_map:
-            discount = discount_map[did]
-            discounts_for_day.append(
-                RedeemDiscountItem(discount_id=did, discount=discount)
-            )
-            
-            discount_type = discount.get("type") or ""
-            scope = discount.get("scope") or {}
-            params = discount.get("params") or {}
-            
-            # Si es FREE_ITEM, obtener info del producto y (si aplica) categorías o productos del scope para requires_purchase
-            if discount_type == "FREE_ITEM":
-                free_item = params.get("free_item") or {}
-                product_id = free_item.get("product_id")
-                if product_id:
-                    product_info = _get_product_info(product_id, cuponera_site_ids)
-                    if product_info:
-                        free_product_info = product_info
-                        limits = discount.get("limits") or {}
-                        free_product_info["max_qty"] = limits.get("max_free_qty", 1)
-                scope_type = scope.get("scope_type") or ""
-                category_ids = scope.get("category_ids") or []
-                product_ids = scope.get("product_ids") or []
-                if scope_type == "CATEGORY_IDS" and category_ids:
-                    discount_categories_info = _get_categories_info(category_ids, cuponera_site_ids)
-                # Incluir discount_products si hay product_ids (aunque scope_type sea ALL_ITEMS)
-                if product_ids:
-                    prods = []
-                    for pid in product_ids:
-                        prod_info = _get_product_info(str(pid), cuponera_site_ids)
-                        if prod_info:
-                            prods.append(prod_info)
-                    if prods:
-                        discount_products_info = prods
-            # Si es descuento por CATEGORÍA, obtener info de las categorías
-            elif discount_type in ("CATEGORY_PERCENT_OFF", "CATEGORY_AMOUNT_OFF", "BUY_M_PAY_N"):
-                scope_type = scope.get("scope_type") or ""
-                category_ids = scope.get("category_ids") or []
-                product_ids_scope = scope.get("product_ids") or []
-                if scope_type == "CATEGORY_IDS" and category_ids:
-                    discount_categories_info = _get_categories_info(category_ids, cuponera_site_ids)
-                # BUY_M_PAY_N: incluir discount_products si hay product_ids (aunque scope_type sea ALL_ITEMS)
-                if discount_type == "BUY_M_PAY_N" and product_ids_scope:
-                    prods = []
-                    for pid in product_ids_scope:
-                        prod_info = _get_product_info(str(pid), cuponera_site_ids)
-                        if prod_info:
-                            prods.append(prod_info)
-                    if prods:
-                        discount_products_info = prods
-            
-            # BUY_X_GET_Y_PERCENT_OFF: puede tener scope por categoría o producto
-            elif discount_type == "BUY_X_GET_Y_PERCENT_OFF":
-                scope_type = scope.get("scope_type") or ""
-                category_ids = scope.get("category_ids") or []
-                product_ids_scope = scope.get("product_ids") or []
-                if scope_type == "CATEGORY_IDS" and category_ids:
-                    discount_categories_info = _get_categories_info(category_ids, cuponera_site_ids)
-                if product_ids_scope:
-                    prods = []
-                    for pid in product_ids_scope:
-                        prod_info = _get_product_info(str(pid), cuponera_site_ids)
-                        if prod_info:
-                            prods.append(prod_info)
-                    if prods:
-                        discount_products_info = prods
-            # Si es descuento por PRODUCTO, obtener info de los productos
-            elif discount_type in ("PRODUCT_PERCENT_OFF", "PRODUCT_AMOUNT_OFF"):
-                product_ids = scope.get("product_ids") or []
-                if product_ids:
-                    prods = []
-                    for pid in product_ids:
-                        prod_info = _get_product_info(str(pid), cuponera_site_ids)
-                        if prod_info:
-                            prods.append(prod_info)
-                    if prods:
-                        discount_products_info = prods
-
-    # Normalizar tipos por si MongoDB/JSON devuelve otro tipo
-    uses_per_day = int(cuponera.get("uses_per_day") or 1)
-    cuponera_id_str = str(cuponera_id or "")
-    today_str = str(today or "")
-
-    usage_list = read_cuponera_usage()
-    current_count = 0
-    for rec in usage_list:
-        rec_cid = str(rec.get("cuponera_id") or "")
-        rec_code = (rec.get("user_code") or "").strip().upper()
-        rec_date = str(rec.get("date") or "")
-        if rec_cid == cuponera_id_str and rec_code == code_upper and rec_date == today_str:
-            current_count = int(rec.get("uses_count") or 0)
-            break
-
-    uses_remaining = max(0, uses_per_day - current_count)
-
-    if record_use and uses_remaining > 0:
-        # Incrementar uso
-        found = False
-        for rec in usage_list:
-            rec_cid = str(rec.get("cuponera_id") or "")
-            rec_code = (rec.get("user_code") or "").strip().upper()
-            rec_date = str(rec.get("date") or "")
-            if rec_cid == cuponera_id_str and rec_code == code_upper and rec_date == today_str:
-                rec["uses_count"] = int(rec.get("uses_count") or 0) + 1
-                found = True
-                break
-        if not found:
-            usage_list.append({
-                "cuponera_id": cuponera_id_str,
-                "user_code": code_upper,
-                "date": today_str,
-                "uses_count": 1,
-            })
-        write_cuponera_usage(usage_list)
-        uses_remaining = max(0, uses_remaining - 1)
-
-    return RedeemResponse(
-        success=True,
-        message="Descuentos del día.",
-        cuponera_name=cuponera.get("name"),
-        discounts=discounts_for_day,
-        uses_remaining_today=uses_remaining,
-        user=user_info,
-        cuponera_site_ids=cuponera_site_ids,
-        free_product=free_product_info,
-        discount_categories=discount_categories_info,
-        discount_products=discount_products_info,
-    )
+        try:
+            found = _find_user_cuponera(code_upper, today)
+            if isinstance(found, RedeemResponse):
+                results[i] = RedeemBatchResult(code=item.code, date=today, response=found)
+                continue
+            user, cuponera = found
+            cuponera_id_str = str(cuponera.get("id") or "")
+            plan = plans.get((cuponera_id_str, today))
+            if plan is None:
+                plan = plans[(cuponera_id_str, today)] = get_day_plan(cuponera, today)
+            if not plan.discount_ids:
+                results[i] = RedeemBatchResult(code=item.code, date=today, response=_no_discounts_response(user, cuponera))
+                continue
+            limit = _uses_per_day(cuponera) if item.record_use else None
+            pending.append((i, user, cuponera, plan, (cuponera_id_str, code_upper, today, limit)))
+        except HTTPException as e:
+            results[i] = RedeemBatchResult(code=item.code, date=today, error=str(e.detail))
+        except Exception:
+            logger.exception("Canje por lote: ítem %s (%s)", i, item.code)
+            results[i] = RedeemBatchResult(code=item.code, date=today, error="Error interno al procesar el ítem")
+
+    if pending:
+        try:
+            counts = consume_cuponera_usage_many([p[4] for p in pending])
+        except Exception:
+            logger.exception("Canje por lote: no se pudieron registrar los usos")
+            counts = None
+            error = "No se pudo registrar el uso"
+        for n, (i, user, cuponera, plan, request) in enumerate(pending):
+            if counts is None:
+                results[i] = RedeemBatchResult(code=items[i].code, date=request[2], error=error)
+            else:
+                response = _day_response(user, cuponera, plan, counts[n][1])
+                results[i] = RedeemBatchResult(code=items[i].code, date=request[2], response=response)
+    return results
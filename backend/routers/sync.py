@@ -0,0 +1,13 @@
+"""Estado de la sincronización de sedes y menús con el API externo."""
+from fastapi import APIRouter
+
+from models import SyncStatus
+from sync_service import sync_status
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+@router.get("/status", response_model=SyncStatus)
+async def get_sync_status():
+    """Último éxito, duración, bytes y error por sede, y cuántas están fallando o desactualizadas."""
+    return sync_status()
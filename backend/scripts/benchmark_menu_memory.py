@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Memoria del catálogo de menús: menús crudos en caché vs MenuIndex compacto.
+
+Mide con tracemalloc lo que queda residente por todas las sedes sincronizadas (data/menus):
+- menús crudos: los dicts de read_menu, lo que antes guardaba la caché de storage por sede;
+- dicts por registro: solo los lookups (un dict por producto/categoría/entrada);
+- MenuIndex: registros con __slots__ compartidos entre sedes + columna de precios (lo único
+  que storage mantiene ahora).
+Cada sede se parsea de su propio JSON, como al leerla del disco. Sin menús sincronizados
+se puede usar --synthetic N para generar N sedes de prueba.
+Ejecutar desde backend/: python scripts/benchmark_menu_memory.py [--synthetic 20]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from menu_index import MenuIndex, category_display_name, product_display_name  # noqa: E402
+
+
+def dict_index(menu: dict) -> dict:
+    """Mismos lookups que MenuIndex pero con un dict por registro (representación anterior)."""
+    products, categories, catalog = {}, {}, {}
+    for cat in menu.get("categorias") or []:
+        cid = str(cat.get("categoria_id") or "")
+        categories.setdefault(cid, {
+            "category_id": cid,
+            "name": (cat.get("categoria_nombre") or cat.get("categoria_descripcion") or "").strip(),
+            "display_name": category_display_name(cat),
+            "image": cat.get("categoria_urlimagen") or "",
+        })
+        for prod in cat.get("products") or []:
+            pid = str(prod.get("producto_id"))
+            products.setdefault(pid, {
+                "product_id": pid,
+                "name": (prod.get("producto_descripcion") or "").strip(),
+                "price": float(prod.get("productogeneral_precio") or 0),
+                "image": prod.get("productogeneral_urlimagen") or "",
+                "category_id": cid,
+            })
+            catalog.setdefault(pid, {"id": pid, "name": product_display_name(prod), "category_id": cid})
+            for pres in prod.get("lista_presentacion") or []:
+                ppid = str(pres.get("producto_id"))
+                catalog.setdefault(ppid, {"id": ppid, "name": product_display_name(prod), "category_id": cid})
+    return {"products": products, "categories": categories, "catalog": catalog}
+
+
+def _unused_fields(pid: int) -> dict:
+    """Campos del payload que el catálogo no usa (aproximación de los de products-light)."""
+    return {
+        "productogeneral_id": pid,
+        "productogeneral_descripcion": f"Descripción larga del producto {pid} con ingredientes y alérgenos",
+        "productogeneral_codigo": f"PG-{pid:06d}",
+        "productogeneral_estado": "ACTIVO",
+        "productogeneral_escombo": False,
+        "productogeneral_orden": pid % 40,
+        "productogeneral_impuesto": 8.0,
+        "productogeneral_tipoimpuesto": "IMPOCONSUMO",
+        "productogeneral_preciosinimpuesto": None,
+        "productogeneral_urlimagen_movil": f"https://img.example/prod/{pid}_m.png",
+        "producto_codigo": f"P-{pid:06d}",
+        "producto_estado": "ACTIVO",
+        "producto_visible": True,
+        "producto_disponible": True,
+        "producto_tiempopreparacion": 15,
+        "producto_unidad": "UND",
+        "producto_etiquetas": ["popular", "nuevo"] if pid % 3 == 0 else [],
+        "english_name": f"Product {pid}",
+        "english_description": f"Long description of product {pid}",
+        "lista_adicionales": [],
+        "lista_modificadores": [],
+        "fecha_actualizacion": "2024-01-01T00:00:00",
+    }
+
+
+def synthetic_menus(sites: int) -> list[dict]:
+    """Sedes con el mismo catálogo base y algunos precios/productos propios, como en producción."""
+    rng = random.Random(1)
+    base = [
+        {
+            "categoria_id": c,
+            "categoria_descripcion": f"Categoría {c}",
+            "categoria_urlimagen": f"https://img.example/cat/{c}.png",
+            "products": [
+                {
+                    **_unused_fields(c * 100 + p),
+                    "producto_id": c * 100 + p,
+                    "producto_descripcion": f"Producto {c}-{p}",
+                    "productogeneral_precio": str(rng.randint(5, 60) * 1000),
+                    "productogeneral_urlimagen": f"https://img.example/prod/{c}/{p}.png",
+                    "lista_presentacion": [{**_unused_fields(10000 + c * 100 + p), "producto_id": 10000 + c * 100 + p}] if p % 4 == 0 else [],
+                }
+                for p in range(40)
+            ],
+        }
+        for c in range(1, 16)
+    ]
+    menus = []
+    for _ in range(sites):
+        categorias = []
+        for cat in base:
+            prods = [
+                {**prod, "productogeneral_precio": str(rng.randint(5, 60) * 1000)} if rng.random() < 0.1 else dict(prod)
+                for prod in cat["products"]
+            ]
+            categorias.append({**cat, "products": prods})
+        menus.append({"categorias": categorias})
+    return menus
+
+
+def measure(build, payloads: list[bytes]) -> tuple[int, list]:
+    """Memoria retenida por build(menú) de cada sede; el menú parseado se descarta si build no lo guarda."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = [build(json.loads(payload)) for payload in payloads]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--synthetic", type=int, metavar="SEDES", help="generar N sedes en vez de leer data/menus")
+    args = parser.parse_args()
+    if args.synthetic:
+        menus = synthetic_menus(args.synthetic)
+    else:
+        menus = [m for m in (storage.read_menu(sid) for sid in storage.list_menu_site_ids()) if m]
+    if not menus:
+        print("No hay menús sincronizados; use --synthetic N.")
+        sys.exit(1)
+    products = sum(len(cat.get("products") or []) for m in menus for cat in m.get("categorias") or [])
+    payloads = [json.dumps(m, ensure_ascii=False).encode("utf-8") for m in menus]
+    del menus
+    raw_size, _ = measure(lambda menu: menu, payloads)
+    dict_size, _ = measure(dict_index, payloads)
+    compact_size, _ = measure(MenuIndex.build, payloads)
+    print(f"{len(payloads)} sedes, {products} productos")
+    print(f"menús crudos:       {raw_size / 1024:10.1f} KiB")
+    print(f"dicts por registro: {dict_size / 1024:10.1f} KiB")
+    print(f"MenuIndex compacto: {compact_size / 1024:10.1f} KiB (incluye índice de búsqueda)")
+    print(f"relación con los menús crudos: {compact_size / raw_size:.2f}x")
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Script de migración data/*.json -> SQLite (STORAGE_BACKEND=sqlite).
+
+Copia descuentos, carpetas, cuponeras, usuarios y usos desde los archivos JSON
+a la base SQLITE_PATH. Reemplaza el contenido de las tablas. Sedes y menús no se
+migran (siguen en JSON). Ejecutar desde backend/: python scripts/migrate_json_to_sqlite.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402  (backend JSON: STORAGE_BACKEND por defecto)
+import storage_sqlite  # noqa: E402
+from config import SQLITE_PATH, STORAGE_BACKEND  # noqa: E402
+
+if __name__ == "__main__":
+    if STORAGE_BACKEND != "json":
+        print("Ejecute con STORAGE_BACKEND=json para leer los archivos JSON de origen.")
+        sys.exit(1)
+    collections = [
+        ("discounts", storage.read_discounts, storage_sqlite.write_discounts),
+        ("folders", storage.read_folders, storage_sqlite.write_folders),
+        ("cuponeras", storage.read_cuponeras, storage_sqlite.write_cuponeras),
+        ("cuponera_users", storage.read_cuponera_users, storage_sqlite.write_cuponera_users),
+        ("cuponera_usage", storage.read_cuponera_usage, storage_sqlite.write_cuponera_usage),
+    ]
+    with storage_sqlite.transaction():
+        for name, read, write in collections:
+            data = read()
+            write(data)
+            print(f"{name}: {len(data)} registros")
+    print(f"Migración completa en {SQLITE_PATH}")
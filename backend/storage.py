@@ -1,17 +1,155 @@
-"""Almacenamiento en archivos JSON locales."""
+"""Almacenamiento en archivos JSON locales.
+
+Los documentos parseados se guardan en una caché en memoria por ruta, invalidada
+por la firma del archivo (mtime, tamaño, inodo) o al escribir con _save_json. Los objetos cacheados
+son compartidos: las funciones internas no deben mutarlos (copiar antes de modificar).
+
+Las escrituras son atómicas (archivo temporal + fsync + rename) y toda operación
+leer-modificar-escribir se hace dentro de _file_transaction(), que bloquea los archivos
+implicados entre hilos y entre procesos (flock sobre <archivo>.lock).
+
+Con STORAGE_FORMAT=binary cada archivo se guarda como snapshot binario <archivo>.bin
+(pickle con cabecera de versión + checksum), que es el que se lee; el .json queda como
+exportación legible que se reescribe en segundo plano (flush_json_exports).
+"""
+import gzip
+import hashlib
 import json
+import logging
 import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from datetime import date
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: solo bloqueo entre hilos
+    fcntl = None
+
 from config import (
+    CUPONERA_USAGE_ARCHIVE_DIR,
+    CUPONERA_USAGE_DIR,
     CUPONERA_USAGE_JSON,
+    CUPONERA_USAGE_LOG,
     CUPONERA_USERS_JSON,
     CUPONERAS_JSON,
+    DATA_DIR,
     DISCOUNTS_JSON,
     FOLDERS_JSON,
     MENUS_DIR,
     SITES_JSON,
+    STORAGE_BACKEND,
+    STORAGE_CACHE_MAX_FILES,
+    STORAGE_FORMAT,
+    USAGE_LOG_COMPACT_EVERY,
+    USAGE_RETENTION_MONTHS,
 )
+from menu_index import MenuIndex, menu_content_hash
+from usage_ledger import PartitionedUsage, UsageLedger, usage_key
+from utils import normalize_code
+
+logger = logging.getLogger(__name__)
+
+# Backend de las colecciones (descuentos, carpetas, cuponeras, usuarios y usos); sedes y
+# menús siguen en JSON con cualquier backend
+if STORAGE_BACKEND == "sqlite":
+    import storage_sqlite as _sqlite
+elif STORAGE_BACKEND == "json":
+    _sqlite = None
+else:
+    raise RuntimeError(f"STORAGE_BACKEND desconocido: {STORAGE_BACKEND!r} (use 'json' o 'sqlite')")
+
+
+def _backend_api(fn):
+    """Función pública de las colecciones: con STORAGE_BACKEND=sqlite se usa la homónima de storage_sqlite."""
+    if _sqlite is None:
+        return fn
+    return getattr(_sqlite, fn.__name__)
+
+# Firma de un archivo: (mtime_ns, tamaño, inodo, dispositivo)
+_Signature = tuple[int, int, int, int]
+
+# path -> (firma, data, índices); orden LRU (el más reciente al final)
+_cache: OrderedDict[str, tuple[_Signature, object, dict]] = OrderedDict()
+_cache_lock = threading.Lock()
+_MISS = object()
+
+# Snapshot binario: MAGIC + versión (1 byte) + blake2b del payload + pickle
+_SNAPSHOT_MAGIC = b"DMSNAP"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_DIGEST_SIZE = 16
+_SNAPSHOT_HEADER_SIZE = len(_SNAPSHOT_MAGIC) + 1 + _SNAPSHOT_DIGEST_SIZE
+
+# Exportaciones JSON pendientes (STORAGE_FORMAT=binary)
+_export_pending: set[str] = set()
+_export_lock = threading.Lock()
+
+# Índices en memoria por colección: nombre -> clave de cada registro (clave -> posición en la lista)
+_INDEX_KEYS = {
+    "id": lambda d: d.get("id"),
+    "user": lambda u: (u.get("cuponera_id"), u.get("id")),
+    "code": lambda u: normalize_code(u.get("code")),
+}
+# Índices no únicos: clave -> lista de posiciones (en orden de inserción)
+_MULTI_INDEXES = {"code"}
+
+
+def _calendar_refs(cuponera: dict) -> dict[str, list[str]]:
+    """discount_id -> fechas (ordenadas) en las que la cuponera lo programa."""
+    refs: dict[str, list[str]] = {}
+    for date_key, ids in (cuponera.get("calendar") or {}).items():
+        if isinstance(ids, list):
+            for did in ids:
+                refs.setdefault(did, []).append(date_key)
+    for dates in refs.values():
+        dates.sort()
+    return refs
+
+
+def _build_calendar_index(items: list[dict]) -> dict:
+    return _update_calendar_index({}, [(i, None, c) for i, c in enumerate(items)])
+
+
+def _update_calendar_index(index: dict, changes: list[tuple]) -> dict:
+    """Aplica cambios (pos, antes, después) de cuponeras al índice discount_id -> {cuponera_id: [fechas]}."""
+    index = dict(index)
+    for _pos, old, new in changes:
+        for doc, add in ((old, False), (new, True)):
+            if not doc:
+                continue
+            cid = doc.get("id")
+            for did, dates in _calendar_refs(doc).items():
+                per_cuponera = dict(index.get(did) or {})
+                if add:
+                    per_cuponera[cid] = dates
+                else:
+                    per_cuponera.pop(cid, None)
+                if per_cuponera:
+                    index[did] = per_cuponera
+                else:
+                    index.pop(did, None)
+    return index
+
+
+# Índices derivados del contenido (no de posiciones): nombre -> (construir, aplicar cambios)
+_DERIVED_INDEXES = {
+    "calendar": (_build_calendar_index, _update_calendar_index),
+}
+
+
+# Nombres de colección aceptados por _file_transaction()
+_COLLECTION_PATHS = {
+    "sites": SITES_JSON,
+    "discounts": DISCOUNTS_JSON,
+    "folders": FOLDERS_JSON,
+    "cuponeras": CUPONERAS_JSON,
+    "cuponera_usage": CUPONERA_USAGE_DIR,
+    "cuponera_users": CUPONERA_USERS_JSON,
+}
 
 
 def _ensure_dir(path: str):
@@ -19,23 +157,523 @@ def _ensure_dir(path: str):
     Path(path).parent.mkdir(parents=True, exist_ok=True)
 
 
-def _load_json(path: str, default):
-    """Carga JSON desde archivo. Retorna default si no existe o está vacío."""
-    if not os.path.exists(path) or os.path.getsize(path) == 0:
+def _file_signature(path: str) -> _Signature | None:
+    """
+    (mtime_ns, tamaño, inodo, dispositivo) del archivo, o None si no existe. El inodo cambia
+    con cada os.replace, así que un reemplazo de otro proceso con el mismo tamaño dentro de
+    la resolución del mtime también invalida la caché.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino, st.st_dev
+
+
+class _FileLock:
+    """Lock reentrante por archivo: RLock entre hilos + flock entre procesos (workers)."""
+
+    def __init__(self, path: str):
+        self.lock_path = path + ".lock"
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd: int | None = None
+
+    def acquire(self):
+        self._lock.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                _ensure_dir(self.lock_path)
+                fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                self._fd = fd
+            self._depth += 1
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+
+_file_locks: dict[str, _FileLock] = {}
+_file_locks_guard = threading.Lock()
+
+
+def _file_lock(path: str) -> _FileLock:
+    with _file_locks_guard:
+        lock = _file_locks.get(path)
+        if lock is None:
+            lock = _file_locks[path] = _FileLock(path)
+        return lock
+
+
+@contextmanager
+def _file_transaction(*collections: str):
+    """
+    Bloquea colecciones (nombre, p. ej. "cuponera_users", o ruta) para un leer-modificar-escribir.
+    Es reentrante; los locks se toman en orden fijo, así que la transacción externa debe
+    declarar todas las colecciones que se van a tocar. Es el lock de los archivos: lo usan
+    también sedes y menús, que siguen en JSON con cualquier backend.
+    """
+    paths = sorted({_COLLECTION_PATHS.get(c, c) for c in collections})
+    with ExitStack() as stack:
+        for path in paths:
+            lock = _file_lock(path)
+            lock.acquire()
+            stack.callback(lock.release)
+        yield
+
+
+@_backend_api
+def transaction(*collections: str):
+    """Transacción sobre colecciones del backend (en JSON, el lock de sus archivos)."""
+    return _file_transaction(*collections)
+
+
+def _cache_get(path: str, signature: _Signature):
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is None or entry[0] != signature:
+            return _MISS
+        _cache.move_to_end(path)
+        return entry[1]
+
+
+def _cache_put(path: str, signature: _Signature | None, data, indexes: dict | None = None):
+    with _cache_lock:
+        if signature is None:
+            _cache.pop(path, None)
+            return
+        _cache[path] = (signature, data, indexes or {})
+        _cache.move_to_end(path)
+        while len(_cache) > STORAGE_CACHE_MAX_FILES:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    """Vacía la caché en memoria (p. ej. tras editar archivos de data/ a mano)."""
+    with _cache_lock:
+        _cache.clear()
+
+
+def _snapshot_path(path: str) -> str:
+    return path + ".bin"
+
+
+def _data_signature(path: str) -> _Signature | None:
+    """Firma del archivo que se lee realmente: el snapshot (modo binary) o el JSON."""
+    if STORAGE_FORMAT == "binary":
+        return _file_signature(_snapshot_path(path))
+    return _file_signature(path)
+
+
+def _encode_snapshot(data) -> bytes:
+    payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.blake2b(payload, digest_size=_SNAPSHOT_DIGEST_SIZE).digest()
+    return _SNAPSHOT_MAGIC + bytes([_SNAPSHOT_VERSION]) + digest + payload
+
+
+def _decode_snapshot(raw: bytes):
+    """Datos del snapshot, o _MISS si la cabecera o el checksum no coinciden."""
+    if len(raw) < _SNAPSHOT_HEADER_SIZE or not raw.startswith(_SNAPSHOT_MAGIC):
+        return _MISS
+    if raw[len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_VERSION:
+        return _MISS
+    digest = raw[len(_SNAPSHOT_MAGIC) + 1:_SNAPSHOT_HEADER_SIZE]
+    payload = memoryview(raw)[_SNAPSHOT_HEADER_SIZE:]
+    if hashlib.blake2b(payload, digest_size=_SNAPSHOT_DIGEST_SIZE).digest() != digest:
+        return _MISS
+    return pickle.loads(payload)
+
+
+def _encode_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _load_snapshot(path: str, cache: bool = True):
+    """Lee <path>.bin (o caché). _MISS si no existe o no es válido (se usa el JSON)."""
+    signature = _file_signature(_snapshot_path(path))
+    if signature is None:
+        return _MISS
+    cached = _cache_get(path, signature)
+    if cached is not _MISS:
+        return cached
+    try:
+        with open(_snapshot_path(path), "rb") as f:
+            raw = f.read()
+        data = _decode_snapshot(raw)
+    except FileNotFoundError:
+        return _MISS
+    except (pickle.UnpicklingError, EOFError, ValueError) as e:
+        logger.warning("Snapshot ilegible %s: %s", _snapshot_path(path), e)
+        data = _MISS
+    if data is _MISS:
+        logger.warning("Snapshot inválido %s; se usa la exportación JSON", _snapshot_path(path))
+        return _MISS
+    if cache:
+        _cache_put(path, signature, data)
+    return data
+
+
+def _load_json(path: str, default, strict: bool = True, cache: bool = True):
+    """
+    Carga JSON desde archivo (o caché). Retorna default si no existe o está vacío.
+    Un archivo corrupto lanza error (strict) en vez de tratarse como vacío, para que la
+    siguiente escritura no lo pise; con strict=False (datos sincronizados) retorna default.
+    En modo binary se prefiere el snapshot si su checksum es válido; si falta, se carga
+    el JSON y se genera el snapshot. Con cache=False lo leído no se guarda en la caché.
+    """
+    if STORAGE_FORMAT == "binary":
+        data = _load_snapshot(path, cache)
+        if data is not _MISS:
+            return default if data is None else data
+    signature = _file_signature(path)
+    if signature is None or signature[1] == 0:
         return default
+    if STORAGE_FORMAT != "binary":
+        cached = _cache_get(path, signature)
+        if cached is not _MISS:
+            return cached
     try:
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
-            return data if data is not None else default
-    except (json.JSONDecodeError, OSError):
+    except FileNotFoundError:
+        return default
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        logger.error("Archivo de datos corrupto %s: %s", path, e)
+        if strict:
+            raise RuntimeError(f"Archivo de datos corrupto: {path}") from e
+        return default
+    if data is None:
         return default
+    if STORAGE_FORMAT == "binary":
+        with _file_transaction(path):
+            current = _load_snapshot(path, cache)  # otro proceso pudo generarlo mientras tanto
+            if current is not _MISS:
+                return default if current is None else current
+            _write_atomic(_snapshot_path(path), _encode_snapshot(data))
+            signature = _data_signature(path)
+    if cache:
+        _cache_put(path, signature, data)
+    return data
 
 
-def _save_json(path: str, data):
-    """Guarda datos en JSON."""
+def _save_json(path: str, data, indexes: dict | None = None, cache: bool = True):
+    """
+    Guarda datos de forma atómica (temporal + fsync + rename) y actualiza la caché
+    (con los índices ya calculados, si se pasan; con cache=False solo descarta la entrada).
+    En modo binary escribe el snapshot y deja la exportación JSON pendiente.
+    """
+    with _file_transaction(path):
+        if STORAGE_FORMAT == "binary":
+            _write_atomic(_snapshot_path(path), _encode_snapshot(data))
+            with _export_lock:
+                _export_pending.add(path)
+        else:
+            _write_atomic(path, _encode_json(data))
+        _cache_put(path, _data_signature(path) if cache else None, data, indexes)
+
+
+def _write_atomic(path: str, payload: bytes):
+    """Escribe bytes en path vía temporal en el mismo directorio + fsync + rename."""
     _ensure_dir(path)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+
+def flush_json_exports() -> int:
+    """
+    Reescribe los .json legibles de los archivos guardados como snapshot (modo binary).
+    Retorna cuántos archivos se exportaron.
+    """
+    with _export_lock:
+        paths = sorted(_export_pending)
+        _export_pending.clear()
+    exported = 0
+    for path in paths:
+        try:
+            with _file_transaction(path):
+                data = _load_snapshot(path)
+                if data is _MISS:
+                    continue
+                _write_atomic(path, _encode_json(data))
+            exported += 1
+        except OSError as e:
+            logger.error("No se pudo exportar %s: %s", path, e)
+            with _export_lock:
+                _export_pending.add(path)
+    return exported
+
+
+def queue_stale_json_exports() -> int:
+    """
+    Deja pendientes de exportar los snapshots más nuevos que su .json (o sin .json), p. ej. si el
+    proceso terminó entre la escritura del snapshot y la exportación. Se llama al arrancar la API.
+    Retorna cuántos quedaron pendientes.
+    """
+    if STORAGE_FORMAT != "binary":
+        return 0
+    stale = []
+    for directory, _, names in os.walk(DATA_DIR):
+        for name in names:
+            if not name.endswith(".json.bin"):
+                continue
+            path = os.path.join(directory, name[:-len(".bin")])
+            snapshot = _file_signature(_snapshot_path(path))
+            export = _file_signature(path)
+            if snapshot is not None and (export is None or export[0] < snapshot[0]):
+                stale.append(path)
+    with _export_lock:
+        _export_pending.update(stale)
+    return len(stale)
+
+
+def _fsync_dir(directory: str):
+    """Persiste el rename en el directorio (no soportado en Windows)."""
+    if os.name != "posix":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# --- Colecciones indexadas (lista de dicts en un archivo JSON) ---
+def _build_index(items: list[dict], name: str) -> dict:
+    if name in _DERIVED_INDEXES:
+        return _DERIVED_INDEXES[name][0](items)
+    key_fn = _INDEX_KEYS[name]
+    index: dict = {}
+    if name in _MULTI_INDEXES:
+        for i, item in enumerate(items):
+            index.setdefault(key_fn(item), []).append(i)
+        return index
+    for i, item in enumerate(items):
+        index.setdefault(key_fn(item), i)  # ante duplicados gana el primero, como en la búsqueda lineal
+    return index
+
+
+def _load_list(path: str) -> list[dict]:
+    data = _load_json(path, [])
+    return data if isinstance(data, list) else []
+
+
+def _attached_index(path: str, data, name: str, build):
+    """Índice `name` de la versión cacheada `data` de path; se construye una vez por versión."""
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry[1] is data and name in entry[2]:
+            return entry[2][name]
+    index = build(data)
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry[1] is data:
+            index = entry[2].setdefault(name, index)
+    return index
+
+
+def _load_indexed(path: str, name: str) -> tuple[list[dict], dict]:
+    """(lista cacheada, índice clave -> posición) coherentes entre sí."""
+    items = _load_list(path)
+    return items, _attached_index(path, items, name, lambda data: _build_index(data, name))
+
+
+def _current_indexes(path: str, items: list[dict]) -> dict:
+    """Índices ya construidos para la versión cacheada `items` (para actualizarlos incrementalmente)."""
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry[1] is items:
+            return dict(entry[2])
+    return {}
+
+
+def _next_indexes(path: str, items: list[dict], changes: list[tuple], shrunk: bool = False) -> dict:
+    """
+    Índices para la nueva versión de la colección a partir de los ya construidos para `items`.
+    changes: (posición, registro anterior o None si es nuevo, registro nuevo o None si se quitó).
+    Si se quitaron registros (shrunk) las posiciones cambian: los índices posicionales se
+    descartan y se reconstruyen en la próxima lectura; los derivados se actualizan siempre.
+    """
+    new_indexes = {}
+    for name, index in _current_indexes(path, items).items():
+        if name in _DERIVED_INDEXES:
+            new_indexes[name] = _DERIVED_INDEXES[name][1](index, changes)
+            continue
+        if shrunk:
+            continue
+        key_fn = _INDEX_KEYS[name]
+        inserts = [(pos, new) for pos, old, new in changes if old is None]
+        if any(old is not None and key_fn(old) != key_fn(new) for _pos, old, new in changes):
+            continue
+        if inserts:
+            index = dict(index)
+            for pos, new in inserts:
+                key = key_fn(new)
+                if name in _MULTI_INDEXES:
+                    index[key] = index.get(key, []) + [pos]
+                else:
+                    index.setdefault(key, pos)
+        new_indexes[name] = index
+    return new_indexes
+
+
+def _get_record(path: str, name: str, key) -> dict | None:
+    items, index = _load_indexed(path, name)
+    pos = index.get(key)
+    return dict(items[pos]) if pos is not None else None
+
+
+def _insert_record(path: str, doc: dict) -> dict:
+    with _file_transaction(path):
+        items = _load_list(path)
+        new_items = items + [doc]
+        _save_json(path, new_items, _next_indexes(path, items, [(len(items), None, doc)]))
+    return doc
+
+
+def _update_record(path: str, name: str, key, upd: dict) -> dict | None:
+    with _file_transaction(path):
+        items, index = _load_indexed(path, name)
+        pos = index.get(key)
+        if pos is None:
+            return None
+        new_items = list(items)
+        new_items[pos] = {**items[pos], **upd}
+        _save_json(path, new_items, _next_indexes(path, items, [(pos, items[pos], new_items[pos])]))
+    return new_items[pos]
+
+
+def _find_records(path: str, name: str, key) -> list[dict]:
+    """Registros con esa clave en un índice no único."""
+    items, index = _load_indexed(path, name)
+    return [dict(items[pos]) for pos in index.get(key, ())]
+
+
+def _delete_records(path: str, name: str, key) -> bool:
+    """Elimina todos los registros con esa clave (índice único)."""
+    with _file_transaction(path):
+        items, index = _load_indexed(path, name)
+        if key not in index:
+            return False
+        key_fn = _INDEX_KEYS[name]
+        kept, removed = [], []
+        for i, item in enumerate(items):
+            if key_fn(item) == key:
+                removed.append((i, item, None))
+            else:
+                kept.append(item)
+        _save_json(path, kept, _next_indexes(path, items, removed, shrunk=True))
+    return True
+
+
+class UnitOfWork:
+    """
+    Operación que toca varias colecciones JSON: carga cada archivo una vez, aplica los
+    cambios en memoria y al terminar escribe una sola vez cada archivo modificado.
+    Usar con unit_of_work(); en el backend SQLite basta con transaction().
+    """
+
+    def __init__(self):
+        self._loaded: dict[str, list[dict]] = {}
+        self._items: dict[str, list[dict]] = {}
+        self._changes: dict[str, list[tuple]] = {}
+        self._shrunk: set[str] = set()
+
+    def items(self, path: str) -> list[dict]:
+        """Estado actual de la colección dentro de la unidad (no mutar: usar replace/remove_where)."""
+        if path not in self._items:
+            self._loaded[path] = _load_list(path)
+            self._items[path] = self._loaded[path]
+        return self._items[path]
+
+    def find(self, path: str, name: str, key) -> int | None:
+        """Posición del registro con esa clave (índice único), o None."""
+        items = self.items(path)
+        key_fn = _INDEX_KEYS[name]
+        if path not in self._shrunk:
+            # Sin eliminaciones las posiciones son las de la versión cargada
+            loaded, index = _load_indexed(path, name)
+            pos = index.get(key) if loaded is self._loaded[path] else None
+            if pos is not None and key_fn(items[pos]) == key:
+                return pos
+        return next((i for i, item in enumerate(items) if key_fn(item) == key), None)
+
+    def _writable(self, path: str) -> list[dict]:
+        items = self.items(path)
+        if items is self._loaded[path]:
+            items = self._items[path] = list(items)
+        return items
+
+    def replace(self, path: str, pos: int, doc: dict):
+        items = self._writable(path)
+        self._changes.setdefault(path, []).append((pos, items[pos], doc))
+        items[pos] = doc
+
+    def update_where(self, path: str, pred, upd: dict) -> int:
+        """Aplica upd a los registros que cumplen pred. Devuelve cuántos cambió."""
+        count = 0
+        for i, item in enumerate(self.items(path)):
+            if pred(item):
+                self.replace(path, i, {**item, **upd})
+                count += 1
+        return count
+
+    def remove_where(self, path: str, pred) -> int:
+        """Elimina los registros que cumplen pred. Devuelve cuántos quitó."""
+        kept, removed = [], []
+        for i, item in enumerate(self.items(path)):
+            if pred(item):
+                removed.append((i, item, None))
+            else:
+                kept.append(item)
+        if removed:
+            self._items[path] = kept
+            self._changes.setdefault(path, []).extend(removed)
+            self._shrunk.add(path)
+        return len(removed)
+
+    def flush(self):
+        for path, items in self._items.items():
+            loaded = self._loaded[path]
+            if items is loaded:
+                continue
+            changes = self._changes.pop(path, [])
+            _save_json(path, items, _next_indexes(path, loaded, changes, shrunk=path in self._shrunk))
+            self._loaded[path] = self._items[path] = items
+            self._shrunk.discard(path)
+
+
+@contextmanager
+def unit_of_work(*collections: str):
+    """Bloquea las colecciones, entrega un UnitOfWork y lo escribe al salir sin errores."""
+    with _file_transaction(*collections):
+        uow = UnitOfWork()
+        yield uow
+        uow.flush()
 
 
 # --- Sites ---
@@ -48,8 +686,8 @@ def _site_allowed(s: dict) -> bool:
 
 
 def read_sites() -> list[dict]:
-    data = _load_json(SITES_JSON, [])
-    return data if isinstance(data, list) else []
+    data = _load_json(SITES_JSON, [], strict=False)
+    return list(data) if isinstance(data, list) else []
 
 
 def read_sites_filtered() -> list[dict]:
@@ -57,8 +695,14 @@ def read_sites_filtered() -> list[dict]:
     return [s for s in read_sites() if _site_allowed(s)]
 
 
-def write_sites(data: list[dict]):
-    _save_json(SITES_JSON, data if data else [])
+def write_sites(data: list[dict]) -> bool:
+    """Guarda las sedes si cambiaron. True si se escribió."""
+    data = data if data else []
+    with _file_transaction(SITES_JSON):
+        if _data_signature(SITES_JSON) is not None and _load_json(SITES_JSON, [], strict=False) == data:
+            return False
+        _save_json(SITES_JSON, data)
+    return True
 
 
 # --- Menus (por sede) ---
@@ -67,17 +711,98 @@ def _menu_path(site_id: int) -> str:
 
 
 def read_menu(site_id: int) -> dict | None:
+    """Menú crudo de la sede, leído del disco (no se cachea: en memoria solo queda el MenuIndex)."""
     path = _menu_path(site_id)
-    data = _load_json(path, None)
+    data = _load_json(path, None, strict=False, cache=False)
     if data is None or not isinstance(data, dict):
         return None
     return data
 
 
-def write_menu(site_id: int, data: dict):
+def write_menu(site_id: int, data: dict) -> bool:
+    """Guarda el menú si su contenido cambió (mismo content_hash = no se reescribe). True si se escribió."""
     data_with_site = {**data, "site_id": site_id}
-    Path(MENUS_DIR).mkdir(parents=True, exist_ok=True)
-    _save_json(_menu_path(site_id), data_with_site)
+    path = _menu_path(site_id)
+    with _file_transaction(path):
+        current = get_menu_index(site_id)
+        index = _build_menu_index(site_id, data_with_site)
+        if current is not None and current.content_hash == index.content_hash:
+            return False
+        Path(MENUS_DIR).mkdir(parents=True, exist_ok=True)
+        _save_json(path, data_with_site, cache=False)
+        _menu_index_by_site[site_id] = (_data_signature(path), index)
+        _write_menu_gzip(site_id, data_with_site)
+    return True
+
+
+def _menu_gzip_path(site_id: int) -> str:
+    return _menu_path(site_id) + ".gz"
+
+
+def _write_menu_gzip(site_id: int, data: dict):
+    """Copia comprimida (JSON compacto) que GET /menus/site/{id} sirve sin parsear."""
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _write_atomic(_menu_gzip_path(site_id), gzip.compress(raw, mtime=0))
+
+
+# site_id -> (firma del .gz, hash de su contenido)
+_menu_gzip_hashes: dict[int, tuple[_Signature, str]] = {}
+
+
+def get_menu_gzip(site_id: int) -> tuple[str, str] | None:
+    """
+    (ruta del menú comprimido, hash de su contenido) para servirlo tal cual. Con el .gz al día
+    cuesta un par de stat; si falta o es más viejo que el menú se regenera. None si no hay menú.
+    """
+    path = _menu_path(site_id)
+    gz_path = _menu_gzip_path(site_id)
+    data_sig = _data_signature(path)
+    if data_sig is None:
+        return None
+    gz_sig = _file_signature(gz_path)
+    if gz_sig is None or gz_sig[0] < data_sig[0]:
+        with _file_transaction(path):
+            data = read_menu(site_id)
+            if data is None:
+                return None
+            _write_menu_gzip(site_id, data)
+            gz_sig = _file_signature(gz_path)
+    cached = _menu_gzip_hashes.get(site_id)
+    if cached is not None and cached[0] == gz_sig:
+        return gz_path, cached[1]
+    with open(gz_path, "rb") as f:
+        content_hash = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    _menu_gzip_hashes[site_id] = (gz_sig, content_hash)
+    return gz_path, content_hash
+
+
+# Índice residente por sede: (firma del archivo del que se construyó, índice). Es lo único
+# que queda en memoria del menú (el crudo no entra en la caché); se reutiliza si el contenido
+# no cambió.
+_menu_index_by_site: dict[int, tuple[_Signature | None, MenuIndex]] = {}
+
+
+def _build_menu_index(site_id: int, data: dict) -> MenuIndex:
+    content_hash = menu_content_hash(data)
+    resident = _menu_index_by_site.get(site_id)
+    if resident is not None and resident[1].content_hash == content_hash:
+        return resident[1]
+    return MenuIndex.build(data, content_hash)
+
+
+def get_menu_index(site_id: int) -> MenuIndex | None:
+    """Índice por id del menú de la sede (construido al escribir o en la primera lectura de cada versión)."""
+    path = _menu_path(site_id)
+    signature = _data_signature(path)
+    resident = _menu_index_by_site.get(site_id)
+    if signature is not None and resident is not None and resident[0] == signature:
+        return resident[1]
+    data = read_menu(site_id)
+    if data is None:
+        return None
+    index = _build_menu_index(site_id, data)
+    _menu_index_by_site[site_id] = (signature, index)
+    return index
 
 
 def list_menu_site_ids() -> list[int]:
@@ -85,10 +810,13 @@ def list_menu_site_ids() -> list[int]:
     if not os.path.isdir(MENUS_DIR):
         return ids
     for name in os.listdir(MENUS_DIR):
+        if name.endswith(".bin"):
+            name = name[:-4]  # snapshot de un menú aún no exportado a JSON
         if name.startswith("site_") and name.endswith(".json"):
             try:
                 sid = int(name[5:-5])
-                ids.append(sid)
+                if sid not in ids:
+                    ids.append(sid)
             except ValueError:
                 pass
     return ids
@@ -96,53 +824,46 @@ def list_menu_site_ids() -> list[int]:
 
 # --- Discounts ---
 def _read_discounts_list() -> list[dict]:
-    data = _load_json(DISCOUNTS_JSON, [])
-    return data if isinstance(data, list) else []
+    return _load_list(DISCOUNTS_JSON)
 
 
+@_backend_api
 def read_discounts() -> list[dict]:
-    return _read_discounts_list()
+    return list(_read_discounts_list())
 
 
+@_backend_api
 def get_discount(discount_id: str) -> dict | None:
-    for d in _read_discounts_list():
-        if d.get("id") == discount_id:
-            return d
-    return None
+    return _get_record(DISCOUNTS_JSON, "id", discount_id)
 
 
+@_backend_api
 def insert_discount(doc: dict) -> dict:
-    items = _read_discounts_list()
-    items.append(doc)
-    _save_json(DISCOUNTS_JSON, items)
-    return doc
+    return _insert_record(DISCOUNTS_JSON, doc)
 
 
+@_backend_api
 def update_discount(discount_id: str, upd: dict) -> dict | None:
-    items = _read_discounts_list()
-    for i, d in enumerate(items):
-        if d.get("id") == discount_id:
-            items[i] = {**d, **upd}
-            _save_json(DISCOUNTS_JSON, items)
-            return items[i]
-    return None
+    return _update_record(DISCOUNTS_JSON, "id", discount_id, upd)
 
 
+@_backend_api
 def delete_discount(discount_id: str) -> bool:
-    items = _read_discounts_list()
-    new_items = [d for d in items if d.get("id") != discount_id]
-    if len(new_items) == len(items):
-        return False
-    _save_json(DISCOUNTS_JSON, new_items)
-    _remove_discount_from_cuponera_calendars(discount_id)
+    with unit_of_work(DISCOUNTS_JSON, CUPONERAS_JSON) as uow:
+        if not uow.remove_where(DISCOUNTS_JSON, lambda d: d.get("id") == discount_id):
+            return False
+        _remove_discount_from_cuponera_calendars(uow, discount_id)
     return True
 
 
-def _remove_discount_from_cuponera_calendars(discount_id: str) -> int:
-    """Quita discount_id de todos los calendarios de cuponeras."""
-    cuponeras = read_cuponeras()
+def _remove_discount_from_cuponera_calendars(uow: UnitOfWork, discount_id: str) -> int:
+    """Quita discount_id de los calendarios de las cuponeras que lo usan (según el índice inverso)."""
     modified = 0
-    for c in cuponeras:
+    for cuponera_id in get_discount_cuponera_dates(discount_id):
+        i = uow.find(CUPONERAS_JSON, "id", cuponera_id)
+        if i is None:
+            continue
+        c = uow.items(CUPONERAS_JSON)[i]
         cal = c.get("calendar") or {}
         new_cal = {}
         changed = False
@@ -156,225 +877,293 @@ def _remove_discount_from_cuponera_calendars(discount_id: str) -> int:
             if new_ids:
                 new_cal[date_key] = new_ids
         if changed:
-            update_cuponera(c["id"], {"calendar": new_cal})
+            uow.replace(CUPONERAS_JSON, i, {**c, "calendar": new_cal})
             modified += 1
     return modified
 
 
+@_backend_api
+def get_discount_cuponera_dates(discount_id: str) -> dict[str, list[str]]:
+    """Dónde está programado un descuento: {cuponera_id: [fechas]} (índice inverso del calendario)."""
+    _, index = _load_indexed(CUPONERAS_JSON, "calendar")
+    return {cid: list(dates) for cid, dates in (index.get(discount_id) or {}).items()}
+
+
+@_backend_api
 def write_discounts(data: list[dict]):
     _save_json(DISCOUNTS_JSON, data if data else [])
 
 
 # --- Folders ---
 def _read_folders_list() -> list[dict]:
-    data = _load_json(FOLDERS_JSON, [])
-    return data if isinstance(data, list) else []
+    return _load_list(FOLDERS_JSON)
 
 
+@_backend_api
 def read_folders() -> list[dict]:
-    return _read_folders_list()
+    return list(_read_folders_list())
 
 
+@_backend_api
 def get_folder(folder_id: str) -> dict | None:
-    for f in _read_folders_list():
-        if f.get("id") == folder_id:
-            return f
-    return None
+    return _get_record(FOLDERS_JSON, "id", folder_id)
 
 
+@_backend_api
 def insert_folder(doc: dict) -> dict:
-    items = _read_folders_list()
-    items.append(doc)
-    _save_json(FOLDERS_JSON, items)
-    return doc
+    return _insert_record(FOLDERS_JSON, doc)
 
 
+@_backend_api
 def update_folder(folder_id: str, upd: dict) -> dict | None:
-    items = _read_folders_list()
-    for i, f in enumerate(items):
-        if f.get("id") == folder_id:
-            old_name = str(f.get("name") or "").strip()
-            items[i] = {**f, **upd}
-            new_name = str(items[i].get("name") or "").strip()
-            _save_json(FOLDERS_JSON, items)
-            if old_name and new_name and old_name != new_name:
-                _update_folder_refs(old_name, new_name)
-            return items[i]
-    return None
-
-
-def _update_folder_refs(old_name: str, new_name: str):
-    """Actualiza referencias de folder en descuentos y cuponeras al renombrar."""
-    changed_d, changed_c = False, False
-    items_d = _read_discounts_list()
-    for i, d in enumerate(items_d):
-        if d.get("folder") == old_name:
-            items_d[i] = {**d, "folder": new_name}
-            changed_d = True
-    if changed_d:
-        _save_json(DISCOUNTS_JSON, items_d)
-    items_c = _read_cuponeras_list()
-    for i, c in enumerate(items_c):
-        if c.get("folder") == old_name:
-            items_c[i] = {**c, "folder": new_name}
-            changed_c = True
-    if changed_c:
-        _save_json(CUPONERAS_JSON, items_c)
+    with unit_of_work(FOLDERS_JSON, DISCOUNTS_JSON, CUPONERAS_JSON) as uow:
+        i = uow.find(FOLDERS_JSON, "id", folder_id)
+        if i is None:
+            return None
+        f = uow.items(FOLDERS_JSON)[i]
+        old_name = str(f.get("name") or "").strip()
+        updated = {**f, **upd}
+        uow.replace(FOLDERS_JSON, i, updated)
+        new_name = str(updated.get("name") or "").strip()
+        if old_name and new_name and old_name != new_name:
+            _update_folder_refs(uow, old_name, new_name)
+    return updated
+
+
+def _update_folder_refs(uow: UnitOfWork, old_name: str, new_name: str) -> tuple[int, int]:
+    """Actualiza referencias de folder en descuentos y cuponeras (renombrar o vaciar)."""
+    d_count = uow.update_where(DISCOUNTS_JSON, lambda d: d.get("folder") == old_name, {"folder": new_name})
+    c_count = uow.update_where(CUPONERAS_JSON, lambda c: c.get("folder") == old_name, {"folder": new_name})
+    return d_count, c_count
 
 
+@_backend_api
 def delete_folder_only(folder_id: str) -> bool:
-    items = _read_folders_list()
-    new_items = [f for f in items if f.get("id") != folder_id]
-    if len(new_items) == len(items):
-        return False
-    _save_json(FOLDERS_JSON, new_items)
-    return True
+    return _delete_records(FOLDERS_JSON, "id", folder_id)
 
 
+@_backend_api
 def delete_folder_by_id(folder_id: str) -> bool:
-    doc = get_folder(folder_id)
-    if not doc:
-        return False
-    folder_name = (doc.get("name") or "").strip()
-    if folder_name:
-        cascade_clear_folder(folder_name)
-    return delete_folder_only(folder_id)
+    with unit_of_work(FOLDERS_JSON, DISCOUNTS_JSON, CUPONERAS_JSON) as uow:
+        doc = get_folder(folder_id)
+        if not doc:
+            return False
+        folder_name = (doc.get("name") or "").strip()
+        if folder_name:
+            _update_folder_refs(uow, folder_name, "")
+        uow.remove_where(FOLDERS_JSON, lambda f: f.get("id") == folder_id)
+    return True
 
 
+@_backend_api
 def cascade_clear_folder(folder_name: str) -> tuple[int, int]:
     """Pone folder='' en todos los descuentos y cuponeras que usan esta carpeta."""
     if not folder_name:
         return 0, 0
-    d_count, c_count = 0, 0
-    items_d = _read_discounts_list()
-    for i, d in enumerate(items_d):
-        if d.get("folder") == folder_name:
-            items_d[i] = {**d, "folder": ""}
-            d_count += 1
-    if d_count:
-        _save_json(DISCOUNTS_JSON, items_d)
-    items_c = _read_cuponeras_list()
-    for i, c in enumerate(items_c):
-        if c.get("folder") == folder_name:
-            items_c[i] = {**c, "folder": ""}
-            c_count += 1
-    if c_count:
-        _save_json(CUPONERAS_JSON, items_c)
-    return d_count, c_count
+    with unit_of_work(DISCOUNTS_JSON, CUPONERAS_JSON) as uow:
+        return _update_folder_refs(uow, folder_name, "")
 
 
+@_backend_api
 def write_folders(data: list[dict]):
     _save_json(FOLDERS_JSON, data if data else [])
 
 
 # --- Cuponeras ---
 def _read_cuponeras_list() -> list[dict]:
-    data = _load_json(CUPONERAS_JSON, [])
-    return data if isinstance(data, list) else []
+    return _load_list(CUPONERAS_JSON)
 
 
+@_backend_api
 def read_cuponeras() -> list[dict]:
-    return _read_cuponeras_list()
+    return list(_read_cuponeras_list())
 
 
+@_backend_api
 def get_cuponera(cuponera_id: str) -> dict | None:
-    for c in _read_cuponeras_list():
-        if c.get("id") == cuponera_id:
-            return c
-    return None
+    return _get_record(CUPONERAS_JSON, "id", cuponera_id)
 
 
+@_backend_api
 def insert_cuponera(doc: dict) -> dict:
-    items = _read_cuponeras_list()
-    items.append(doc)
-    _save_json(CUPONERAS_JSON, items)
-    return doc
+    return _insert_record(CUPONERAS_JSON, doc)
 
 
+@_backend_api
 def update_cuponera(cuponera_id: str, upd: dict) -> dict | None:
-    items = _read_cuponeras_list()
-    for i, c in enumerate(items):
-        if c.get("id") == cuponera_id:
-            items[i] = {**c, **upd}
-            _save_json(CUPONERAS_JSON, items)
-            return items[i]
-    return None
+    return _update_record(CUPONERAS_JSON, "id", cuponera_id, upd)
 
 
+@_backend_api
 def delete_cuponera(cuponera_id: str) -> bool:
-    items = _read_cuponeras_list()
-    new_items = [c for c in items if c.get("id") != cuponera_id]
-    if len(new_items) == len(items):
-        return False
-    _save_json(CUPONERAS_JSON, new_items)
-    users = _read_cuponera_users_list()
-    new_users = [u for u in users if u.get("cuponera_id") != cuponera_id]
-    _save_json(CUPONERA_USERS_JSON, new_users)
-    usage = read_cuponera_usage()
-    new_usage = [u for u in usage if u.get("cuponera_id") != cuponera_id]
-    write_cuponera_usage(new_usage)
+    with unit_of_work(CUPONERAS_JSON, CUPONERA_USERS_JSON, CUPONERA_USAGE_DIR) as uow:
+        pos = uow.find(CUPONERAS_JSON, "id", cuponera_id)
+        if pos is None:
+            return False
+        uow.remove_where(CUPONERAS_JSON, lambda c: c.get("id") == cuponera_id)
+        uow.remove_where(CUPONERA_USERS_JSON, lambda u: u.get("cuponera_id") == cuponera_id)
+        _usage.remove_cuponera(cuponera_id)
     return True
 
 
+@_backend_api
 def write_cuponeras(data: list[dict]):
     _save_json(CUPONERAS_JSON, data if data else [])
 
 
-# --- Cuponera usage ---
+# --- Cuponera usage (particiones mensuales: snapshot + log append-only) ---
+def _load_usage_snapshot(path: str, default):
+    """Snapshot de usos sin pasar por la caché: la tabla ya vive en el ledger."""
+    return _load_json(path, default, cache=False)
+
+
+def _save_usage_snapshot(path: str, data: dict):
+    _save_json(path, data, cache=False)
+
+
+_usage = PartitionedUsage(
+    CUPONERA_USAGE_DIR,
+    CUPONERA_USAGE_ARCHIVE_DIR,
+    USAGE_LOG_COMPACT_EVERY,
+    load_snapshot=_load_usage_snapshot,
+    save_snapshot=_save_usage_snapshot,
+    lock=lambda path: _file_transaction(path),
+    signature=_data_signature,
+)
+
+
+@_backend_api
 def read_cuponera_usage() -> list[dict]:
-    data = _load_json(CUPONERA_USAGE_JSON, [])
-    return data if isinstance(data, list) else []
+    return _usage.records()
 
 
+@_backend_api
 def write_cuponera_usage(data: list[dict]):
-    _save_json(CUPONERA_USAGE_JSON, data if data else [])
+    """Reemplaza todos los registros de uso (reescribe las particiones y descarta sus logs)."""
+    _usage.replace(data if data else [])
+
+
+@_backend_api
+def get_cuponera_usage_count(cuponera_id: str, user_code: str, date: str) -> int:
+    return _usage.get(usage_key(cuponera_id, user_code, date))
+
+
+@_backend_api
+def increment_cuponera_usage(cuponera_id: str, user_code: str, date: str) -> int:
+    """Registra un uso (una línea en el log del mes). Devuelve el total de usos de ese día."""
+    return _usage.increment(usage_key(cuponera_id, user_code, date))
+
+
+@_backend_api
+def consume_cuponera_usage(cuponera_id: str, user_code: str, date: str, limit: int) -> tuple[bool, int]:
+    """
+    Registra un uso solo si el código lleva menos de limit ese día, en una sola operación
+    atómica (lock de la partición del mes). Devuelve (consumido, total de usos del día).
+    """
+    return _usage.consume(usage_key(cuponera_id, user_code, date), limit)
+
+
+@_backend_api
+def consume_cuponera_usage_many(requests: list[tuple]) -> list[tuple[bool, int, bool]]:
+    """
+    consume_cuponera_usage para varios (cuponera_id, user_code, date, limit[, clave de idempotencia])
+    en orden; limit None solo lee el total. Los usos consumidos se escriben juntos (una escritura
+    por mes). Devuelve (consumido, total, repetido): repetido si la clave ya había consumido un
+    uso de ese código y fecha; entonces no se consume otro y el total es el de ese uso.
+    """
+    return _usage.consume_many([(usage_key(cid, code, d), limit, *rest) for cid, code, d, limit, *rest in requests])
+
+
+@_backend_api
+def reset_cuponera_usage(cuponera_id: str, user_code: str, date: str) -> bool:
+    """Borra los usos de un código en una fecha. True si había registro."""
+    return _usage.reset(usage_key(cuponera_id, user_code, date))
+
+
+def _migrate_flat_cuponera_usage():
+    """Reparte el formato anterior (cuponera_usage.json + .log) en particiones mensuales."""
+    if _data_signature(CUPONERA_USAGE_JSON) is None and not os.path.exists(CUPONERA_USAGE_LOG):
+        return
+    with _file_transaction(CUPONERA_USAGE_DIR, CUPONERA_USAGE_JSON):
+        legacy = UsageLedger(
+            CUPONERA_USAGE_JSON,
+            CUPONERA_USAGE_LOG,
+            0,
+            load_snapshot=_load_usage_snapshot,
+            save_snapshot=_save_usage_snapshot,
+            lock=lambda: _file_transaction(CUPONERA_USAGE_JSON),
+            signature=_data_signature,
+        )
+        records = legacy.records()
+        _usage.merge(records)
+        for path in (CUPONERA_USAGE_JSON, CUPONERA_USAGE_JSON + ".bin", CUPONERA_USAGE_LOG):
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+    logger.info("Usos migrados a particiones mensuales: %s registros", len(records))
+
+
+@_backend_api
+def compact_cuponera_usage():
+    """Migra el formato anterior si existe y vuelca el log de cada partición en su snapshot."""
+    _migrate_flat_cuponera_usage()
+    _usage.compact()
+
+
+@_backend_api
+def archive_cuponera_usage() -> list[str]:
+    """
+    Archiva (gzip en CUPONERA_USAGE_ARCHIVE_DIR) las particiones más viejas que
+    USAGE_RETENTION_MONTHS meses completos antes del actual. Retorna los meses archivados.
+    """
+    if USAGE_RETENTION_MONTHS <= 0:
+        return []
+    today = date.today()
+    months = today.year * 12 + today.month - 1 - USAGE_RETENTION_MONTHS
+    cutoff = f"{months // 12:04d}-{months % 12 + 1:02d}"
+    with _file_transaction(CUPONERA_USAGE_DIR):
+        return _usage.archive_before(cutoff)
 
 
 # --- Cuponera users ---
 def _read_cuponera_users_list() -> list[dict]:
-    data = _load_json(CUPONERA_USERS_JSON, [])
-    return data if isinstance(data, list) else []
+    return _load_list(CUPONERA_USERS_JSON)
 
 
+@_backend_api
 def read_cuponera_users() -> list[dict]:
-    return _read_cuponera_users_list()
+    return list(_read_cuponera_users_list())
 
 
+@_backend_api
 def get_cuponera_user(cuponera_id: str, user_id: str) -> dict | None:
-    for u in _read_cuponera_users_list():
-        if u.get("cuponera_id") == cuponera_id and u.get("id") == user_id:
-            return u
-    return None
+    return _get_record(CUPONERA_USERS_JSON, "user", (cuponera_id, user_id))
 
 
+@_backend_api
 def insert_cuponera_user(doc: dict) -> dict:
-    items = _read_cuponera_users_list()
-    items.append(doc)
-    _save_json(CUPONERA_USERS_JSON, items)
-    return doc
+    return _insert_record(CUPONERA_USERS_JSON, doc)
+
 
+@_backend_api
+def find_cuponera_users_by_code(code: str) -> list[dict]:
+    """Usuarios (de cualquier cuponera) con ese código, comparado normalizado."""
+    code_upper = normalize_code(code)
+    if not code_upper:
+        return []
+    return _find_records(CUPONERA_USERS_JSON, "code", code_upper)
 
+
+@_backend_api
 def update_cuponera_user(cuponera_id: str, user_id: str, upd: dict) -> dict | None:
-    items = _read_cuponera_users_list()
-    for i, u in enumerate(items):
-        if u.get("cuponera_id") == cuponera_id and u.get("id") == user_id:
-            items[i] = {**u, **upd}
-            _save_json(CUPONERA_USERS_JSON, items)
-            return items[i]
-    return None
+    return _update_record(CUPONERA_USERS_JSON, "user", (cuponera_id, user_id), upd)
 
 
+@_backend_api
 def delete_cuponera_user(cuponera_id: str, user_id: str) -> bool:
-    items = _read_cuponera_users_list()
-    new_items = [
-        u for u in items
-        if not (u.get("cuponera_id") == cuponera_id and u.get("id") == user_id)
-    ]
-    if len(new_items) == len(items):
-        return False
-    _save_json(CUPONERA_USERS_JSON, new_items)
-    return True
+    return _delete_records(CUPONERA_USERS_JSON, "user", (cuponera_id, user_id))
 
 
+@_backend_api
 def write_cuponera_users(data: list[dict]):
     _save_json(CUPONERA_USERS_JSON, data if data else [])
+
@@ -0,0 +1,140 @@
+"""Fachada async de storage para el código que corre en el event loop.
+
+Las funciones de storage son bloqueantes (leen y escriben archivos, parsean y serializan
+JSON); aquí se ejecutan en pools de hilos propios para que una escritura grande, como la
+de un menú, no detenga el resto de peticiones async:
+- run_read(): lecturas de las peticiones (cachés en memoria, planes del día, conteos de
+  usos), pool de API_THREADPOOL_SIZE hilos: el mismo paralelismo que las rutas síncronas.
+- run(): escrituras de las peticiones (lotes de canjes), pool de STORAGE_THREADS hilos.
+- run_background(): trabajo de fondo (sincronización, exportaciones, archivado), pool de
+  SYNC_CONCURRENCY hilos, así una sincronización no deja sin hilos a los canjes.
+
+Los consumos de usos concurrentes se agrupan (group commit): mientras se escribe un lote
+se acumulan los siguientes, que van juntos en la próxima escritura.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import storage
+from config import API_THREADPOOL_SIZE, STORAGE_THREADS, SYNC_CONCURRENCY
+
+
+def _new_executors() -> tuple[ThreadPoolExecutor, ThreadPoolExecutor, ThreadPoolExecutor]:
+    return (
+        ThreadPoolExecutor(max_workers=max(1, STORAGE_THREADS), thread_name_prefix="storage"),
+        ThreadPoolExecutor(max_workers=max(1, API_THREADPOOL_SIZE), thread_name_prefix="storage-read"),
+        ThreadPoolExecutor(max_workers=max(1, SYNC_CONCURRENCY), thread_name_prefix="storage-bg"),
+    )
+
+
+_executor, _reads, _background = _new_executors()
+
+
+async def run(fn, *args, **kwargs):
+    """Ejecuta fn(*args, **kwargs) en el pool de storage y devuelve su resultado."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+async def run_read(fn, *args, **kwargs):
+    """Como run(), en el pool de lecturas de las peticiones."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_reads, partial(fn, *args, **kwargs))
+
+
+async def run_background(fn, *args, **kwargs):
+    """Como run(), en el pool de trabajo de fondo."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_background, partial(fn, *args, **kwargs))
+
+
+def drain():
+    """Espera las operaciones en curso (al apagar la API, antes de exportar lo pendiente)."""
+    global _executor, _reads, _background
+    executors = (_executor, _reads, _background)
+    _executor, _reads, _background = _new_executors()
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+# --- Sedes y menús ---
+async def read_sites_filtered() -> list[dict]:
+    return await run_read(storage.read_sites_filtered)
+
+
+async def write_sites(data: list[dict]) -> bool:
+    return await run_background(storage.write_sites, data)
+
+
+async def read_menu(site_id: int) -> dict | None:
+    return await run_read(storage.read_menu, site_id)
+
+
+async def write_menu(site_id: int, data: dict) -> bool:
+    return await run_background(storage.write_menu, site_id, data)
+
+
+async def list_menu_site_ids() -> list[int]:
+    return await run_background(storage.list_menu_site_ids)
+
+
+# --- Usos de cuponera ---
+class _UsageBatcher:
+    """Agrupa los consume_cuponera_usage concurrentes en una escritura (consume_cuponera_usage_many)."""
+
+    def __init__(self):
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+        self._flushing: asyncio.Task | None = None
+
+    async def consume(self, request: tuple) -> tuple[bool, int, bool]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        if self._flushing is None or self._flushing.done():
+            self._flushing = loop.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                results = await run(storage.consume_cuponera_usage_many, [request for request, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+_usage_batcher = _UsageBatcher()
+
+
+async def get_cuponera_usage_count(cuponera_id: str, user_code: str, date: str) -> int:
+    return await run_read(storage.get_cuponera_usage_count, cuponera_id, user_code, date)
+
+
+async def consume_cuponera_usage(
+    cuponera_id: str, user_code: str, date: str, limit: int, request_key: str | None = None
+) -> tuple[bool, int, bool]:
+    """
+    storage.consume_cuponera_usage_many de un solo consumo, escrito junto con los demás en curso.
+    Devuelve (consumido, total, repetido); repetido si request_key ya había consumido un uso.
+    """
+    return await _usage_batcher.consume((cuponera_id, user_code, date, limit, request_key))
+
+
+async def consume_cuponera_usage_many(requests: list[tuple]) -> list[tuple[bool, int, bool]]:
+    return await run(storage.consume_cuponera_usage_many, requests)
+
+
+# --- Mantenimiento ---
+async def flush_json_exports() -> int:
+    return await run_background(storage.flush_json_exports)
+
+
+async def archive_cuponera_usage() -> list[str]:
+    return await run_background(storage.archive_cuponera_usage)
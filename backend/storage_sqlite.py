@@ -0,0 +1,597 @@
+"""Almacenamiento en SQLite (modo WAL) con la misma API que storage.py.
+
+Se activa con STORAGE_BACKEND=sqlite. Cada colección es una tabla con el documento
+completo en JSON (columna doc) más las columnas indexadas que se consultan (id,
+cuponera_id, código normalizado, folder). Las escrituras son por fila y las lecturas
+por índice. Sedes y menús siguen en archivos JSON (ver storage.py).
+"""
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date as _date
+
+from config import CUPONERA_USAGE_ARCHIVE_DIR, SQLITE_PATH, USAGE_RETENTION_MONTHS
+from usage_ledger import remove_archived_cuponera, usage_partition
+from utils import normalize_code
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS discounts (
+    id TEXT PRIMARY KEY,
+    folder TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_discounts_folder ON discounts (folder);
+
+CREATE TABLE IF NOT EXISTS folders (
+    id TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS cuponeras (
+    id TEXT PRIMARY KEY,
+    folder TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_cuponeras_folder ON cuponeras (folder);
+
+-- Índice inverso del calendario: dónde está programado cada descuento
+CREATE TABLE IF NOT EXISTS cuponera_calendar (
+    discount_id TEXT NOT NULL,
+    cuponera_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (discount_id, cuponera_id, date)
+);
+CREATE INDEX IF NOT EXISTS ix_cuponera_calendar_cuponera ON cuponera_calendar (cuponera_id);
+
+CREATE TABLE IF NOT EXISTS cuponera_users (
+    cuponera_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    code TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (cuponera_id, id)
+);
+CREATE INDEX IF NOT EXISTS ix_cuponera_users_code ON cuponera_users (code);
+
+CREATE TABLE IF NOT EXISTS cuponera_usage (
+    cuponera_id TEXT NOT NULL,
+    user_code TEXT NOT NULL,
+    date TEXT NOT NULL,
+    uses_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (cuponera_id, user_code, date)
+);
+CREATE INDEX IF NOT EXISTS ix_cuponera_usage_date ON cuponera_usage (date);
+
+-- Clave de idempotencia de cada uso consumido con una (total del día tras ese uso)
+CREATE TABLE IF NOT EXISTS cuponera_usage_requests (
+    cuponera_id TEXT NOT NULL,
+    user_code TEXT NOT NULL,
+    date TEXT NOT NULL,
+    request_key TEXT NOT NULL,
+    uses_count INTEGER NOT NULL,
+    PRIMARY KEY (cuponera_id, user_code, date, request_key)
+);
+"""
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _conn() -> sqlite3.Connection:
+    """Conexión por hilo (FastAPI ejecuta los handlers síncronos en un threadpool)."""
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    os.makedirs(os.path.dirname(SQLITE_PATH) or ".", exist_ok=True)
+    # isolation_level=None: autocommit; las transacciones se abren explícitamente en transaction()
+    conn = sqlite3.connect(SQLITE_PATH, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(_SCHEMA)
+            _schema_ready = True
+            _local.conn, _local.depth = conn, 0
+            _backfill_calendar()
+    _local.conn = conn
+    _local.depth = 0
+    return conn
+
+
+@contextmanager
+def transaction(*collections: str):
+    """
+    Transacción de escritura (BEGIN IMMEDIATE). Es reentrante por hilo; las colecciones
+    se aceptan por compatibilidad con storage.transaction (SQLite bloquea toda la base).
+    """
+    conn = _conn()
+    if _local.depth == 0:
+        conn.execute("BEGIN IMMEDIATE")
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.execute("ROLLBACK")
+        raise
+    _local.depth -= 1
+    if _local.depth == 0:
+        conn.execute("COMMIT")
+
+
+def _dump(doc: dict) -> str:
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":"))
+
+
+def _docs(rows) -> list[dict]:
+    return [json.loads(r[0]) for r in rows]
+
+
+def _one(rows) -> dict | None:
+    row = rows.fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _set_calendar_refs(cuponera_id: str, cuponera: dict | None):
+    """Sincroniza cuponera_calendar con el calendario de la cuponera (None = borrada)."""
+    conn = _conn()
+    conn.execute("DELETE FROM cuponera_calendar WHERE cuponera_id = ?", (cuponera_id,))
+    if not cuponera:
+        return
+    rows = []
+    for date_key, ids in (cuponera.get("calendar") or {}).items():
+        if isinstance(ids, list):
+            rows.extend((did, cuponera_id, date_key) for did in ids)
+    conn.executemany(
+        "INSERT OR IGNORE INTO cuponera_calendar (discount_id, cuponera_id, date) VALUES (?, ?, ?)", rows
+    )
+
+
+def _backfill_calendar():
+    """Llena cuponera_calendar en bases creadas antes de que existiera la tabla."""
+    conn = _conn()
+    if conn.execute("SELECT 1 FROM cuponera_calendar LIMIT 1").fetchone():
+        return
+    with transaction():
+        for c in read_cuponeras():
+            _set_calendar_refs(c.get("id"), c)
+
+
+# --- Discounts ---
+def read_discounts() -> list[dict]:
+    return _docs(_conn().execute("SELECT doc FROM discounts ORDER BY rowid"))
+
+
+def get_discount(discount_id: str) -> dict | None:
+    return _one(_conn().execute("SELECT doc FROM discounts WHERE id = ?", (discount_id,)))
+
+
+def insert_discount(doc: dict) -> dict:
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO discounts (id, folder, doc) VALUES (?, ?, ?)",
+            (doc.get("id"), doc.get("folder"), _dump(doc)),
+        )
+    return doc
+
+
+def update_discount(discount_id: str, upd: dict) -> dict | None:
+    with transaction() as conn:
+        d = get_discount(discount_id)
+        if d is None:
+            return None
+        d = {**d, **upd}
+        conn.execute(
+            "UPDATE discounts SET folder = ?, doc = ? WHERE id = ?",
+            (d.get("folder"), _dump(d), discount_id),
+        )
+    return d
+
+
+def delete_discount(discount_id: str) -> bool:
+    with transaction() as conn:
+        if conn.execute("DELETE FROM discounts WHERE id = ?", (discount_id,)).rowcount == 0:
+            return False
+        _remove_discount_from_cuponera_calendars(discount_id)
+    return True
+
+
+def _remove_discount_from_cuponera_calendars(discount_id: str) -> int:
+    """Quita discount_id de los calendarios de las cuponeras que lo usan (según cuponera_calendar)."""
+    modified = 0
+    with transaction() as conn:
+        rows = conn.execute(
+            "SELECT doc FROM cuponeras WHERE id IN "
+            "(SELECT DISTINCT cuponera_id FROM cuponera_calendar WHERE discount_id = ?)",
+            (discount_id,),
+        ).fetchall()
+        for c in _docs(rows):
+            cal = c.get("calendar") or {}
+            new_cal = {}
+            changed = False
+            for date_key, ids in cal.items():
+                if not isinstance(ids, list):
+                    new_cal[date_key] = ids
+                    continue
+                new_ids = [x for x in ids if x != discount_id]
+                if new_ids != ids:
+                    changed = True
+                if new_ids:
+                    new_cal[date_key] = new_ids
+            if changed:
+                update_cuponera(c["id"], {"calendar": new_cal})
+                modified += 1
+    return modified
+
+
+def get_discount_cuponera_dates(discount_id: str) -> dict[str, list[str]]:
+    """Dónde está programado un descuento: {cuponera_id: [fechas]}."""
+    out: dict[str, list[str]] = {}
+    rows = _conn().execute(
+        "SELECT cuponera_id, date FROM cuponera_calendar WHERE discount_id = ? ORDER BY cuponera_id, date",
+        (discount_id,),
+    )
+    for cid, d in rows:
+        out.setdefault(cid, []).append(d)
+    return out
+
+
+def write_discounts(data: list[dict]):
+    with transaction() as conn:
+        conn.execute("DELETE FROM discounts")
+        conn.executemany(
+            "INSERT OR REPLACE INTO discounts (id, folder, doc) VALUES (?, ?, ?)",
+            [(d.get("id"), d.get("folder"), _dump(d)) for d in data or []],
+        )
+
+
+# --- Folders ---
+def read_folders() -> list[dict]:
+    return _docs(_conn().execute("SELECT doc FROM folders ORDER BY rowid"))
+
+
+def get_folder(folder_id: str) -> dict | None:
+    return _one(_conn().execute("SELECT doc FROM folders WHERE id = ?", (folder_id,)))
+
+
+def insert_folder(doc: dict) -> dict:
+    with transaction() as conn:
+        conn.execute("INSERT INTO folders (id, doc) VALUES (?, ?)", (doc.get("id"), _dump(doc)))
+    return doc
+
+
+def update_folder(folder_id: str, upd: dict) -> dict | None:
+    with transaction() as conn:
+        f = get_folder(folder_id)
+        if f is None:
+            return None
+        old_name = str(f.get("name") or "").strip()
+        f = {**f, **upd}
+        new_name = str(f.get("name") or "").strip()
+        conn.execute("UPDATE folders SET doc = ? WHERE id = ?", (_dump(f), folder_id))
+        if old_name and new_name and old_name != new_name:
+            _set_folder_refs(old_name, new_name)
+    return f
+
+
+def _set_folder_refs(old_name: str, new_name: str) -> tuple[int, int]:
+    """Cambia folder=old_name por new_name en descuentos y cuponeras."""
+    counts = []
+    with transaction() as conn:
+        for table in ("discounts", "cuponeras"):
+            rows = conn.execute(f"SELECT doc FROM {table} WHERE folder = ?", (old_name,)).fetchall()
+            docs = [{**d, "folder": new_name} for d in _docs(rows)]
+            conn.executemany(
+                f"UPDATE {table} SET folder = ?, doc = ? WHERE id = ?",
+                [(new_name, _dump(d), d.get("id")) for d in docs],
+            )
+            counts.append(len(docs))
+    return counts[0], counts[1]
+
+
+def delete_folder_only(folder_id: str) -> bool:
+    with transaction() as conn:
+        return conn.execute("DELETE FROM folders WHERE id = ?", (folder_id,)).rowcount > 0
+
+
+def delete_folder_by_id(folder_id: str) -> bool:
+    with transaction():
+        doc = get_folder(folder_id)
+        if not doc:
+            return False
+        folder_name = (doc.get("name") or "").strip()
+        if folder_name:
+            cascade_clear_folder(folder_name)
+        return delete_folder_only(folder_id)
+
+
+def cascade_clear_folder(folder_name: str) -> tuple[int, int]:
+    """Pone folder='' en todos los descuentos y cuponeras que usan esta carpeta."""
+    if not folder_name:
+        return 0, 0
+    return _set_folder_refs(folder_name, "")
+
+
+def write_folders(data: list[dict]):
+    with transaction() as conn:
+        conn.execute("DELETE FROM folders")
+        conn.executemany(
+            "INSERT OR REPLACE INTO folders (id, doc) VALUES (?, ?)",
+            [(f.get("id"), _dump(f)) for f in data or []],
+        )
+
+
+# --- Cuponeras ---
+def read_cuponeras() -> list[dict]:
+    return _docs(_conn().execute("SELECT doc FROM cuponeras ORDER BY rowid"))
+
+
+def get_cuponera(cuponera_id: str) -> dict | None:
+    return _one(_conn().execute("SELECT doc FROM cuponeras WHERE id = ?", (cuponera_id,)))
+
+
+def insert_cuponera(doc: dict) -> dict:
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO cuponeras (id, folder, doc) VALUES (?, ?, ?)",
+            (doc.get("id"), doc.get("folder"), _dump(doc)),
+        )
+        _set_calendar_refs(doc.get("id"), doc)
+    return doc
+
+
+def update_cuponera(cuponera_id: str, upd: dict) -> dict | None:
+    with transaction() as conn:
+        c = get_cuponera(cuponera_id)
+        if c is None:
+            return None
+        c = {**c, **upd}
+        conn.execute(
+            "UPDATE cuponeras SET folder = ?, doc = ? WHERE id = ?",
+            (c.get("folder"), _dump(c), cuponera_id),
+        )
+        if "calendar" in upd:
+            _set_calendar_refs(cuponera_id, c)
+    return c
+
+
+def delete_cuponera(cuponera_id: str) -> bool:
+    with transaction() as conn:
+        if conn.execute("DELETE FROM cuponeras WHERE id = ?", (cuponera_id,)).rowcount == 0:
+            return False
+        _set_calendar_refs(cuponera_id, None)
+        conn.execute("DELETE FROM cuponera_users WHERE cuponera_id = ?", (cuponera_id,))
+        conn.execute("DELETE FROM cuponera_usage WHERE cuponera_id = ?", (cuponera_id,))
+        conn.execute("DELETE FROM cuponera_usage_requests WHERE cuponera_id = ?", (cuponera_id,))
+        remove_archived_cuponera(CUPONERA_USAGE_ARCHIVE_DIR, cuponera_id)
+    return True
+
+
+def write_cuponeras(data: list[dict]):
+    with transaction() as conn:
+        conn.execute("DELETE FROM cuponeras")
+        conn.execute("DELETE FROM cuponera_calendar")
+        conn.executemany(
+            "INSERT OR REPLACE INTO cuponeras (id, folder, doc) VALUES (?, ?, ?)",
+            [(c.get("id"), c.get("folder"), _dump(c)) for c in data or []],
+        )
+        for c in data or []:
+            _set_calendar_refs(c.get("id"), c)
+
+
+# --- Cuponera usage ---
+def read_cuponera_usage() -> list[dict]:
+    rows = _conn().execute(
+        "SELECT cuponera_id, user_code, date, uses_count FROM cuponera_usage ORDER BY rowid"
+    )
+    return [
+        {"cuponera_id": cid, "user_code": code, "date": d, "uses_count": n}
+        for cid, code, d, n in rows
+    ]
+
+
+def write_cuponera_usage(data: list[dict]):
+    with transaction() as conn:
+        conn.execute("DELETE FROM cuponera_usage")
+        conn.execute("DELETE FROM cuponera_usage_requests")
+        conn.executemany(
+            "INSERT OR IGNORE INTO cuponera_usage (cuponera_id, user_code, date, uses_count) VALUES (?, ?, ?, ?)",
+            [
+                (str(r.get("cuponera_id") or ""), normalize_code(r.get("user_code")), str(r.get("date") or ""), int(r.get("uses_count") or 0))
+                for r in data or []
+            ],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO cuponera_usage_requests (cuponera_id, user_code, date, request_key, uses_count) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (str(r.get("cuponera_id") or ""), normalize_code(r.get("user_code")), str(r.get("date") or ""), k, int(n))
+                for r in data or []
+                for k, n in (r.get("request_keys") or {}).items()
+            ],
+        )
+
+
+def get_cuponera_usage_count(cuponera_id: str, user_code: str, date: str) -> int:
+    row = _conn().execute(
+        "SELECT uses_count FROM cuponera_usage WHERE cuponera_id = ? AND user_code = ? AND date = ?",
+        (str(cuponera_id or ""), normalize_code(user_code), str(date or "")),
+    ).fetchone()
+    return int(row[0]) if row else 0
+
+
+def increment_cuponera_usage(cuponera_id: str, user_code: str, date: str) -> int:
+    """Registra un uso. Devuelve el total de usos de ese día."""
+    key = (str(cuponera_id or ""), normalize_code(user_code), str(date or ""))
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO cuponera_usage (cuponera_id, user_code, date, uses_count) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (cuponera_id, user_code, date) DO UPDATE SET uses_count = uses_count + 1",
+            key,
+        )
+        return get_cuponera_usage_count(*key)
+
+
+def consume_cuponera_usage(cuponera_id: str, user_code: str, date: str, limit: int) -> tuple[bool, int]:
+    """Registra un uso solo si el total del día es menor que limit (un solo UPSERT). Devuelve (consumido, total)."""
+    key = (str(cuponera_id or ""), normalize_code(user_code), str(date or ""))
+    with transaction() as conn:
+        consumed = False
+        if limit > 0:
+            cur = conn.execute(
+                "INSERT INTO cuponera_usage (cuponera_id, user_code, date, uses_count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (cuponera_id, user_code, date) DO UPDATE SET uses_count = uses_count + 1 "
+                "WHERE uses_count < ?",
+                (*key, limit),
+            )
+            consumed = cur.rowcount > 0
+        return consumed, get_cuponera_usage_count(*key)
+
+
+def consume_cuponera_usage_many(requests: list[tuple]) -> list[tuple[bool, int, bool]]:
+    """
+    consume_cuponera_usage para varios (cuponera_id, user_code, date, limit[, clave de idempotencia])
+    en una transacción; limit None solo lee. Devuelve (consumido, total, repetido), como storage.
+    """
+    results = []
+    with transaction() as conn:
+        for cuponera_id, user_code, date, limit, *rest in requests:
+            key = (str(cuponera_id or ""), normalize_code(user_code), str(date or ""))
+            request_key = rest[0] if rest else None
+            if request_key:
+                row = conn.execute(
+                    "SELECT uses_count FROM cuponera_usage_requests "
+                    "WHERE cuponera_id = ? AND user_code = ? AND date = ? AND request_key = ?",
+                    (*key, request_key),
+                ).fetchone()
+                if row:
+                    results.append((True, int(row[0]), True))
+                    continue
+            if limit is None:
+                results.append((False, get_cuponera_usage_count(*key), False))
+                continue
+            consumed, count = consume_cuponera_usage(*key, limit)
+            if consumed and request_key:
+                conn.execute(
+                    "INSERT INTO cuponera_usage_requests (cuponera_id, user_code, date, request_key, uses_count) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (*key, request_key, count),
+                )
+            results.append((consumed, count, False))
+    return results
+
+
+def reset_cuponera_usage(cuponera_id: str, user_code: str, date: str) -> bool:
+    """Borra los usos de un código en una fecha. True si había registro."""
+    with transaction() as conn:
+        key = (str(cuponera_id or ""), normalize_code(user_code), str(date or ""))
+        conn.execute("DELETE FROM cuponera_usage_requests WHERE cuponera_id = ? AND user_code = ? AND date = ?", key)
+        cur = conn.execute("DELETE FROM cuponera_usage WHERE cuponera_id = ? AND user_code = ? AND date = ?", key)
+        return cur.rowcount > 0
+
+
+def compact_cuponera_usage():
+    """Equivalente a la compactación del log JSON: vuelca el WAL en la base."""
+    _conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def archive_cuponera_usage() -> list[str]:
+    """
+    Mueve a CUPONERA_USAGE_ARCHIVE_DIR (usage_YYYY-MM.json.gz) los usos de meses más viejos
+    que USAGE_RETENTION_MONTHS meses completos antes del actual. Retorna los meses archivados.
+    """
+    if USAGE_RETENTION_MONTHS <= 0:
+        return []
+    today = _date.today()
+    months = today.year * 12 + today.month - 1 - USAGE_RETENTION_MONTHS
+    cutoff = f"{months // 12:04d}-{months % 12 + 1:02d}"
+    with transaction() as conn:
+        rows = conn.execute(
+            "SELECT cuponera_id, user_code, date, uses_count FROM cuponera_usage WHERE date < ?",
+            (cutoff,),
+        ).fetchall()
+        grouped: dict[str, list[dict]] = {}
+        for cid, code, d, n in rows:
+            partition = usage_partition(d)
+            if partition != "other":
+                grouped.setdefault(partition, []).append(
+                    {"cuponera_id": cid, "user_code": code, "date": d, "uses_count": n}
+                )
+        os.makedirs(CUPONERA_USAGE_ARCHIVE_DIR, exist_ok=True)
+        for partition, records in sorted(grouped.items()):
+            archive_path = os.path.join(CUPONERA_USAGE_ARCHIVE_DIR, f"usage_{partition}.json.gz")
+            if os.path.exists(archive_path):
+                with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+                    records = json.load(f) + records
+            tmp_path = archive_path + ".tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(records, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, archive_path)
+            for table in ("cuponera_usage", "cuponera_usage_requests"):
+                conn.execute(f"DELETE FROM {table} WHERE date >= ? AND date < ?", (partition, partition + "~"))
+    return sorted(grouped)
+
+
+# --- Cuponera users ---
+def read_cuponera_users() -> list[dict]:
+    return _docs(_conn().execute("SELECT doc FROM cuponera_users ORDER BY rowid"))
+
+
+def get_cuponera_user(cuponera_id: str, user_id: str) -> dict | None:
+    return _one(_conn().execute(
+        "SELECT doc FROM cuponera_users WHERE cuponera_id = ? AND id = ?", (cuponera_id, user_id)
+    ))
+
+
+def insert_cuponera_user(doc: dict) -> dict:
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO cuponera_users (cuponera_id, id, code, doc) VALUES (?, ?, ?, ?)",
+            (doc.get("cuponera_id"), doc.get("id"), normalize_code(doc.get("code")), _dump(doc)),
+        )
+    return doc
+
+
+def find_cuponera_users_by_code(code: str) -> list[dict]:
+    """Usuarios (de cualquier cuponera) con ese código, comparado normalizado."""
+    code_upper = normalize_code(code)
+    if not code_upper:
+        return []
+    return _docs(_conn().execute(
+        "SELECT doc FROM cuponera_users WHERE code = ? ORDER BY rowid", (code_upper,)
+    ))
+
+
+def update_cuponera_user(cuponera_id: str, user_id: str, upd: dict) -> dict | None:
+    with transaction() as conn:
+        u = get_cuponera_user(cuponera_id, user_id)
+        if u is None:
+            return None
+        u = {**u, **upd}
+        conn.execute(
+            "UPDATE cuponera_users SET code = ?, doc = ? WHERE cuponera_id = ? AND id = ?",
+            (normalize_code(u.get("code")), _dump(u), cuponera_id, user_id),
+        )
+    return u
+
+
+def delete_cuponera_user(cuponera_id: str, user_id: str) -> bool:
+    with transaction() as conn:
+        cur = conn.execute(
+            "DELETE FROM cuponera_users WHERE cuponera_id = ? AND id = ?", (cuponera_id, user_id)
+        )
+        return cur.rowcount > 0
+
+
+def write_cuponera_users(data: list[dict]):
+    with transaction() as conn:
+        conn.execute("DELETE FROM cuponera_users")
+        conn.executemany(
+            "INSERT OR REPLACE INTO cuponera_users (cuponera_id, id, code, doc) VALUES (?, ?, ?, ?)",
+            [(u.get("cuponera_id"), u.get("id"), normalize_code(u.get("code")), _dump(u)) for u in data or []],
+        )
@@ -1,60 +1,292 @@
-"""Sincronización de sedes y menús desde el API externo."""
+"""Sincronización de sedes y menús desde el API externo.
+
+Usa un solo httpx.AsyncClient (conexiones reutilizadas), descarga los menús en paralelo
+con un máximo de SYNC_CONCURRENCY peticiones y reintenta errores de red y respuestas
+429/5xx con backoff exponencial.
+
+Planificador (run_sync_loop): la lista de sedes se refresca cada SYNC_INTERVAL_MINUTES y
+cada menú tiene su propio turno, repartido en el intervalo y con jitter para no golpear el
+API en ráfagas. Un menú que cambia acorta su intervalo (hasta SYNC_MIN_INTERVAL_MINUTES) y
+uno estable vuelve al intervalo base; las sedes que fallan esperan cada vez más (hasta
+SYNC_MAX_BACKOFF_MINUTES). sync_status() resume el estado por sede para GET /sync/status.
+
+Detección de cambios: se envían If-None-Match / If-Modified-Since si el API dio ETag o
+Last-Modified, y se compara el hash del cuerpo con la última descarga escrita; si no cambió
+no se parsea ni se escribe. storage además omite escrituras con el mismo contenido. Solo
+las escrituras reales emiten "sites_changed" / "menu_changed" (ver events.py).
+
+El hash, el parseo de las respuestas y todo acceso a storage van por storage_async (pool de
+hilos de fondo), así la sincronización no bloquea el event loop de la API.
+"""
 import asyncio
+import hashlib
 import logging
+import random
+import time
+from datetime import datetime
 from typing import Any
 
 import httpx
 
-from config import MENU_API_URL_TEMPLATE, SITES_API_URL, SYNC_INTERVAL_MINUTES
-from storage import read_sites_filtered, write_menu, write_sites
+from config import (
+    MENU_API_URL_TEMPLATE,
+    SITES_API_URL,
+    SYNC_CONCURRENCY,
+    SYNC_HTTP_TIMEOUT_SECONDS,
+    SYNC_INTERVAL_MINUTES,
+    SYNC_JITTER_FRACTION,
+    SYNC_MAX_BACKOFF_MINUTES,
+    SYNC_MAX_RETRIES,
+    SYNC_MIN_INTERVAL_MINUTES,
+    SYNC_RETRY_BACKOFF_SECONDS,
+    SYNC_STALE_MINUTES,
+)
+import storage_async
+from events import emit
 
 logger = logging.getLogger(__name__)
 
+# url -> (ETag, Last-Modified, hash del cuerpo) de la última respuesta ya guardada
+_validators: dict[str, tuple[str | None, str | None, str]] = {}
+
+# Máxima espera del planificador entre revisiones de turnos pendientes
+_SCHEDULER_TICK_SECONDS = 5.0
+
+
+class SyncState:
+    """Estado de sincronización de un recurso (menú de una sede o la lista de sedes)."""
+
+    def __init__(self, interval: float):
+        self.interval = interval  # intervalo adaptativo actual (s)
+        self.next_run = 0.0  # loop.time() del próximo turno
+        self.failures = 0  # fallos consecutivos
+        self.last_attempt: float | None = None  # time.time()
+        self.last_success: float | None = None
+        self.last_change: float | None = None
+        self.duration: float | None = None  # s del último intento
+        self.bytes = 0  # bytes descargados en el último intento (0 si 304)
+        self.error: str | None = None
+
+
+_base_interval = SYNC_INTERVAL_MINUTES * 60
+_sites_state = SyncState(_base_interval)
+_menu_states: dict[Any, SyncState] = {}
+_started_at = time.time()
+
+
+def _jitter(seconds: float) -> float:
+    return seconds * (1 + random.uniform(-SYNC_JITTER_FRACTION, SYNC_JITTER_FRACTION))
+
+
+def _finish(state: SyncState, started: float, nbytes: int, changed: bool, error: str | None):
+    """Registra el resultado de un intento y programa el siguiente turno."""
+    now = asyncio.get_running_loop().time()
+    state.duration = now - started
+    state.bytes = nbytes
+    state.error = error
+    if error is not None:
+        state.failures += 1
+        delay = min(SYNC_MAX_BACKOFF_MINUTES * 60, SYNC_MIN_INTERVAL_MINUTES * 60 * 2**state.failures)
+    else:
+        state.failures = 0
+        state.last_success = time.time()
+        if changed:
+            state.last_change = state.last_success
+            state.interval = max(SYNC_MIN_INTERVAL_MINUTES * 60, state.interval / 2)
+        else:
+            state.interval = min(_base_interval, state.interval * 1.5)
+        delay = state.interval
+    state.next_run = now + _jitter(delay)
+
+
+def _menu_state(site_id: Any) -> SyncState:
+    state = _menu_states.get(site_id)
+    if state is None:
+        state = _menu_states[site_id] = SyncState(_base_interval)
+    return state
+
+
+def _plan_sites(site_ids: list[Any], local: set, now: float):
+    """Reparte las sedes nuevas en el intervalo (las que no tienen menú local van ya) y olvida las que no están."""
+    new = [sid for sid in site_ids if sid not in _menu_states]
+    for i, sid in enumerate(new):
+        state = _menu_state(sid)
+        state.next_run = now + _jitter(_base_interval * i / len(new)) if sid in local else now
+    for sid in [sid for sid in _menu_states if sid not in site_ids]:
+        del _menu_states[sid]
+
 
-async def fetch_sites() -> list[dict]:
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.get(SITES_API_URL)
-        r.raise_for_status()
-        return r.json()
+def make_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """Cliente compartido por el planificador (transport: p. ej. httpx.MockTransport en pruebas)."""
+    limits = httpx.Limits(max_connections=SYNC_CONCURRENCY, max_keepalive_connections=SYNC_CONCURRENCY)
+    return httpx.AsyncClient(timeout=SYNC_HTTP_TIMEOUT_SECONDS, limits=limits, transport=transport)
 
 
-async def fetch_menu(site_id: int) -> dict | None:
-    url = MENU_API_URL_TEMPLATE.format(site_id=site_id)
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.get(url)
-        if r.status_code != 200:
-            logger.warning("Menu for site %s: status %s", site_id, r.status_code)
-            return None
-        return r.json()
+def _retryable(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
 
 
-async def sync_sites():
+async def _get(client: httpx.AsyncClient, url: str, headers: dict | None = None) -> httpx.Response:
+    """GET con reintentos (errores de red, 429 y 5xx) y backoff exponencial."""
+    attempt = 0
+    while True:
+        try:
+            r = await client.get(url, headers=headers)
+            if not _retryable(r.status_code) or attempt >= SYNC_MAX_RETRIES:
+                return r
+            logger.info("GET %s: status %s, reintento %s", url, r.status_code, attempt + 1)
+        except httpx.TransportError as e:
+            if attempt >= SYNC_MAX_RETRIES:
+                raise
+            logger.info("GET %s: %s, reintento %s", url, e, attempt + 1)
+        await asyncio.sleep(SYNC_RETRY_BACKOFF_SECONDS * 2**attempt)
+        attempt += 1
+
+
+def _body_hash(r: httpx.Response) -> str:
+    return hashlib.blake2b(r.content, digest_size=16).hexdigest()
+
+
+async def _fetch_if_changed(client: httpx.AsyncClient, url: str) -> tuple[httpx.Response, str] | None:
+    """(respuesta, hash del cuerpo) del GET condicional, o None si no cambió (304 o mismo cuerpo que la última guardada)."""
+    known = _validators.get(url)
+    headers = {}
+    if known and known[0]:
+        headers["If-None-Match"] = known[0]
+    if known and known[1]:
+        headers["If-Modified-Since"] = known[1]
+    r = await _get(client, url, headers)
+    if r.status_code == 304:
+        return None
+    body_hash = await storage_async.run_background(_body_hash, r)
+    if r.status_code == 200 and known and known[2] == body_hash:
+        return None
+    return r, body_hash
+
+
+def _remember(url: str, r: httpx.Response, body_hash: str):
+    """Registra los validadores de una respuesta ya guardada (después de escribir, para no perder cambios)."""
+    _validators[url] = (r.headers.get("etag"), r.headers.get("last-modified"), body_hash)
+
+
+async def sync_sites(client: httpx.AsyncClient):
+    started = asyncio.get_running_loop().time()
+    _sites_state.last_attempt = time.time()
+    nbytes, changed, error = 0, False, None
     try:
-        data = await fetch_sites()
-        write_sites(data)
-        logger.info("Sites synced: %s sites", len(data))
+        fetched = await _fetch_if_changed(client, SITES_API_URL)
+        if fetched is None:
+            logger.info("Sites sin cambios")
+        else:
+            r, body_hash = fetched
+            nbytes = len(r.content)
+            r.raise_for_status()
+            data = await storage_async.run_background(r.json)
+            if await storage_async.write_sites(data):
+                changed = True
+                emit("sites_changed")
+                logger.info("Sites synced: %s sites", len(data))
+            _remember(SITES_API_URL, r, body_hash)
     except Exception as e:
+        error = str(e) or type(e).__name__
         logger.exception("Sync sites failed: %s", e)
+    _finish(_sites_state, started, nbytes, changed, error)
 
 
-async def sync_menus():
-    sites = read_sites_filtered()
-    for site in sites:
-        sid = site.get("site_id")
-        if sid is None:
-            continue
+async def _sync_menu(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, sid: Any):
+    url = MENU_API_URL_TEMPLATE.format(site_id=sid)
+    state = _menu_state(sid)
+    async with semaphore:
+        started = asyncio.get_running_loop().time()
+        state.last_attempt = time.time()
+        nbytes, changed, error = 0, False, None
         try:
-            menu = await fetch_menu(sid)
-            if menu:
-                write_menu(sid, menu)
-                logger.info("Menu synced for site %s", sid)
+            fetched = await _fetch_if_changed(client, url)
+            if fetched is not None:
+                r, body_hash = fetched
+                nbytes = len(r.content)
+                menu = await storage_async.run_background(r.json) if r.status_code == 200 else None
+                if r.status_code != 200:
+                    error = f"status {r.status_code}"
+                    logger.warning("Menu for site %s: status %s", sid, r.status_code)
+                elif not menu:
+                    error = "menú vacío"
+                else:
+                    if await storage_async.write_menu(sid, menu):
+                        changed = True
+                        emit("menu_changed", site_id=sid)
+                        logger.info("Menu synced for site %s", sid)
+                    _remember(url, r, body_hash)
         except Exception as e:
+            error = str(e) or type(e).__name__
             logger.warning("Menu sync site %s: %s", sid, e)
-        await asyncio.sleep(0.2)  # evitar saturar el API
+        _finish(state, started, nbytes, changed, error)
 
 
-async def run_sync_loop():
-    while True:
-        await sync_sites()
-        await sync_menus()
-        await asyncio.sleep(SYNC_INTERVAL_MINUTES * 60)
+async def run_sync_loop(transport: httpx.AsyncBaseTransport | None = None):
+    """Planificador: lista de sedes y menús por turnos propios, con un cliente compartido."""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max(1, SYNC_CONCURRENCY))
+    running: dict[Any, asyncio.Task] = {}
+    async with make_client(transport) as client:
+        try:
+            while True:
+                if loop.time() >= _sites_state.next_run:
+                    await sync_sites(client)
+                    sites = await storage_async.read_sites_filtered()
+                    site_ids = [s["site_id"] for s in sites if s.get("site_id") is not None]
+                    local = set(await storage_async.list_menu_site_ids())
+                    _plan_sites(site_ids, local, loop.time())
+                now = loop.time()
+                for sid, state in _menu_states.items():
+                    if state.next_run <= now and sid not in running:
+                        task = running[sid] = asyncio.create_task(_sync_menu(client, semaphore, sid))
+                        task.add_done_callback(lambda _, sid=sid: running.pop(sid, None))
+                waiting = [s.next_run for sid, s in _menu_states.items() if sid not in running]
+                wake = min([_sites_state.next_run, *waiting])
+                await asyncio.sleep(min(max(wake - loop.time(), 0.05), _SCHEDULER_TICK_SECONDS))
+        finally:
+            for task in list(running.values()):
+                task.cancel()
+            await asyncio.gather(*running.values(), return_exceptions=True)
+
+
+def _iso(ts: float | None) -> str | None:
+    return datetime.utcfromtimestamp(ts).isoformat() + "Z" if ts is not None else None
+
+
+def _state_status(state: SyncState, now: float, loop_now: float | None) -> dict:
+    age = now - (state.last_success or _started_at)
+    return {
+        "last_attempt": _iso(state.last_attempt),
+        "last_success": _iso(state.last_success),
+        "last_change": _iso(state.last_change),
+        "duration_ms": round(state.duration * 1000, 1) if state.duration is not None else None,
+        "bytes": state.bytes,
+        "error": state.error,
+        "consecutive_failures": state.failures,
+        "interval_seconds": round(state.interval, 1),
+        "next_run_in_seconds": round(max(0.0, state.next_run - loop_now), 1) if loop_now is not None else None,
+        "staleness_seconds": round(age, 1) if state.last_success is not None else None,
+        "stale": age > SYNC_STALE_MINUTES * 60,
+    }
+
+
+def sync_status() -> dict:
+    """Estado de la sincronización: lista de sedes y menú por sede (para GET /sync/status)."""
+    try:
+        loop_now = asyncio.get_running_loop().time()
+    except RuntimeError:
+        loop_now = None
+    now = time.time()
+    sites = [
+        {"site_id": sid, **_state_status(state, now, loop_now)}
+        for sid, state in sorted(_menu_states.items(), key=lambda item: item[0])
+    ]
+    return {
+        "generated_at": _iso(now),
+        "sites_list": _state_status(_sites_state, now, loop_now),
+        "sites": sites,
+        "failing": sum(1 for s in sites if s["error"]),
+        "stale": sum(1 for s in sites if s["stale"]),
+    }
@@ -0,0 +1,36 @@
+"""Las pruebas usan un data/ temporal: config se redirige antes de importar storage."""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import config
+
+_DATA_DIR = tempfile.mkdtemp(prefix="descuentos-tests-")
+_ORIGINAL_DATA_DIR = config.DATA_DIR
+for _name, _value in list(vars(config).items()):
+    if isinstance(_value, str) and _value.startswith(_ORIGINAL_DATA_DIR):
+        setattr(config, _name, _DATA_DIR + _value[len(_ORIGINAL_DATA_DIR):])
+
+import storage  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def data_dir():
+    """data/ vacío y cachés de storage limpias en cada prueba."""
+    for name in os.listdir(_DATA_DIR):
+        path = os.path.join(_DATA_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    storage.clear_cache()
+    storage._usage._ledgers.clear()
+    storage._menu_index_by_site.clear()
+    storage._menu_gzip_hashes.clear()
+    return _DATA_DIR
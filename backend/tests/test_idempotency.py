@@ -0,0 +1,193 @@
+"""Idempotency-Key en /redeem: caché por worker (IdempotencyCache) y clave guardada con el uso."""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import idempotency
+import storage
+from idempotency import IdempotencyCache
+from routers import redeem
+
+DAY = "2026-03-05"
+
+
+# --- IdempotencyCache ---
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(idempotency.time, "monotonic", clock)
+    return clock
+
+
+def _counter():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    return calls, compute
+
+
+def test_replays_within_ttl_and_recomputes_after(clock):
+    cache = IdempotencyCache(ttl_seconds=60, max_entries=10)
+    calls, compute = _counter()
+
+    async def main():
+        first = await cache.run("k", compute)
+        clock.now += 59
+        replay = await cache.run("k", compute)
+        clock.now += 2
+        expired = await cache.run("k", compute)
+        return first, replay, expired
+
+    assert asyncio.run(main()) == ((1, False), (1, True), (2, False))
+    assert len(calls) == 2
+
+
+def test_evicts_oldest_beyond_max_entries(clock):
+    cache = IdempotencyCache(ttl_seconds=60, max_entries=3)
+    calls, compute = _counter()
+
+    async def main():
+        for key in "abcd":
+            await cache.run(key, compute)
+            clock.now += 1
+        return await cache.run("a", compute), await cache.run("d", compute)
+
+    (a, a_replayed), (d, d_replayed) = asyncio.run(main())
+    assert not a_replayed and a == 5  # "a" salió al entrar "d": se vuelve a calcular
+    assert d_replayed and d == 4
+    assert len(cache._entries) <= 3
+
+
+def test_concurrent_identical_keys_compute_once(clock):
+    cache = IdempotencyCache(ttl_seconds=60, max_entries=10)
+    calls, compute = _counter()
+
+    async def main():
+        return await asyncio.gather(*(cache.run("k", compute) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [value for value, _ in results] == [1] * 5
+    assert sorted(replayed for _, replayed in results) == [False, True, True, True, True]
+
+
+def test_failed_compute_is_not_kept(clock):
+    cache = IdempotencyCache(ttl_seconds=60, max_entries=10)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("falla")
+        return "ok"
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await cache.run("k", flaky)
+        return await cache.run("k", flaky)
+
+    assert asyncio.run(main()) == ("ok", False)
+
+
+# --- GET /redeem con record_use ---
+@pytest.fixture
+def cuponera(data_dir):
+    redeem._idempotent.clear()
+    storage.write_discounts([{"id": "d1", "name": "10 %", "type": "ORDER_PERCENT_OFF", "params": {"percent": 10}}])
+    storage.write_cuponeras([{"id": "c1", "name": "Cuponera", "active": True, "uses_per_day": 3, "calendar": {DAY: ["d1"]}}])
+    storage.write_cuponera_users([{"id": "u1", "cuponera_id": "c1", "code": "ABC123", "name": "Ana Pérez"}])
+    yield
+    redeem._idempotent.clear()
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(redeem.router)
+    return app
+
+
+async def _redeem(client: httpx.AsyncClient, key: str | None) -> httpx.Response:
+    headers = {"Idempotency-Key": key} if key else {}
+    r = await client.get("/redeem", params={"code": "abc123", "date": DAY, "record_use": "true"}, headers=headers)
+    assert r.status_code == 200 and r.json()["success"], r.text
+    return r
+
+
+def _requests(*calls):
+    """Ejecuta las peticiones (listas = concurrentes) contra la app y devuelve las respuestas."""
+    async def main():
+        out = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=_app()), base_url="http://test") as client:
+            for call in calls:
+                if isinstance(call, list):
+                    out.extend(await asyncio.gather(*(_redeem(client, key) for key in call)))
+                else:
+                    out.append(await _redeem(client, call))
+        return out
+    return asyncio.run(main())
+
+
+def _uses() -> int:
+    return storage.get_cuponera_usage_count("c1", "ABC123", DAY)
+
+
+def _restart():
+    """Otro proceso: sin respuestas guardadas ni tablas de usos en memoria."""
+    redeem._idempotent.clear()
+    storage.clear_cache()
+    storage._usage._ledgers.clear()
+
+
+def test_retry_with_same_key_is_replayed(cuponera):
+    first, retry = _requests("k1", "k1")
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json() and first.json()["uses_remaining_today"] == 2
+    assert _uses() == 1
+
+
+def test_concurrent_requests_with_same_key_consume_once(cuponera):
+    responses = _requests(["k1"] * 5)
+    assert _uses() == 1
+    assert sum(1 for r in responses if r.headers.get("idempotent-replayed") == "true") == 4
+    assert {r.json()["uses_remaining_today"] for r in responses} == {2}
+
+
+def test_replay_after_restart_comes_from_stored_request_keys(cuponera):
+    (first,) = _requests("k1")
+    storage.compact_cuponera_usage()  # la clave pasa del log al snapshot
+    _restart()
+    retry, other = _requests("k1", "k2")
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json()["uses_remaining_today"] == first.json()["uses_remaining_today"] == 2
+    assert "idempotent-replayed" not in other.headers and other.json()["uses_remaining_today"] == 1
+    assert _uses() == 2
+    records = storage.read_cuponera_usage()
+    assert records[0]["request_keys"] == {"k1": 1, "k2": 2}
+
+
+def test_replay_after_cache_ttl_still_does_not_consume(cuponera, monkeypatch):
+    monkeypatch.setattr(redeem._idempotent, "ttl_seconds", 0)
+    first, retry = _requests("k1", "k1")
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert _uses() == 1
+
+
+def test_without_key_every_request_consumes(cuponera):
+    responses = _requests(None, None, None, None)
+    assert [r.json()["uses_remaining_today"] for r in responses] == [2, 1, 0, 0]
+    assert _uses() == 3
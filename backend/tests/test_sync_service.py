@@ -0,0 +1,174 @@
+"""Planificador de sincronización y detección de cambios (API externo simulado con httpx.MockTransport)."""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import storage
+import sync_service
+from config import MENU_API_URL_TEMPLATE, SITES_API_URL
+
+SITES = [{"site_id": sid, "site_name": f"Sede {sid}", "time_zone": "America/Bogota", "show_on_web": True} for sid in (1, 2)]
+
+
+def _menu(price: int = 25000) -> dict:
+    return {"categorias": [{"categoria_id": 10, "categoria_descripcion": "Salchipapas", "products": [
+        {"producto_id": 100, "producto_descripcion": "Salchipapa", "productogeneral_precio": price},
+    ]}]}
+
+
+@pytest.fixture(autouse=True)
+def sync_state(data_dir, monkeypatch):
+    """Estado del planificador limpio; los eventos emitidos se registran en la lista que devuelve."""
+    sync_service._validators.clear()
+    sync_service._menu_states.clear()
+    monkeypatch.setattr(sync_service, "_sites_state", sync_service.SyncState(sync_service._base_interval))
+    monkeypatch.setattr(sync_service, "SYNC_RETRY_BACKOFF_SECONDS", 0)
+    emitted = []
+    monkeypatch.setattr(sync_service, "emit", lambda event, **payload: emitted.append((event, payload)))
+    return emitted
+
+
+async def _sync_menu_once(handler, sid=1):
+    async with sync_service.make_client(httpx.MockTransport(handler)) as client:
+        await sync_service._sync_menu(client, asyncio.Semaphore(1), sid)
+    return sync_service._menu_state(sid)
+
+
+def _run(handler, times, sid=1):
+    async def main():
+        state = None
+        for _ in range(times):
+            state = await _sync_menu_once(handler, sid)
+        return state
+    return asyncio.run(main())
+
+
+def test_etag_304_skips_parse_and_write(sync_state):
+    seen_headers = []
+
+    def handler(request):
+        seen_headers.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=_menu(), headers={"ETag": '"v1"'})
+
+    state = _run(handler, 2)
+    assert seen_headers == [None, '"v1"']
+    assert sync_state == [("menu_changed", {"site_id": 1})]
+    assert state.error is None and state.bytes == 0  # el 304 no descarga cuerpo
+    assert storage.read_menu(1)["categorias"][0]["products"][0]["productogeneral_precio"] == 25000
+
+
+def test_unchanged_body_is_not_written_again(sync_state, monkeypatch):
+    writes = []
+    write_menu = sync_service.storage_async.write_menu
+
+    async def counting_write_menu(site_id, data):
+        writes.append(site_id)
+        return await write_menu(site_id, data)
+
+    monkeypatch.setattr(sync_service.storage_async, "write_menu", counting_write_menu)
+    body = json.dumps(_menu()).encode()
+    state = _run(lambda request: httpx.Response(200, content=body), 3)
+    assert writes == [1]  # sin validadores: el hash del cuerpo igual evita parsear y escribir
+    assert sync_state == [("menu_changed", {"site_id": 1})]
+    assert state.error is None and state.failures == 0
+
+    changed = json.dumps(_menu(price=27000)).encode()
+    _run(lambda request: httpx.Response(200, content=changed), 1)
+    assert writes == [1, 1]
+    assert sync_state[-1] == ("menu_changed", {"site_id": 1})
+
+
+def test_failures_back_off_exponentially_and_success_resets(monkeypatch):
+    monkeypatch.setattr(sync_service, "SYNC_MAX_RETRIES", 0)
+    monkeypatch.setattr(sync_service, "SYNC_MIN_INTERVAL_MINUTES", 1)
+    monkeypatch.setattr(sync_service, "SYNC_MAX_BACKOFF_MINUTES", 8)
+    monkeypatch.setattr(sync_service, "SYNC_JITTER_FRACTION", 0.2)
+
+    def failing(request):
+        return httpx.Response(503)
+
+    async def main():
+        delays = []
+        for _ in range(4):
+            state = await _sync_menu_once(failing)
+            delays.append((state.next_run - asyncio.get_running_loop().time(), state.failures, state.error))
+        state = await _sync_menu_once(lambda request: httpx.Response(200, json=_menu()))
+        return delays, state, state.next_run - asyncio.get_running_loop().time()
+
+    delays, state, after_success = asyncio.run(main())
+    # 1 min * 2**fallos, tope 8 min, con ±20 % de jitter
+    for (delay, failures, error), expected in zip(delays, (120, 240, 480, 480)):
+        assert expected * 0.8 - 1 <= delay <= expected * 1.2
+        assert error == "status 503"
+    assert [failures for _, failures, _ in delays] == [1, 2, 3, 4]
+    assert state.failures == 0 and state.error is None and state.last_success is not None
+    assert after_success <= state.interval * 1.2
+
+
+def test_retries_transient_errors_before_failing(monkeypatch):
+    monkeypatch.setattr(sync_service, "SYNC_MAX_RETRIES", 2)
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        if len(calls) < 3:
+            return httpx.Response(502)
+        return httpx.Response(200, json=_menu())
+
+    state = _run(handler, 1)
+    assert len(calls) == 3
+    assert state.error is None and state.failures == 0
+
+
+def test_jitter_stays_within_bounds(monkeypatch):
+    monkeypatch.setattr(sync_service, "SYNC_JITTER_FRACTION", 0.25)
+    samples = [sync_service._jitter(100.0) for _ in range(2000)]
+    assert all(75.0 <= s <= 125.0 for s in samples)
+    assert max(samples) - min(samples) > 10  # hay dispersión
+
+
+def test_plan_spreads_sites_over_interval_with_jitter(monkeypatch):
+    monkeypatch.setattr(sync_service, "SYNC_JITTER_FRACTION", 0.1)
+    base = sync_service._base_interval
+    site_ids = list(range(1, 11))
+    sync_service._plan_sites(site_ids, local=set(site_ids) - {10}, now=1000.0)
+    for i, sid in enumerate(site_ids[:-1]):
+        offset = sync_service._menu_states[sid].next_run - 1000.0
+        target = base * i / len(site_ids)
+        assert target * 0.9 <= offset <= target * 1.1
+    assert sync_service._menu_states[10].next_run == 1000.0  # sin menú local: va en el primer turno
+
+    sync_service._plan_sites([1, 2], local={1, 2}, now=2000.0)
+    assert sorted(sync_service._menu_states) == [1, 2]  # las sedes que ya no están se olvidan
+    assert sync_service._menu_states[2].next_run < 2000.0  # las conocidas conservan su turno
+
+
+def test_sync_loop_downloads_sites_and_menus(sync_state):
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        if str(request.url) == SITES_API_URL:
+            return httpx.Response(200, json=SITES, headers={"ETag": '"s1"'})
+        return httpx.Response(200, json=_menu())
+
+    async def main():
+        task = asyncio.create_task(sync_service.run_sync_loop(httpx.MockTransport(handler)))
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if all(sync_service._menu_states.get(sid) and sync_service._menu_states[sid].last_success for sid in (1, 2)):
+                break
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert requested[0] == SITES_API_URL
+    assert sorted(requested[1:]) == sorted(MENU_API_URL_TEMPLATE.format(site_id=sid) for sid in (1, 2))
+    assert ("sites_changed", {}) in sync_state
+    assert storage.read_menu(1) is not None and storage.read_menu(2) is not None
+    status = sync_service.sync_status()
+    assert [s["site_id"] for s in status["sites"]] == [1, 2] and status["failing"] == 0
@@ -0,0 +1,218 @@
+"""Tabla de usos (snapshot + log), recuperación de compactaciones a medias y transacciones de storage."""
+import json
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+import storage
+from config import CUPONERAS_JSON, DISCOUNTS_JSON, FOLDERS_JSON
+from usage_ledger import UsageLedger, usage_key
+
+KEY = usage_key("c1", "ab", "2026-03-05")
+
+
+def _ledger(data_dir, compact_every=0) -> UsageLedger:
+    snapshot_path = os.path.join(data_dir, "usage_test.json")
+    return UsageLedger(
+        snapshot_path,
+        os.path.join(data_dir, "usage_test.log"),
+        compact_every,
+        load_snapshot=storage._load_usage_snapshot,
+        save_snapshot=storage._save_usage_snapshot,
+        lock=lambda: storage._file_transaction(snapshot_path),
+        signature=storage._data_signature,
+    )
+
+
+def _inc(key=KEY, **extra) -> bytes:
+    return (json.dumps({"op": "inc", "c": key[0], "u": key[1], "d": key[2], **extra}) + "\n").encode()
+
+
+# --- Log ---
+def test_replays_snapshot_plus_log(data_dir):
+    ledger = _ledger(data_dir)
+    with open(ledger.snapshot_path, "w") as f:
+        json.dump([{"cuponera_id": "c1", "user_code": "ab ", "date": "2026-03-05", "uses_count": 3}], f)
+    with open(ledger.log_path, "wb") as f:
+        f.write(_inc() + _inc() + b"not json\n" + _inc(usage_key("c2", "x", "2026-03-05")))
+    assert ledger.get(KEY) == 5
+    assert ledger.get(usage_key("c2", "X", "2026-03-05")) == 1
+
+
+def test_partial_line_is_applied_once_complete(data_dir):
+    ledger = _ledger(data_dir)
+    assert ledger.increment(KEY) == 1
+    line = _inc()
+    with open(ledger.log_path, "ab") as f:
+        f.write(line[:10])
+    assert ledger.get(KEY) == 1
+    with open(ledger.log_path, "ab") as f:
+        f.write(line[10:])
+    assert ledger.get(KEY) == 2
+
+
+def test_sees_writes_from_another_instance(data_dir):
+    a, b = _ledger(data_dir), _ledger(data_dir)
+    a.increment(KEY)
+    b.increment(KEY)
+    assert a.get(KEY) == b.get(KEY) == 2
+    assert b.reset(KEY) and a.get(KEY) == 0
+
+
+def test_compaction_folds_log_into_snapshot(data_dir):
+    ledger = _ledger(data_dir, compact_every=3)
+    for _ in range(7):
+        ledger.increment(KEY)
+    assert _ledger(data_dir).get(KEY) == 7
+    with open(ledger.snapshot_path) as f:
+        snapshot = json.load(f)
+    assert snapshot["compacted"] and snapshot["records"][0]["uses_count"] == 6
+    assert os.path.getsize(ledger.log_path) < 200
+
+
+# --- Compactación interrumpida ---
+def test_crash_after_rotation_before_snapshot_reapplies_log(data_dir):
+    ledger = _ledger(data_dir)
+    for _ in range(3):
+        ledger.increment(KEY)
+    ledger.compact()
+    ledger.increment(KEY)
+    ledger.increment(KEY)
+    # Caída entre la rotación (y su marca) y el rename del snapshot nuevo
+    os.replace(ledger.log_path, ledger.log_path + ".1")
+    with open(ledger.log_path + ".1", "ab") as f:
+        f.write(b'{"op":"compacted","g":"never-saved"}\n')
+    with open(ledger.log_path, "wb") as f:
+        f.write(_inc())  # otro worker siguió escribiendo en un log nuevo
+    recovered = _ledger(data_dir)
+    assert recovered.get(KEY) == 6
+    assert not os.path.exists(ledger.log_path + ".1")
+    recovered.compact()
+    assert _ledger(data_dir).get(KEY) == 6
+
+
+def test_crash_before_marker_reapplies_log(data_dir):
+    ledger = _ledger(data_dir)
+    ledger.increment(KEY)
+    os.replace(ledger.log_path, ledger.log_path + ".1")
+    assert _ledger(data_dir).get(KEY) == 1
+
+
+def test_crash_after_snapshot_does_not_double_count(data_dir, monkeypatch):
+    ledger = _ledger(data_dir)
+    for _ in range(4):
+        ledger.increment(KEY)
+    rotated = ledger.log_path + ".1"
+    kept = {}
+    remove = os.remove
+
+    def crash_before_removing_rotated(path):
+        if path == rotated:
+            with open(path, "rb") as f:
+                kept["raw"] = f.read()
+        remove(path)
+
+    monkeypatch.setattr(os, "remove", crash_before_removing_rotated)
+    ledger.compact()
+    monkeypatch.undo()
+    with open(rotated, "wb") as f:
+        f.write(kept["raw"])
+    # Mismo mtime que el snapshot: la decisión no puede depender de los tiempos
+    mtime = os.stat(ledger.snapshot_path).st_mtime_ns
+    os.utime(rotated, ns=(mtime, mtime))
+    recovered = _ledger(data_dir)
+    assert recovered.get(KEY) == 4
+    assert not os.path.exists(rotated)
+
+
+# --- Límite entre procesos ---
+def _consume_worker(data_dir, attempts, limit, results):
+    ledger = _ledger(data_dir, compact_every=5)
+    consumed = sum(1 for _ in range(attempts) if ledger.consume(KEY, limit)[0])
+    results.put(consumed)
+
+
+@pytest.mark.skipif(storage.fcntl is None, reason="el lock entre procesos usa flock")
+def test_consume_limit_holds_across_processes(data_dir):
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_consume_worker, args=(data_dir, 15, 25, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert sum(results.get(timeout=5) for _ in workers) == 25
+    assert _ledger(data_dir).get(KEY) == 25
+
+
+def test_consume_many_with_request_keys(data_dir):
+    ledger = _ledger(data_dir)
+    results = ledger.consume_many([(KEY, 2, "r1"), (KEY, 2, "r1"), (KEY, 2, "r2"), (KEY, 2, "r3"), (KEY, None)])
+    assert results == [(True, 1, False), (True, 1, True), (True, 2, False), (False, 2, False), (False, 2, False)]
+    ledger.compact()
+    assert _ledger(data_dir).consume_many([(KEY, 2, "r2")]) == [(True, 2, True)]
+
+
+# --- transaction / unit_of_work ---
+def test_transaction_serializes_read_modify_write(data_dir):
+    storage.write_discounts([])
+
+    def insert_many(prefix):
+        for i in range(25):
+            storage.insert_discount({"id": f"{prefix}{i}"})
+
+    threads = [threading.Thread(target=insert_many, args=(p,)) for p in "abcd"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(storage.read_discounts()) == 100
+
+
+def _seed():
+    storage.write_discounts([{"id": "d1", "folder": "f"}, {"id": "d2", "folder": "f"}])
+    storage.write_cuponeras([{"id": "c1", "folder": "f", "calendar": {"2026-03-05": ["d1", "d2"], "2026-03-06": ["d1"]}}])
+    storage.write_folders([{"id": "f1", "name": "f"}])
+    assert storage.get_discount("d1")  # construye el índice por id
+    assert storage.get_discount_cuponera_dates("d1") == {"c1": ["2026-03-05", "2026-03-06"]}
+
+
+def _indexes(path) -> dict:
+    return storage._current_indexes(path, storage._load_list(path))
+
+
+def test_unit_of_work_commit_carries_indexes(data_dir):
+    _seed()
+    assert storage.update_folder("f1", {"name": "g"})
+    # Sin eliminaciones los índices pasan a la versión nueva sin reconstruirse
+    assert "id" in _indexes(DISCOUNTS_JSON) and "calendar" in _indexes(CUPONERAS_JSON)
+    assert storage.get_discount("d2")["folder"] == "g"
+
+    assert storage.delete_discount("d1")
+    # El índice derivado (calendario) se actualiza; el posicional se descarta al quitar registros
+    assert "calendar" in _indexes(CUPONERAS_JSON) and "id" not in _indexes(DISCOUNTS_JSON)
+    assert storage.get_discount_cuponera_dates("d1") == {}
+    assert storage.get_discount_cuponera_dates("d2") == {"c1": ["2026-03-05"]}
+    assert storage.get_discount("d1") is None and storage.get_discount("d2")["id"] == "d2"
+    assert storage.get_cuponera("c1")["calendar"] == {"2026-03-05": ["d2"]}
+
+
+def test_unit_of_work_rollback_writes_nothing(data_dir):
+    _seed()
+    before_items = storage._load_list(DISCOUNTS_JSON)
+    before_indexes = _indexes(DISCOUNTS_JSON)
+    with open(DISCOUNTS_JSON, "rb") as f:
+        before_file = f.read()
+    with pytest.raises(RuntimeError):
+        with storage.unit_of_work(DISCOUNTS_JSON, CUPONERAS_JSON, FOLDERS_JSON) as uow:
+            uow.remove_where(DISCOUNTS_JSON, lambda d: d["id"] == "d1")
+            uow.update_where(FOLDERS_JSON, lambda f: True, {"name": "x"})
+            raise RuntimeError("falla a mitad")
+    with open(DISCOUNTS_JSON, "rb") as f:
+        assert f.read() == before_file
+    assert storage._load_list(DISCOUNTS_JSON) is before_items
+    assert _indexes(DISCOUNTS_JSON) == before_indexes
+    assert storage.get_discount("d1") and storage.get_folder("f1")["name"] == "f"
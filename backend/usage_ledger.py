@@ -0,0 +1,525 @@
+"""Usos de cuponera: snapshot JSON + log append-only, particionados por mes.
+
+Cada canje agrega una línea pequeña al log en vez de reescribir el snapshot.
+En memoria se mantiene la tabla (cuponera_id, user_code, date) -> uses_count, que se
+reconstruye desde el snapshot + log al arrancar y se pone al día leyendo solo las
+líneas nuevas del log (p. ej. escritas por otro worker). Cada cierto número de líneas
+el log se compacta dentro del snapshot: el log se rota a <log>.1, se le agrega una línea
+con la marca de la compactación ({"op": "compacted", "g": ...}) y el snapshot se guarda
+como {"compacted": marca, "records": [...]}. Si el proceso cae a mitad, al cargar se
+compara la marca del log rotado con la del snapshot para saber si ya está incluido.
+
+Un uso puede llevar la clave de idempotencia del canje que lo consumió ("k" en el log,
+request_keys en el snapshot): un reintento con la misma clave, en cualquier worker, recibe
+el total de ese uso sin consumir otro. Las claves viven lo mismo que el registro del día.
+
+PartitionedUsage reparte los registros en un UsageLedger por mes (usage_YYYY-MM.json
++ usage_YYYY-MM.log), de modo que un canje solo carga la partición de su fecha; las
+particiones viejas se archivan comprimidas (usage_YYYY-MM.json.gz). Solo queda en memoria
+la tabla de las particiones usadas por clave (sobre todo el mes actual): las operaciones
+que recorren todas las particiones cargan las demás de paso y no las retienen.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import date as _date
+
+from utils import normalize_code
+
+logger = logging.getLogger(__name__)
+
+UsageKey = tuple[str, str, str]
+
+
+def usage_key(cuponera_id, user_code, date) -> UsageKey:
+    """Clave normalizada (cuponera_id, código en mayúsculas, fecha)."""
+    return str(cuponera_id or ""), normalize_code(user_code), str(date or "")
+
+
+def usage_partition(date) -> str:
+    """Partición (mes YYYY-MM) de una fecha; las fechas no ISO van a "other"."""
+    d = str(date or "")
+    if len(d) >= 7 and d[4] == "-" and d[:4].isdigit() and d[5:7].isdigit():
+        return d[:7]
+    return "other"
+
+
+def remove_archived_cuponera(archive_dir: str, cuponera_id: str) -> int:
+    """Borra los usos de una cuponera de los meses archivados (usage_YYYY-MM.json.gz). Retorna cuántos borró."""
+    removed = 0
+    if not os.path.isdir(archive_dir):
+        return removed
+    for name in sorted(os.listdir(archive_dir)):
+        if not (name.startswith("usage_") and name.endswith(".json.gz")):
+            continue
+        archive_path = os.path.join(archive_dir, name)
+        with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+            records = json.load(f)
+        keep = [rec for rec in records if str(rec.get("cuponera_id") or "") != cuponera_id]
+        if len(keep) == len(records):
+            continue
+        tmp_path = archive_path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(keep, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, archive_path)
+        removed += len(records) - len(keep)
+    return removed
+
+
+def _snapshot_parts(data) -> tuple[list, str | None]:
+    """(registros, marca de la última compactación) de un snapshot; acepta la lista del formato anterior."""
+    if isinstance(data, dict):
+        records = data.get("records")
+        return (records if isinstance(records, list) else []), data.get("compacted")
+    return (data if isinstance(data, list) else []), None
+
+
+def _compaction_marker(raw: bytes) -> tuple[bytes, str | None]:
+    """(líneas del log rotado sin la marca, marca de la compactación o None si no llegó a escribirse)."""
+    body = raw.rstrip(b"\n")
+    cut = body.rfind(b"\n") + 1
+    try:
+        entry = json.loads(body[cut:])
+    except ValueError:
+        return raw, None
+    if not isinstance(entry, dict) or entry.get("op") != "compacted":
+        return raw, None
+    return body[:cut], entry.get("g")
+
+
+def _signature(path: str) -> tuple[int, int, int, int] | None:
+    """(mtime_ns, tamaño, inodo, dispositivo) del archivo, o None si no existe."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino, st.st_dev
+
+
+class UsageLedger:
+    """Tabla de usos respaldada por un snapshot (lista JSON) y un log de operaciones."""
+
+    def __init__(self, snapshot_path: str, log_path: str, compact_every: int, load_snapshot, save_snapshot, lock,
+                 signature=_signature):
+        """
+        lock: fábrica de context manager reentrante que serializa el acceso (hilos y procesos).
+        signature: firma (mtime, tamaño, inodo) del snapshot según cómo lo guarda save_snapshot.
+        """
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.compact_every = compact_every
+        self._load_snapshot = load_snapshot
+        self._save_snapshot = save_snapshot
+        self._lock = lock
+        self._snapshot_signature = signature
+        self._counts: dict[UsageKey, int] = {}
+        self._requests: dict[UsageKey, dict[str, int]] = {}  # clave de idempotencia -> total tras ese uso
+        self._snapshot_sig: tuple | None = None
+        self._log_offset = 0
+        self._log_lines = 0
+        self._loaded = False
+
+    # --- Carga ---
+    def _recover_compaction(self):
+        """Si una compactación quedó a medias, decide por su marca si el log rotado ya está en el snapshot."""
+        rotated = self.log_path + ".1"
+        try:
+            with open(rotated, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return
+        pending, marker = _compaction_marker(raw)
+        _, absorbed = _snapshot_parts(self._load_snapshot(self.snapshot_path, []))
+        if marker is not None and marker == absorbed:
+            os.remove(rotated)  # el snapshot de esta compactación se llegó a escribir: ya lo incluye
+            return
+        # El snapshot no llegó a escribirse: devolver las líneas rotadas al principio del log
+        current = b""
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                current = f.read()
+        with open(self.log_path, "wb") as f:
+            f.write(pending + current)
+        os.remove(rotated)
+
+    def _reload(self):
+        self._recover_compaction()
+        self._snapshot_sig = self._snapshot_signature(self.snapshot_path)
+        counts: dict[UsageKey, int] = {}
+        requests: dict[UsageKey, dict[str, int]] = {}
+        records, _ = _snapshot_parts(self._load_snapshot(self.snapshot_path, []))
+        for rec in records:
+            key = usage_key(rec.get("cuponera_id"), rec.get("user_code"), rec.get("date"))
+            if key in counts:
+                continue
+            counts[key] = int(rec.get("uses_count") or 0)
+            if rec.get("request_keys"):
+                requests[key] = dict(rec["request_keys"])
+        self._counts = counts
+        self._requests = requests
+        self._log_offset = 0
+        self._log_lines = 0
+        self._loaded = True
+
+    def _apply(self, entry: dict):
+        key = usage_key(entry.get("c"), entry.get("u"), entry.get("d"))
+        op = entry.get("op")
+        if op == "inc":
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if entry.get("k"):
+                self._requests.setdefault(key, {})[entry["k"]] = self._counts[key]
+        elif op == "reset":
+            self._counts.pop(key, None)
+            self._requests.pop(key, None)
+
+    def _catch_up(self):
+        """Aplica las líneas del log escritas desde la última lectura (propias o de otro proceso)."""
+        if not self._loaded or self._snapshot_signature(self.snapshot_path) != self._snapshot_sig:
+            self._reload()
+        log_sig = _signature(self.log_path)
+        size = log_sig[1] if log_sig else 0
+        if size < self._log_offset:
+            self._reload()  # otro proceso compactó el log
+        if size == self._log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1  # una línea incompleta (escritura en curso) se lee en la próxima vuelta
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (json.JSONDecodeError, AttributeError):
+                logger.warning("Línea inválida en %s: %r", self.log_path, line[:200])
+            self._log_lines += 1
+        self._log_offset += end
+
+    def _append(self, *entries: dict):
+        """Agrega las líneas al log en una sola escritura (un fsync)."""
+        lines = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in entries)
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with open(self.log_path, "ab") as f:
+            f.write(lines.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        # Leer lo que haya escrito otro proceso antes de nuestra línea y aplicar la nuestra
+        self._catch_up()
+        if self.compact_every and self._log_lines >= self.compact_every:
+            self.compact()
+
+    # --- API ---
+    def get(self, key: UsageKey) -> int:
+        with self._lock():
+            self._catch_up()
+            return self._counts.get(key, 0)
+
+    def increment(self, key: UsageKey) -> int:
+        """Suma un uso y devuelve el nuevo total."""
+        with self._lock():
+            self._catch_up()
+            self._append({"op": "inc", "c": key[0], "u": key[1], "d": key[2]})
+            return self._counts.get(key, 0)
+
+    def consume(self, key: UsageKey, limit: int) -> tuple[bool, int]:
+        """Suma un uso solo si el total es menor que limit. Devuelve (consumido, total)."""
+        with self._lock():
+            self._catch_up()
+            count = self._counts.get(key, 0)
+            if count >= limit:
+                return False, count
+            self._append({"op": "inc", "c": key[0], "u": key[1], "d": key[2]})
+            return True, self._counts.get(key, 0)
+
+    def consume_many(self, ops: list[tuple]) -> list[tuple[bool, int, bool]]:
+        """
+        consume() de varias claves en orden, con una sola escritura en el log para todos los
+        usos consumidos. Cada op es (clave, limit) o (clave, limit, clave de idempotencia);
+        limit None = solo leer el total. Resultados (consumido, total, repetido): repetido si
+        la clave de idempotencia ya había consumido un uso (se devuelve el total de ese uso).
+        """
+        with self._lock():
+            self._catch_up()
+            added: dict[UsageKey, int] = {}
+            done: dict[tuple[UsageKey, str], int] = {}  # claves de idempotencia consumidas en este lote
+            entries = []
+            results = []
+            for key, limit, *rest in ops:
+                request_key = rest[0] if rest else None
+                if request_key:
+                    previous = done.get((key, request_key), self._requests.get(key, {}).get(request_key))
+                    if previous is not None:
+                        results.append((True, previous, True))
+                        continue
+                count = self._counts.get(key, 0) + added.get(key, 0)
+                if limit is not None and count < limit:
+                    added[key] = added.get(key, 0) + 1
+                    entry = {"op": "inc", "c": key[0], "u": key[1], "d": key[2]}
+                    if request_key:
+                        entry["k"] = request_key
+                        done[(key, request_key)] = count + 1
+                    entries.append(entry)
+                    results.append((True, count + 1, False))
+                else:
+                    results.append((False, count, False))
+            if entries:
+                self._append(*entries)
+            return results
+
+    def reset(self, key: UsageKey) -> bool:
+        """Borra los usos de la clave. True si había registro."""
+        with self._lock():
+            self._catch_up()
+            if key not in self._counts:
+                return False
+            self._append({"op": "reset", "c": key[0], "u": key[1], "d": key[2]})
+            return True
+
+    def _record(self, key: UsageKey, count: int) -> dict:
+        rec = {"cuponera_id": key[0], "user_code": key[1], "date": key[2], "uses_count": count}
+        if self._requests.get(key):
+            rec["request_keys"] = dict(self._requests[key])
+        return rec
+
+    def records(self) -> list[dict]:
+        with self._lock():
+            self._catch_up()
+            return [self._record(key, n) for key, n in self._counts.items()]
+
+    def replace(self, records: list[dict]):
+        """Reemplaza toda la tabla: escribe el snapshot y descarta el log (también uno rotado)."""
+        with self._lock():
+            self._save_snapshot(self.snapshot_path, {"compacted": None, "records": records})
+            for path in (self.log_path, self.log_path + ".1"):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._reload()
+
+    def remove_cuponera(self, cuponera_id: str) -> int:
+        """Borra los usos de una cuponera (reescribe el snapshot solo si tenía). Retorna cuántos borró."""
+        with self._lock():
+            self._catch_up()
+            keep = [self._record(key, n) for key, n in self._counts.items() if key[0] != cuponera_id]
+            removed = len(self._counts) - len(keep)
+            if removed:
+                self.replace(keep)
+            return removed
+
+    def has_log(self) -> bool:
+        """True si hay log (o log rotado de una compactación a medias) por volcar en el snapshot."""
+        return os.path.exists(self.log_path) or os.path.exists(self.log_path + ".1")
+
+    def compact(self):
+        """Vuelca el log en el snapshot. Rota el log antes para no perder líneas escritas durante el volcado."""
+        with self._lock():
+            if not self.has_log():
+                return  # sin log no hay nada que volcar: no se carga la tabla
+            self._catch_up()
+            if not os.path.exists(self.log_path):
+                return
+            rotated = self.log_path + ".1"
+            os.replace(self.log_path, rotated)
+            marker = uuid.uuid4().hex
+            with open(rotated, "ab") as f:
+                f.write(json.dumps({"op": "compacted", "g": marker}).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._catch_up_rotated(rotated)
+            records = [self._record(key, n) for key, n in self._counts.items()]
+            self._save_snapshot(self.snapshot_path, {"compacted": marker, "records": records})
+            os.remove(rotated)
+            self._snapshot_sig = self._snapshot_signature(self.snapshot_path)
+            self._log_offset = 0
+            self._log_lines = 0
+            logger.info("Usage log compactado: %s registros", len(self._counts))
+            # Líneas escritas por otros procesos en el log nuevo mientras tanto
+            self._catch_up()
+
+    def _catch_up_rotated(self, rotated: str):
+        """Aplica el resto del log ya rotado (líneas posteriores a la última lectura)."""
+        with open(rotated, "rb") as f:
+            f.seek(self._log_offset)
+            chunk = f.read()
+        for line in chunk.splitlines():
+            if line.strip():
+                try:
+                    self._apply(json.loads(line))
+                except (json.JSONDecodeError, AttributeError):
+                    logger.warning("Línea inválida en %s: %r", rotated, line[:200])
+
+
+class PartitionedUsage:
+    """Tabla de usos repartida en un UsageLedger por mes dentro de un directorio."""
+
+    def __init__(self, directory: str, archive_dir: str, compact_every: int, load_snapshot, save_snapshot, lock,
+                 signature=_signature):
+        """lock: fábrica lock(ruta_snapshot) de context manager reentrante por partición."""
+        self.directory = directory
+        self.archive_dir = archive_dir
+        self.compact_every = compact_every
+        self._load_snapshot = load_snapshot
+        self._save_snapshot = save_snapshot
+        self._lock = lock
+        self._snapshot_signature = signature
+        self._ledgers: dict[str, UsageLedger] = {}
+        self._guard = threading.Lock()
+
+    def _paths(self, partition: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, f"usage_{partition}")
+        return base + ".json", base + ".log"
+
+    def _new_ledger(self, partition: str) -> UsageLedger:
+        snapshot_path, log_path = self._paths(partition)
+        return UsageLedger(
+            snapshot_path,
+            log_path,
+            self.compact_every,
+            load_snapshot=self._load_snapshot,
+            save_snapshot=self._save_snapshot,
+            lock=lambda: self._lock(snapshot_path),
+            signature=self._snapshot_signature,
+        )
+
+    def ledger(self, partition: str) -> UsageLedger:
+        """Ledger residente de la partición (se carga una vez y queda en memoria)."""
+        with self._guard:
+            ledger = self._ledgers.get(partition)
+            if ledger is None:
+                ledger = self._ledgers[partition] = self._new_ledger(partition)
+            return ledger
+
+    def _scan_ledger(self, partition: str) -> UsageLedger:
+        """Ledger residente si la partición ya está cargada; si no, uno de paso que no queda en memoria."""
+        with self._guard:
+            ledger = self._ledgers.get(partition)
+        return ledger if ledger is not None else self._new_ledger(partition)
+
+    def _evict(self, partition: str):
+        with self._guard:
+            self._ledgers.pop(partition, None)
+
+    def partitions(self) -> list[str]:
+        """Particiones con archivos en disco (snapshot, snapshot binario o log), ordenadas."""
+        found = set()
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.startswith("usage_"):
+                    continue
+                for suffix in (".json", ".json.bin", ".log", ".log.1"):
+                    if name.endswith(suffix):
+                        found.add(name[len("usage_"):-len(suffix)])
+                        break
+        return sorted(found)
+
+    # --- API por clave: solo toca la partición de la fecha ---
+    def get(self, key: UsageKey) -> int:
+        return self.ledger(usage_partition(key[2])).get(key)
+
+    def increment(self, key: UsageKey) -> int:
+        return self.ledger(usage_partition(key[2])).increment(key)
+
+    def consume(self, key: UsageKey, limit: int) -> tuple[bool, int]:
+        return self.ledger(usage_partition(key[2])).consume(key, limit)
+
+    def consume_many(self, ops: list[tuple]) -> list[tuple[bool, int, bool]]:
+        """consume_many por partición (una escritura por mes presente en ops), resultados en el orden de ops."""
+        grouped: dict[str, list[int]] = {}
+        for i, op in enumerate(ops):
+            grouped.setdefault(usage_partition(op[0][2]), []).append(i)
+        results: list[tuple[bool, int, bool]] = [(False, 0, False)] * len(ops)
+        for partition, positions in grouped.items():
+            found = self.ledger(partition).consume_many([ops[i] for i in positions])
+            for i, result in zip(positions, found):
+                results[i] = result
+        return results
+
+    def reset(self, key: UsageKey) -> bool:
+        return self.ledger(usage_partition(key[2])).reset(key)
+
+    # --- Operaciones sobre varias particiones ---
+    def records(self) -> list[dict]:
+        out: list[dict] = []
+        for partition in self.partitions():
+            out.extend(self._scan_ledger(partition).records())
+        return out
+
+    def replace(self, records: list[dict]):
+        """Reemplaza toda la tabla: reescribe cada partición y vacía las que ya no tienen registros."""
+        grouped: dict[str, list[dict]] = {}
+        for rec in records:
+            grouped.setdefault(usage_partition(rec.get("date")), []).append(rec)
+        for partition in set(self.partitions()) | set(grouped):
+            self._scan_ledger(partition).replace(grouped.get(partition, []))
+
+    def merge(self, records: list[dict]):
+        """Suma registros a las particiones existentes (migración del archivo plano)."""
+        grouped: dict[str, dict[UsageKey, int]] = {}
+        for rec in records:
+            key = usage_key(rec.get("cuponera_id"), rec.get("user_code"), rec.get("date"))
+            counts = grouped.setdefault(usage_partition(key[2]), {})
+            counts[key] = counts.get(key, 0) + int(rec.get("uses_count") or 0)
+        for partition, counts in grouped.items():
+            ledger = self._scan_ledger(partition)
+            with ledger._lock():
+                for rec in ledger.records():
+                    key = usage_key(rec["cuponera_id"], rec["user_code"], rec["date"])
+                    counts[key] = counts.get(key, 0) + rec["uses_count"]
+                ledger.replace([
+                    {"cuponera_id": cid, "user_code": code, "date": d, "uses_count": n}
+                    for (cid, code, d), n in counts.items()
+                ])
+
+    def remove_cuponera(self, cuponera_id: str) -> int:
+        """
+        Borra los usos de una cuponera en todas las particiones (incluida "other") y en los meses
+        archivados; se recorren todas porque el calendario pudo cambiar desde el canje. Solo se
+        reescriben las particiones que tenían usos de la cuponera, y las que no estaban cargadas
+        se leen de paso.
+        """
+        removed = sum(self._scan_ledger(p).remove_cuponera(cuponera_id) for p in self.partitions())
+        return removed + remove_archived_cuponera(self.archive_dir, cuponera_id)
+
+    def compact(self):
+        """
+        Vuelca el log de cada partición que tenga uno (las demás no se cargan) y deja residente
+        solo la del mes actual: las otras se vuelven a cargar si algún canje las usa.
+        """
+        current = usage_partition(_date.today().isoformat())
+        for partition in self.partitions():
+            self._scan_ledger(partition).compact()
+            if partition != current:
+                self._evict(partition)
+
+    def archive_before(self, cutoff: str) -> list[str]:
+        """
+        Mueve las particiones de meses anteriores a cutoff (YYYY-MM) a archive_dir como
+        usage_YYYY-MM.json.gz (sumando a un archivo previo del mismo mes). Retorna las archivadas.
+        """
+        archived = []
+        for partition in self.partitions():
+            if partition == "other" or partition >= cutoff:
+                continue
+            ledger = self._scan_ledger(partition)
+            with ledger._lock():
+                records = ledger.records()
+                archive_path = os.path.join(self.archive_dir, f"usage_{partition}.json.gz")
+                if os.path.exists(archive_path):
+                    with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+                        records = json.load(f) + records
+                os.makedirs(self.archive_dir, exist_ok=True)
+                tmp_path = archive_path + ".tmp"
+                with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                    json.dump(records, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp_path, archive_path)
+                snapshot_path, log_path = self._paths(partition)
+                for path in (snapshot_path, snapshot_path + ".bin", log_path, log_path + ".1"):
+                    if os.path.exists(path):
+                        os.remove(path)
+            self._evict(partition)
+            archived.append(partition)
+            logger.info("Partición de usos %s archivada en %s (%s registros)", partition, archive_path, len(records))
+        return archived
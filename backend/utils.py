@@ -19,5 +19,10 @@ def new_user_code(length: int = 8) -> str:
     return "".join(random.choices(chars, k=length))
 
 
+def normalize_code(code) -> str:
+    """Código de usuario normalizado (sin espacios, en mayúsculas) para comparar."""
+    return (code or "").strip().upper()
+
+
 def now_iso() -> str:
     return datetime.utcnow().isoformat() + "Z"
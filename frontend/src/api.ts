@@ -31,15 +31,22 @@ export const api = {
       const params = siteIds?.length ? `?site_ids=${siteIds.join(',')}` : ''
       return request<Array<{ id: string; name: string }>>(`/menus/categories${params}`)
     },
-    products: (params: { site_ids: number[] | null; q?: string; limit?: number; offset?: number; ids?: string[] }) => {
+    products: (params: { site_ids: number[] | null; q?: string; limit?: number; offset?: number; cursor?: string; ids?: string[] }) => {
       const sp = new URLSearchParams()
       if (params.site_ids?.length) sp.set('site_ids', params.site_ids.join(','))
       if (params.q) sp.set('q', params.q)
       if (params.limit != null) sp.set('limit', String(params.limit))
       if (params.offset != null) sp.set('offset', String(params.offset))
+      if (params.cursor) sp.set('cursor', params.cursor)
       if (params.ids?.length) sp.set('ids', params.ids.join(','))
       const query = sp.toString()
-      return request<{ items: Array<{ id: string; name: string; category_id: string }>; total: number }>(`/menus/products${query ? `?${query}` : ''}`)
+      return request<{ items: Array<{ id: string; name: string; category_id: string }>; total: number; next_cursor: string | null }>(`/menus/products${query ? `?${query}` : ''}`)
+    },
+    /** Productos con esos ids (p. ej. los ya seleccionados, para mostrar sus nombres). */
+    productsByIds: (siteIds: number[] | null, ids: string[]) => {
+      const sp = new URLSearchParams({ ids: ids.join(','), only_ids: 'true' })
+      if (siteIds?.length) sp.set('site_ids', siteIds.join(','))
+      return request<{ items: Array<{ id: string; name: string; category_id: string }> }>(`/menus/products?${sp}`)
     },
   },
   folders: {
@@ -55,6 +62,12 @@ export const api = {
     create: (body: Record<string, unknown>) => request<Record<string, unknown>>('/discounts', { method: 'POST', body: JSON.stringify(body) }),
     update: (id: string, body: Record<string, unknown>) => request<Record<string, unknown>>(`/discounts/${id}`, { method: 'PATCH', body: JSON.stringify(body) }),
     delete: (id: string) => request<void>(`/discounts/${id}`, { method: 'DELETE' }),
+    usageInCuponeras: (id: string) =>
+      request<{
+        discount_id: string
+        in_use: boolean
+        cuponeras: Array<{ cuponera_id: string; cuponera_name: string | null; dates: string[] }>
+      }>(`/discounts/${id}/usage-in-cuponeras`),
   },
   cuponeras: {
     list: () => request<Array<Record<string, unknown>>>('/cuponeras'),
@@ -74,10 +87,11 @@ export const api = {
     delete: (cuponeraId: string, userId: string) =>
       request<void>(`/cuponeras/${cuponeraId}/users/${userId}`, { method: 'DELETE' }),
   },
-  redeem: (code: string, date?: string, recordUse = false) => {
+  redeem: (code: string, date?: string, recordUse = false, idempotencyKey?: string) => {
     const params = new URLSearchParams({ code })
     if (date) params.set('date', date)
     if (recordUse) params.set('record_use', 'true')
+    if (idempotencyKey) params.set('idempotency_key', idempotencyKey)
     return request<{
       success: boolean
       message: string